@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Department, UserProxy, GroupProxy
+from .models import Profile, Department, UserProxy, GroupProxy, ReportJob
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin, GroupAdmin as BaseGroupAdmin
 from django import forms
@@ -18,6 +18,12 @@ except admin.sites.NotRegistered:
 class DepartmentAdmin(admin.ModelAdmin):
     list_display = ['name']
 
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'requested_by', 'status', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
 # Встраивание профиля на страницу пользователя
 class ManagerChoiceField(forms.ModelChoiceField):
     def label_from_instance(self, obj):
@@ -7,7 +7,7 @@ class AccountsConfig(AppConfig):
     verbose_name = 'Профили'
     
     def ready(self):
-        from django.db.models.signals import post_save
+        from django.db.models.signals import post_save, post_delete
         from django.contrib.auth.models import User
         from .models import Profile
         
@@ -18,3 +18,25 @@ class AccountsConfig(AppConfig):
                 Profile.objects.get_or_create(user=instance)
         
         post_save.connect(create_user_profile, sender=User)
+
+        # Инвалидация кэшей отчётов и навигации: изменения проектов, задач, времени
+        # и таймеров приходят из шины событий (в том числе от других процессов)
+        from projects import bus
+        from . import navigation, report_cache
+
+        bus.subscribe(report_cache.on_change)
+        bus.subscribe(navigation.on_change)
+
+        post_save.connect(report_cache.profile_changed, sender=Profile, dispatch_uid='report_cache_Profile_save')
+        post_delete.connect(report_cache.profile_changed, sender=Profile, dispatch_uid='report_cache_Profile_delete')
+        post_save.connect(navigation.profile_changed, sender=Profile, dispatch_uid='navigation_Profile_save')
+        post_delete.connect(navigation.profile_changed, sender=Profile, dispatch_uid='navigation_Profile_delete')
+
+        # Пути иерархии подчинения при удалении профиля
+        from . import hierarchy
+        post_delete.connect(hierarchy.profile_deleted, sender=Profile, dispatch_uid='hierarchy_Profile_delete')
+
+        # Области видимости зависят от начальников и ролей всех профилей
+        from . import visibility
+        post_save.connect(visibility.profile_changed, sender=Profile, dispatch_uid='visibility_Profile_save')
+        post_delete.connect(visibility.profile_changed, sender=Profile, dispatch_uid='visibility_Profile_delete')
@@ -0,0 +1,68 @@
+import csv
+
+from django.utils import timezone
+
+from projects.models import TimeEntry
+from .reports import period_bounds
+
+# Потоковая выгрузка записей времени (CSV)
+# Строки читаются из БД порциями через .iterator() (на PostgreSQL — серверный
+# курсор) и сразу отдаются клиенту, поэтому память не зависит от объёма выгрузки.
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_HEADER = ['Сотрудник', 'Отдел', 'Проект', 'Задача', 'Начало', 'Окончание', 'Секунды']
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи"""
+    def write(self, value):
+        return value
+
+
+def time_entries_for_export(start_date=None, end_date=None, department_id=None):
+    # Записи, пересекающиеся с периодом (без обрезки — это сырые данные)
+    start, end = period_bounds(start_date, end_date)
+    entries = TimeEntry.objects.all()
+    if start:
+        entries = entries.filter(ended_at__gt=start)
+    if end:
+        entries = entries.filter(started_at__lt=end)
+    if department_id:
+        entries = entries.filter(user__profile__department_id=department_id)
+    return entries.order_by('started_at', 'id').values_list(
+        'user__last_name', 'user__first_name', 'user__profile__surname',
+        'user__profile__department__name', 'project__title', 'task__text',
+        'started_at', 'ended_at', 'seconds',
+    )
+
+
+# Ячейки, которые Excel/LibreOffice считают формулой (CSV injection)
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _safe_cell(value):
+    # Текст, введённый пользователями, экранируется апострофом: он виден как есть
+    return "'" + value if value.startswith(_FORMULA_PREFIXES) else value
+
+
+def _format_dt(value):
+    return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def stream_time_entries_csv(entries):
+    """Генератор строк CSV (разделитель «;» — его ожидает Excel с русской локалью)"""
+    writer = csv.writer(Echo(), delimiter=';')
+    # BOM, чтобы Excel распознал UTF-8
+    yield '\ufeff' + writer.writerow(EXPORT_HEADER)
+    for (last_name, first_name, surname, department, project, task,
+         started_at, ended_at, seconds) in entries.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow([
+            _safe_cell(' '.join(part for part in (last_name, first_name, surname) if part)),
+            _safe_cell(department or ''),
+            _safe_cell(project),
+            _safe_cell(task or ''),
+            _format_dt(started_at),
+            _format_dt(ended_at),
+            seconds,
+        ])
@@ -0,0 +1,93 @@
+from django.db.models import Case, Value, When
+from django.db.models.functions import Concat, Substr
+
+from .models import Profile
+
+# Иерархия подчинения (Profile.manager) в виде материализованного пути
+# Profile.path — '/id корня/.../id профиля/'. Всё поддерево сотрудника любой
+# глубины выбирается одним запросом path LIKE 'путь%' по индексу, а проверка
+# «начальник ли» — сравнение путей без запросов.
+# Путь пересчитывается в Profile.save (вместе с путями подчинённых — одним
+# UPDATE) и при удалении профиля. Загрузка фикстур (loaddata) сохраняет
+# профили в обход save, поэтому после неё пути перестраиваются командой
+# rebuild_profile_paths.
+
+
+def descendants(profile, include_self=False):
+    """Все подчинённые профиля на любой глубине (один запрос)"""
+    profiles = Profile.objects.filter(path__startswith=profile.path)
+    return profiles if include_self else profiles.exclude(pk=profile.pk)
+
+
+def is_ancestor(ancestor, profile):
+    """Является ли ancestor начальником profile (на любом уровне)"""
+    return bool(ancestor.path) and ancestor.pk != profile.pk and profile.path.startswith(ancestor.path)
+
+
+def _stored_paths(profile):
+    # Пути профиля и его начальника из базы (экземпляр мог устареть)
+    ids = [pk for pk in (profile.pk, profile.manager_id) if pk]
+    paths = dict(Profile.objects.filter(pk__in=ids).values_list('pk', 'path')) if ids else {}
+    return paths.get(profile.pk, ''), paths.get(profile.manager_id, '')
+
+
+def creates_cycle(profile):
+    """Назначенный начальник — сам сотрудник или его подчинённый"""
+    if not profile.pk or not profile.manager_id:
+        return False
+    own_path, manager_path = _stored_paths(profile)
+    return profile.manager_id == profile.pk or bool(own_path) and manager_path.startswith(own_path)
+
+
+def save_path(profile, save):
+    """
+    Сохраняет профиль (save — исходный Model.save) и обновляет пути профиля
+    и всех его подчинённых
+    """
+    old_path, manager_path = _stored_paths(profile)
+    # Не затираем путь, изменённый после загрузки экземпляра
+    profile.path = old_path
+    save()
+    new_path = f'{manager_path or "/"}{profile.pk}/'
+    if new_path == old_path:
+        return
+    Profile.objects.filter(pk=profile.pk).update(path=new_path)
+    if old_path:
+        Profile.objects.filter(path__startswith=old_path).exclude(pk=profile.pk).update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1)))
+    profile.path = new_path
+
+
+def profile_deleted(sender, instance, **kwargs):
+    # Непосредственные подчинённые остаются без начальника (SET_NULL) и
+    # становятся корнями: из путей поддерева убирается префикс удалённого
+    if not instance.path:
+        return
+    Profile.objects.filter(path__startswith=instance.path).update(path=Substr('path', len(instance.path)))
+
+
+def compute_paths(managers):
+    """Пути по словарю {id профиля: id начальника}; циклы разрываются на месте"""
+    paths = {}
+    for profile_id in managers:
+        chain = []
+        current = profile_id
+        while current is not None and current not in paths and current not in chain:
+            chain.append(current)
+            current = managers.get(current)
+        prefix = paths.get(current, '/')
+        for member in reversed(chain):
+            prefix = paths[member] = f'{prefix}{member}/'
+    return paths
+
+
+def rebuild(batch_size=1000):
+    """Перестраивает пути всех профилей; возвращает число изменённых"""
+    rows = list(Profile.objects.values_list('pk', 'manager_id', 'path'))
+    paths = compute_paths({pk: manager_id for pk, manager_id, _ in rows})
+    changed = [(pk, paths[pk]) for pk, _, path in rows if paths[pk] != path]
+    for index in range(0, len(changed), batch_size):
+        chunk = changed[index:index + batch_size]
+        Profile.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            path=Case(*[When(pk=pk, then=Value(path)) for pk, path in chunk]))
+    return len(changed)
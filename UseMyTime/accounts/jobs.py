@@ -0,0 +1,95 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ReportJob
+from .report_cache import render_report_pdf
+
+logger = logging.getLogger(__name__)
+
+
+# Фоновое формирование PDF-отчётов
+# Веб-процесс только ставит задание в очередь, рендер выполняет
+# отдельный процесс: python manage.py process_report_jobs
+# Захват задания — аренда на REPORT_JOB_LEASE_MINUTES от started_at: если
+# обработчик упал, не закончив, задание по истечении аренды снова попадает
+# в очередь (или помечается ошибкой после REPORT_JOB_MAX_ATTEMPTS попыток).
+
+def enqueue_report_job(request, kind, params):
+    """Создаёт задание на формирование PDF для текущего пользователя"""
+    # Гарантируем наличие session_key для штампа ПЭП
+    if not request.session.session_key:
+        request.session.save()
+    return ReportJob.objects.create(
+        requested_by=request.user,
+        kind=kind,
+        params=params,
+        session_key=request.session.session_key,
+        base_url=request.build_absolute_uri('/'),
+    )
+
+
+def reclaim_stale_jobs(now=None):
+    """
+    Возвращает в очередь задания с истёкшей арендой; исчерпавшие попытки
+    помечаются ошибкой. Возвращает (возвращено, отклонено).
+    """
+    now = now or timezone.now()
+    stale = ReportJob.objects.filter(
+        status='running', started_at__lt=now - timedelta(minutes=settings.REPORT_JOB_LEASE_MINUTES))
+    failed = stale.filter(attempts__gte=settings.REPORT_JOB_MAX_ATTEMPTS).update(
+        status='failed', error='Превышено время формирования отчёта', finished_at=now)
+    requeued = stale.update(status='pending', started_at=None)
+    for count, state in ((requeued, 'возвращено в очередь'), (failed, 'отклонено')):
+        if count:
+            logger.warning('Задания на отчёты с истёкшей арендой: %s %s', state, count)
+    return requeued, failed
+
+
+def claim_next_job():
+    """
+    Забирает самое старое задание из очереди.
+    Захват — условный UPDATE, поэтому несколько воркеров не возьмут одно задание.
+    """
+    reclaim_stale_jobs()
+    candidates = (
+        ReportJob.objects
+        .filter(status='pending')
+        .order_by('created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = ReportJob.objects.filter(id=job_id, status='pending').update(
+            status='running', started_at=timezone.now(), attempts=F('attempts') + 1)
+        if claimed:
+            return ReportJob.objects.select_related('requested_by__profile').get(id=job_id)
+    return None
+
+
+def run_report_job(job):
+    """Формирует PDF по заданию и сохраняет файл"""
+    try:
+        result, filename = render_report_pdf(
+            job.kind, job.requested_by.profile, job.params, job.session_key, job.base_url)
+        job.file.save(f'report_{job.pk}.pdf', ContentFile(result), save=False)
+        job.filename = filename
+        job.status = 'done'
+    except Exception as e:
+        logger.exception('Ошибка формирования отчёта #%s', job.pk)
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    # Пока формировался отчёт, аренда могла истечь и задание — перейти к другому
+    # обработчику: результат записывается, только если аренда всё ещё наша
+    saved = ReportJob.objects.filter(pk=job.pk, status='running', started_at=job.started_at).update(
+        file=job.file.name or '', filename=job.filename, status=job.status, error=job.error,
+        finished_at=job.finished_at)
+    if not saved:
+        logger.warning('Аренда задания #%s истекла, результат отброшен', job.pk)
+        if job.file:
+            job.file.delete(save=False)
+    return job
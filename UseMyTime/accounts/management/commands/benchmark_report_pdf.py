@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from weasyprint import HTML
+
+from accounts.models import Profile
+from accounts.report_cache import SIGNATURE_PLACEHOLDER, pdf_options
+from accounts.rendering import render_pdf
+from accounts.reports import build_report
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время рендеринга и размер PDF-отчёта: обычный WeasyPrint и «прогретый» рендерер'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Автор отчёта (директор или начальник)')
+        parser.add_argument('--department', type=int, help='ID отдела (отчёт по отделу)')
+        parser.add_argument('--employee', type=int, help='ID профиля сотрудника (отчёт по сотруднику)')
+        parser.add_argument('--repeat', type=int, default=3, help='Число повторов каждого варианта')
+        parser.add_argument('--base-url', default='http://localhost:8000/',
+                            help='base_url документа; без оптимизаций static загружается по этому адресу')
+
+    def handle(self, *args, **options):
+        try:
+            author = Profile.objects.select_related('user').get(user__username=options['username'])
+        except Profile.DoesNotExist:
+            raise CommandError(f"Пользователь {options['username']} не найден")
+
+        if options['employee']:
+            kind, params = 'employee', {'employee_id': options['employee']}
+        else:
+            kind, params = 'team', {'department_id': options['department']} if options['department'] else {}
+
+        template_name, context, _ = build_report(kind, author, params, None)
+        context['signature_hash'] = SIGNATURE_PLACEHOLDER
+        html = render_to_string(template_name, context)
+        base_url = options['base_url']
+        render_options = pdf_options(kind, params)
+
+        variants = (
+            ('до (HTML.write_pdf)', lambda: HTML(string=html, base_url=base_url).write_pdf()),
+            ('после (render_pdf)', lambda: render_pdf(html, base_url, render_options)),
+        )
+        for title, render in variants:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                pdf = render()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'{title}: первый {timings[0]:.2f} с, лучший {min(timings):.2f} с, '
+                f'размер {len(pdf) / 1024:.1f} КБ'
+            )
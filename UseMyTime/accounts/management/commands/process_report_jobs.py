@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.jobs import claim_next_job, run_report_job
+from projects import bus
+
+
+class Command(BaseCommand):
+    help = 'Формирует PDF-отчёты из очереди заданий (запускается отдельным процессом)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать текущую очередь и завершиться')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Пауза между опросами пустой очереди, сек.')
+
+    def handle(self, *args, **options):
+        # Изменения из веб-процессов сбрасывают кэши отчётов и в этом процессе
+        bus.start()
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job:
+                run_report_job(job)
+                self.stdout.write(f'{job}: {job.get_status_display()}')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts import visibility
+from accounts.hierarchy import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает пути иерархии подчинения профилей (например, после loaddata)'
+
+    def handle(self, *args, **options):
+        changed = rebuild()
+        if changed:
+            # Пути меняются в обход save: закэшированные области видимости устарели
+            visibility.bump_version()
+        self.stdout.write(f'Обновлено путей: {changed}')
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    # Пути иерархии подчинения для существующих профилей (циклы разрываются)
+    Profile = apps.get_model('accounts', 'Profile')
+    managers = dict(Profile.objects.values_list('pk', 'manager_id'))
+    paths = {}
+    for profile_id in managers:
+        chain = []
+        current = profile_id
+        while current is not None and current not in paths and current not in chain:
+            chain.append(current)
+            current = managers.get(current)
+        prefix = paths.get(current, '/')
+        for member in reversed(chain):
+            prefix = paths[member] = f'{prefix}{member}/'
+    profiles = [Profile(pk=profile_id, path=path) for profile_id, path in paths.items()]
+    Profile.objects.bulk_update(profiles, ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Путь в иерархии'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['path'], name='profile_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
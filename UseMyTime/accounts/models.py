@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User as DjangoUser, Group as DjangoGroup
 
 # Роли пользователей в системе
@@ -36,12 +37,49 @@ class Profile(models.Model):
     # Добавлено поле для связи: кто начальник у этого сотрудника
     manager = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True,  null=True, related_name='subordinates',
                                 verbose_name="Начальник")
+    # Путь в иерархии подчинения '/id корня/.../id/' (accounts.hierarchy)
+    path = models.CharField('Путь в иерархии', max_length=255, blank=True, default='', editable=False)
+
     def __str__(self):
         return f'Profile of {self.user.username}'
+
+    def clean(self):
+        from .hierarchy import creates_cycle
+        if creates_cycle(self):
+            raise ValidationError({'manager': 'Подчинённый не может быть назначен начальником'})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Начальник на момент загрузки: по нему save понимает, менялась ли иерархия
+        instance._loaded_manager_id = instance.__dict__.get('manager_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .hierarchy import creates_cycle, save_path
+        if self.pk and self.path and self.manager_id == getattr(self, '_loaded_manager_id', False):
+            # Начальник не менялся: без проверки цикла и пересчёта путей.
+            # Путь не сохраняем — он мог измениться в базе после загрузки
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [field.name for field in self._meta.concrete_fields
+                                 if not field.primary_key and field.attname not in deferred]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'path']
+            super().save(*args, **kwargs)
+            return
+        if creates_cycle(self):
+            raise ValueError('Подчинённый не может быть назначен начальником')
+        save_path(self, lambda: super(Profile, self).save(*args, **kwargs))
+        self._loaded_manager_id = self.manager_id
     
     class Meta:
         verbose_name = 'Профиль'
         verbose_name_plural = 'Профили'
+        indexes = [
+            # Поддерево — выборка по префиксу пути (LIKE 'путь%')
+            models.Index(fields=['path'], name='profile_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
 # Прокси-модель пользователя для отображения в административной части
 # Позволяет настроить интерфейс администрирования отдельно от стандартного User
@@ -59,4 +97,44 @@ class GroupProxy(DjangoGroup):
         proxy = True
         app_label = 'accounts'
         verbose_name = 'Отдел'
-        verbose_name_plural = 'Отделы'
\ No newline at end of file
+        verbose_name_plural = 'Отделы'
+
+# Задание на формирование PDF-отчёта
+# PDF рендерится отдельным процессом (manage.py process_report_jobs),
+# а страница отчёта опрашивает статус задания
+class ReportJob(models.Model):
+    KIND_CHOICES = (
+        ('team', 'Отчёт по отделу/компании'),
+        ('employee', 'Отчёт по сотруднику'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'В очереди'),
+        ('running', 'Формируется'),
+        ('done', 'Готов'),
+        ('failed', 'Ошибка'),
+    )
+
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                     related_name='report_jobs', verbose_name='Кто запросил')
+    kind = models.CharField('Тип отчёта', max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    session_key = models.CharField('Сессия (для штампа ПЭП)', max_length=40, blank=True)
+    base_url = models.CharField('Базовый URL', max_length=255, blank=True)
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField('Файл', upload_to='reports/%Y/%m/%d/', blank=True)
+    filename = models.CharField('Имя файла', max_length=255, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    started_at = models.DateTimeField('Начало формирования', null=True, blank=True)
+    finished_at = models.DateTimeField('Окончание формирования', null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток формирования', default=0)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.pk} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Задание на отчёт'
+        verbose_name_plural = 'Задания на отчёты'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='reportjob_status_created_idx'),
+        ]
@@ -0,0 +1,169 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from projects import timers
+from projects.models import Project
+from .models import Profile
+
+# Данные навигации (шапка и меню base.html) для context processor
+# Значения считаются по требованию и хранятся в кэше отдельной записью на
+# пользователя. Запись сбрасывается при изменении таймеров, проектов
+# (проверка, архив, общее время) и профилей; TTL ограничивает устаревание
+# в редких случаях, которые сигналы не покрывают (смена начальника).
+# В кэше только простые значения (числа, строки, словари из них), а не
+# экземпляры моделей: запись мала и не зависит от изменений моделей.
+# Сброс меняет версию пользователя (как в visibility), а запись помнит версию,
+# при которой её начали считать: запрос, дописавший запись после сброса,
+# сохраняет её со старой версией, и следующий запрос её не примет.
+
+
+def _cache_key(user_id):
+    # v2 — записи из простых значений; старые записи с моделями не читаются
+    return f'nav:v2:user:{user_id}'
+
+
+def _version_key(user_id):
+    return f'nav:ver:user:{user_id}'
+
+
+def invalidate(*user_ids):
+    """Сбрасывает закэшированную навигацию пользователей"""
+    version = time.time_ns()
+    cache.set_many({_version_key(user_id): version for user_id in user_ids if user_id}, None)
+
+
+def _user_profile(user):
+    # Получаем или создаем профиль, если его нет
+    profile, _ = Profile.objects.get_or_create(user=user)
+    return {
+        'id': profile.pk,
+        'role': profile.role,
+        'surname': profile.surname,
+        'photo_url': profile.photo.url if profile.photo else '',
+    }
+
+
+def _project_info(project, started_at, in_work):
+    return {
+        'project_id': project.pk,
+        'project_title': project.title,
+        'base_seconds': int(project.total_time.total_seconds()),
+        'started_at_epoch': int(started_at.timestamp()) if in_work and started_at else None,
+        'in_work': in_work,
+    }
+
+
+def _active_project_info(user):
+    # Данные для глобального таймера: запущенный таймер, иначе активный проект
+    timer = timers.state(user).header
+    if timer is None:
+        return None
+    return _project_info(timer.project, timer.last_started_at, timer.in_work)
+
+
+def _review_queue_count(user, profile):
+    # Счетчик проектов на проверке для руководителей (проекты непосредственных подчиненных)
+    if profile['role'] not in ('manager', 'sector_manager', 'director'):
+        return 0
+    return Project.objects.filter(user__profile__manager_id=profile['id'], review_status='in_review').count()
+
+
+def _attention_projects_count(user):
+    # Счетчик проектов, требующих внимания (возвращенные с проверки)
+    return Project.objects.filter(user=user, review_status='rejected', is_archived=False).count()
+
+
+_FALLBACKS = {
+    'user_profile': None,
+    'active_project_info': None,
+    'review_queue_count': 0,
+    'attention_projects_count': 0,
+}
+
+
+class Navigation:
+    """Ленивые значения навигации одного запроса поверх записи в кэше"""
+
+    def __init__(self, user):
+        self.user = user
+        self._values = None
+        self._version = None
+
+    def _load(self):
+        key, version_key = _cache_key(self.user.pk), _version_key(self.user.pk)
+        cached = cache.get_many([version_key, key])
+        self._version = cached.get(version_key)
+        entry = cached.get(key)
+        if self._version is not None and entry is not None and entry['version'] == self._version:
+            return entry['values']
+        if self._version is None:
+            self._version = time.time_ns()
+            cache.add(version_key, self._version, None)
+            self._version = cache.get(version_key, self._version)
+        return {}
+
+    def _compute(self, name):
+        if name == 'user_profile':
+            return _user_profile(self.user)
+        if name == 'active_project_info':
+            return _active_project_info(self.user)
+        if name == 'review_queue_count':
+            return _review_queue_count(self.user, self.get('user_profile'))
+        return _attention_projects_count(self.user)
+
+    def get(self, name):
+        if self._values is None:
+            self._values = self._load()
+        if name not in self._values:
+            try:
+                self._values[name] = self._compute(name)
+            except Exception:
+                # Навигация не должна ломать страницу
+                return _FALLBACKS[name]
+            cache.set(_cache_key(self.user.pk), {'version': self._version, 'values': self._values},
+                      settings.NAVIGATION_CACHE_TIMEOUT)
+        return self._values[name]
+
+
+def timer_state_key(active_project_info):
+    """Ключ состояния таймера: по нему страница понимает, что таймер сменился"""
+    if not active_project_info:
+        return ''
+    return f"{active_project_info['project_id']}:{active_project_info['started_at_epoch'] or ''}"
+
+
+def watched_users(user):
+    """Пользователи, чьи изменения влияют на навигацию: сам пользователь и его подчинённые"""
+    return {user.pk} | set(Profile.objects.filter(manager__user=user).values_list('user_id', flat=True))
+
+
+def live_state(user):
+    """Состояние для потока событий: счётчик очереди проверки и таймер"""
+    navigation = Navigation(user)
+    return {
+        'review_count': navigation.get('review_queue_count'),
+        'timer': timer_state_key(navigation.get('active_project_info')),
+    }
+
+
+# Обработчики сигналов
+
+def profile_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    manager_user_id = None
+    if instance.manager_id:
+        manager_user_id = Profile.objects.filter(pk=instance.manager_id).values_list('user_id', flat=True).first()
+    invalidate(instance.user_id, manager_user_id)
+
+
+def on_change(event):
+    """Подписчик шины событий: таймеры и проекты"""
+    if event['model'] == 'projecttimer':
+        invalidate(event['user'])
+    elif event['model'] == 'project':
+        # Статус проверки виден владельцу и его начальнику, общее время — в таймере владельца
+        manager_user_ids = Profile.objects.filter(subordinates__user_id=event['user']).values_list('user_id', flat=True)
+        invalidate(event['user'], *manager_user_ids)
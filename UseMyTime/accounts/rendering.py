@@ -0,0 +1,168 @@
+import mimetypes
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+from urllib.parse import unquote, urlsplit
+
+from pypdf import PdfReader, PdfWriter
+from weasyprint import CSS, HTML, default_url_fetcher # Библиотека для формирования отчетов
+from weasyprint.text.fonts import FontConfiguration
+
+
+# Рендеринг PDF-отчётов (WeasyPrint)
+# Модуль не импортирует Django, поэтому функции можно вызывать в дочерних процессах.
+# Состояние «прогревается» один раз на процесс: конфигурация шрифтов, разобранные
+# стили отчётов и кэш изображений переиспользуются между отчётами.
+#
+# options — словарь с настройками рендеринга (передаётся и в дочерние процессы):
+#   stylesheets  — пути к CSS отчёта; они разбираются заранее, а ссылки на них
+#                  в документе не загружаются повторно;
+#   locations    — [(URL-префикс, [каталоги])], например ('/static/', [...]):
+#                  такие адреса читаются с диска, а не по HTTP через base_url;
+#   write        — параметры write_pdf (optimize_images, jpeg_quality, dpi).
+
+# Предел кэша изображений (байт данных изображений). WeasyPrint связывает
+# записи кэша между собой (изображение по URL ссылается на свои данные), поэтому
+# при превышении кэш очищается целиком и только когда ни один рендер не идёт.
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_font_config = None
+_stylesheets = {}
+_image_cache = {}
+_image_cache_lock = threading.Lock()
+_active_renders = 0
+_executor = None
+
+
+def font_config():
+    """Общая конфигурация шрифтов процесса"""
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def stylesheet(path):
+    """Разобранный CSS; разбирается заново только при изменении файла"""
+    mtime = os.path.getmtime(path)
+    cached = _stylesheets.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, CSS(filename=path, font_config=font_config()))
+        _stylesheets[path] = cached
+    return cached[1]
+
+
+def _local_path(url, base_url, locations):
+    # Адрес вида {base_url}static/... -> файл в одном из каталогов
+    if not url.startswith(base_url):
+        return None
+    path = unquote(urlsplit(url).path)
+    for prefix, roots in locations:
+        if not path.startswith(prefix):
+            continue
+        relative = path[len(prefix):]
+        for root in roots:
+            root = os.path.realpath(root)
+            candidate = os.path.realpath(os.path.join(root, relative))
+            # Не выпускаем запрос за пределы каталога (../)
+            if candidate.startswith(root + os.sep) and os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def local_url_fetcher(base_url, locations, preparsed=()):
+    """url_fetcher для WeasyPrint: static и media читаются с диска"""
+    preparsed = {os.path.realpath(path) for path in preparsed}
+
+    def fetcher(url, *args, **kwargs):
+        path = _local_path(url, base_url, locations)
+        if path is None:
+            return default_url_fetcher(url, *args, **kwargs)
+        if path in preparsed:
+            # Стиль уже передан разобранным в stylesheets
+            return {'string': b'', 'mime_type': 'text/css', 'redirected_url': url}
+        with open(path, 'rb') as f:
+            return {
+                'string': f.read(),
+                'mime_type': mimetypes.guess_type(path)[0],
+                'redirected_url': url,
+            }
+
+    return fetcher
+
+
+def _image_cache_size():
+    return sum(len(value) for value in _image_cache.values() if isinstance(value, bytes))
+
+
+def render_pdf(html_string, base_url, options=None):
+    """Преобразует HTML отчёта в PDF и возвращает байты"""
+    global _active_renders
+    options = options or {}
+    paths = options.get('stylesheets', [])
+    html = HTML(
+        string=html_string,
+        base_url=base_url,
+        url_fetcher=local_url_fetcher(base_url, options.get('locations', []), paths),
+    )
+    with _image_cache_lock:
+        _active_renders += 1
+    try:
+        return html.write_pdf(
+            stylesheets=[stylesheet(path) for path in paths],
+            font_config=font_config(),
+            cache=_image_cache,
+            **options.get('write', {}),
+        )
+    finally:
+        with _image_cache_lock:
+            _active_renders -= 1
+            if not _active_renders and _image_cache_size() > IMAGE_CACHE_MAX_BYTES:
+                _image_cache.clear()
+
+
+def merge_pdfs(documents, titles=None):
+    """
+    Склеивает PDF в один документ в исходном порядке.
+    titles — закладки на первую страницу каждой части (None — без закладки).
+    """
+    writer = PdfWriter()
+    titles = titles or []
+    for index, document in enumerate(documents):
+        first_page = len(writer.pages)
+        writer.append(PdfReader(BytesIO(document)))
+        title = titles[index] if index < len(titles) else None
+        if title:
+            writer.add_outline_item(title, first_page)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def _pool(workers):
+    # Пул живёт всё время процесса, чтобы дочерние процессы оставались «прогретыми».
+    # Процессы не ответвляются (fork) от рабочего процесса: к моменту первого
+    # отчёта в нём уже идут потоки (шина событий, сервер), и fork унаследовал бы
+    # их захваченные блокировки. forkserver/spawn запускают чистый интерпретатор
+    global _executor
+    if _executor is None:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _executor
+
+
+def render_pdf_parts(html_parts, base_url, workers, titles=None, options=None):
+    """
+    Рендерит части отчёта в пуле процессов и склеивает их.
+    Вёрстка WeasyPrint однопоточная и растёт быстрее числа страниц,
+    поэтому несколько небольших документов на разных ядрах быстрее одного большого.
+    """
+    if workers <= 1 or len(html_parts) <= 1:
+        documents = [render_pdf(html, base_url, options) for html in html_parts]
+    else:
+        documents = list(_pool(workers).map(render_pdf, html_parts, repeat(base_url), repeat(options)))
+    return merge_pdfs(documents, titles)
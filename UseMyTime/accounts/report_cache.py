@@ -0,0 +1,255 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Department, Profile
+from .rendering import render_pdf, render_pdf_parts
+from .reports import (
+    REPORT_STYLESHEETS, build_company_report_stream, build_report, department_totals,
+    report_template, signature_context, split_seconds, team_for,
+)
+
+# Кэш готовых отчётов (HTML/PDF)
+# Ключ: тип и область отчёта (отдел, сотрудник, компания), автор, период, формат
+# и «версия данных» всех сотрудников области. Версия сотрудника меняется при
+# изменении его TimeEntry, задач и проектов, поэтому устаревший отчёт просто
+# перестаёт находиться по ключу.
+# Штамп ПЭП зависит от сессии зрителя, поэтому в HTML кэшируется тело с
+# заглушкой вместо хэша подписи, а хэш подставляется уже после кэша.
+
+SIGNATURE_PLACEHOLDER = '__REPORT_SIGNATURE_HASH__'
+
+PROFILES_VERSION_KEY = 'report:ver:profiles'
+
+# Место в документе отчёта по компании, куда выводятся отделы при потоковой выдаче
+STREAM_SECTIONS_MARKER = '<!-- report-sections -->'
+
+
+def _user_version_key(user_id):
+    return f'report:ver:user:{user_id}'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def bump_user_version(user_id):
+    """Инвалидирует отчёты, в которые входит пользователь"""
+    cache.set(_user_version_key(user_id), _new_version(), None)
+
+
+def bump_profiles_version():
+    """Инвалидирует все отчёты (изменился состав отделов/подчинённых)"""
+    cache.set(PROFILES_VERSION_KEY, _new_version(), None)
+
+
+def _versions(keys):
+    # Отсутствующие версии (новый сотрудник, вытеснение из кэша) заводим заново,
+    # чтобы они не совпали ни с одной из прошлых
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def _scope(kind, author, params):
+    # Описание области отчёта и список пользователей в ней
+    if kind == 'employee':
+        user_ids = list(Profile.objects.filter(pk=params['employee_id']).values_list('user_id', flat=True))
+        return f"employee:{params['employee_id']}", user_ids
+    department = None
+    if params.get('department_id'):
+        department = Department(pk=params['department_id'])
+        scope = f"department:{params['department_id']}"
+    elif author.role == 'director':
+        scope = 'company'
+    else:
+        scope = f'team:{author.pk}'
+    user_ids = list(team_for(author, department).order_by('user_id').values_list('user_id', flat=True))
+    return scope, user_ids
+
+
+def report_cache_key(kind, author, params, fmt, now_dt, extra=''):
+    scope, user_ids = _scope(kind, author, params)
+    return _versioned_key(fmt, scope, user_ids, author, params, now_dt, extra)
+
+
+def _versioned_key(fmt, scope, user_ids, author, params, now_dt, extra=''):
+    keys = [PROFILES_VERSION_KEY] + [_user_version_key(user_id) for user_id in user_ids]
+    digest = hashlib.md5(
+        '|'.join(str(version) for version in _versions(keys)).encode('utf-8')
+    ).hexdigest()
+    period = f"{params.get('start_date', '')}:{params.get('end_date', '')}"
+    return f"report:{fmt}:{scope}:{author.pk}:{period}:{now_dt.strftime('%Y%m%d')}:{extra}:{digest}"
+
+
+def cached_report_body(kind, author, params, now_dt=None):
+    """
+    HTML отчёта без штампа ПЭП.
+    Возвращает (body, filename); при промахе кэша отчёт строится заново.
+    """
+    now_dt = now_dt or timezone.now()
+    key = report_cache_key(kind, author, params, 'html', now_dt)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    template_name, context, filename = build_report(kind, author, params, None, now_dt)
+    context['signature_hash'] = SIGNATURE_PLACEHOLDER
+    cached = (render_to_string(template_name, context), filename)
+    cache.set(key, cached, settings.REPORT_CACHE_TIMEOUT)
+    return cached
+
+
+def is_company_report(kind, params):
+    """Отчёт по компании (без отдела) — его можно рендерить по частям"""
+    return kind == 'team' and not params.get('department_id')
+
+
+def cached_report_parts(kind, author, params, now_dt=None):
+    """
+    HTML отчёта по компании по частям без штампа ПЭП: по документу на отдел
+    и итоговая часть с подписью. Возвращает (parts, titles, filename),
+    titles — закладки частей в склеенном PDF.
+    """
+    now_dt = now_dt or timezone.now()
+    key = report_cache_key(kind, author, params, 'html-parts', now_dt)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    template_name, context, filename = build_report(kind, author, params, None, now_dt)
+    context['signature_hash'] = SIGNATURE_PLACEHOLDER
+    parts, titles = [], []
+    for index, section in enumerate(context['department_totals']):
+        parts.append(render_to_string(template_name, {**context, 'part': 'section', 'part_index': index, 'section': section}))
+        titles.append(f"Отдел: {section['name']}")
+    parts.append(render_to_string(template_name, {**context, 'part': 'summary', 'part_index': len(parts)}))
+    titles.append('Общий итог')
+    cached = (parts, titles, filename)
+    cache.set(key, cached, settings.REPORT_CACHE_TIMEOUT)
+    return cached
+
+
+def stream_company_report(author, params, session_id, now_dt=None):
+    """
+    HTML отчёта по компании частями: шапка, отделы по одному, итог с подписью.
+    Пиковая память ограничена данными одного отдела. Каждый отдел кэшируется
+    отдельно по версиям своих сотрудников: изменение данных одного отдела
+    не заставляет пересобирать остальные, а целиком отчёт в памяти не собирается.
+    """
+    now_dt = now_dt or timezone.now()
+    template_name, context, departments, _ = build_company_report_stream(author, params, None, now_dt)
+    context.update({'signature_hash': SIGNATURE_PLACEHOLDER, 'part': 'stream', 'part_index': 0})
+    yield render_to_string(template_name, context).split(STREAM_SECTIONS_MARKER)[0]
+
+    tasks = seconds = count = 0
+    for scope, team in departments:
+        user_ids = list(team.order_by('user_id').values_list('user_id', flat=True))
+        key = _versioned_key('html-section', scope, user_ids, author, params, now_dt)
+        section = cache.get(key)
+        if section is None:
+            totals = department_totals(team, context['start_date'], context['end_date'])
+            section = (
+                ''.join(
+                    render_to_string('accounts/company_report_department.html', {**context, 'dept_total': dept_total})
+                    for dept_total in totals
+                ),
+                sum(dept_total['tasks'] for dept_total in totals),
+                sum(dept_total['total_seconds'] for dept_total in totals),
+                len(totals),
+            )
+            cache.set(key, section, settings.REPORT_CACHE_TIMEOUT)
+        tasks += section[1]
+        seconds += section[2]
+        count += section[3]
+        yield section[0]
+
+    hours, minutes, _ = split_seconds(seconds)
+    context.update({
+        'dept_total_tasks': tasks,
+        'dept_total_hours': hours,
+        'dept_total_minutes': minutes,
+        'department_count': count,
+    })
+    tail = render_to_string(template_name, context).split(STREAM_SECTIONS_MARKER)[1]
+    yield stamp_report(tail, session_id, now_dt)
+
+
+def stamp_report(body, session_id, now_dt=None):
+    """Подставляет штамп ПЭП зрителя в закэшированное тело отчёта"""
+    now_dt = now_dt or timezone.now()
+    return body.replace(SIGNATURE_PLACEHOLDER, signature_context(session_id, now_dt)['signature_hash'])
+
+
+def pdf_options(kind, params):
+    """
+    Настройки рендеринга PDF: разобранный заранее стиль отчёта,
+    чтение static/media с диска и сжатие изображений
+    """
+    stylesheet = REPORT_STYLESHEETS[report_template(kind, params)]
+    stylesheet_path = finders.find(stylesheet) or os.path.join(settings.STATIC_ROOT, stylesheet)
+    return {
+        'stylesheets': [stylesheet_path] if os.path.isfile(stylesheet_path) else [],
+        'locations': [
+            (settings.STATIC_URL, [str(path) for path in settings.STATICFILES_DIRS] + [str(settings.STATIC_ROOT)]),
+            (settings.MEDIA_URL, [str(settings.MEDIA_ROOT)]),
+        ],
+        'write': {
+            'optimize_images': True,
+            'jpeg_quality': settings.REPORT_PDF_JPEG_QUALITY,
+            'dpi': settings.REPORT_PDF_DPI,
+        },
+    }
+
+
+def _pdf_cache_key(kind, author, params, session_id, now_dt):
+    # В PDF штамп уже «впечатан», поэтому ключ включает хэш подписи зрителя
+    signature_hash = signature_context(session_id, now_dt)['signature_hash']
+    return report_cache_key(kind, author, params, 'pdf', now_dt, extra=signature_hash)
+
+
+def cached_report_pdf(kind, author, params, session_id):
+    """Готовый PDF из кэша: (pdf, filename) или None"""
+    return cache.get(_pdf_cache_key(kind, author, params, session_id, timezone.now()))
+
+
+def render_report_pdf(kind, author, params, session_id, base_url):
+    """PDF отчёта: тело берётся из кэша HTML, результат кэшируется. Возвращает (pdf, filename)"""
+    now_dt = timezone.now()
+    key = _pdf_cache_key(kind, author, params, session_id, now_dt)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    options = pdf_options(kind, params)
+    if settings.REPORT_PDF_WORKERS > 1 and is_company_report(kind, params):
+        # Каждый отдел — отдельный документ в своём процессе, затем склейка
+        parts, titles, filename = cached_report_parts(kind, author, params, now_dt)
+        parts = [stamp_report(part, session_id, now_dt) for part in parts]
+        pdf = render_pdf_parts(parts, base_url, settings.REPORT_PDF_WORKERS, titles, options)
+    else:
+        body, filename = cached_report_body(kind, author, params, now_dt)
+        pdf = render_pdf(stamp_report(body, session_id, now_dt), base_url, options)
+    cached = (pdf, filename)
+    cache.set(key, cached, settings.REPORT_CACHE_TIMEOUT)
+    return cached
+
+
+# Изменение данных сотрудника меняет его версию
+
+def on_change(event):
+    """Подписчик шины событий: записи времени, задачи и проекты сотрудника"""
+    if event['model'] in ('timeentry', 'task', 'project') and event['user']:
+        bump_user_version(event['user'])
+
+
+def profile_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    bump_profiles_version()
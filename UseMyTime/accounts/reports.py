@@ -0,0 +1,370 @@
+import hashlib
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from projects.models import DailyWorkRollup, Project, Task
+from .models import Department, Profile
+
+
+# Сборка данных для отчётов (сотрудник -> проект -> задачи)
+# Дерево строится фиксированным числом сгруппированных запросов,
+# независимо от количества сотрудников, а затем собирается в Python.
+
+def split_seconds(total_seconds):
+    """Раскладывает секунды на [часы, минуты, секунды]"""
+    total_seconds = int(total_seconds)
+    return [total_seconds // 3600, (total_seconds % 3600) // 60, total_seconds % 60]
+
+
+def _completed_tasks_q(start_date=None, end_date=None, prefix=''):
+    # Выполненные задачи за период (по дате завершения)
+    q = Q(**{f'{prefix}is_done': True})
+    if start_date:
+        q &= Q(**{f'{prefix}completed_at__date__gte': start_date})
+    if end_date:
+        q &= Q(**{f'{prefix}completed_at__date__lte': end_date})
+    return q
+
+
+def period_bounds(start_date=None, end_date=None):
+    """Границы периода [start, end) в виде aware datetime (None — без ограничения)"""
+    start = end = None
+    if start_date:
+        start = timezone.make_aware(datetime.combine(start_date, time.min))
+    if end_date:
+        end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return start, end
+
+
+def period_seconds(user_ids, start_date=None, end_date=None):
+    """
+    Отработанное за период время: {(project_id, task_id): секунды}.
+    Читает суточные итоги DailyWorkRollup, в которых записи на границе дня
+    уже разбиты по датам, поэтому обрезка по периоду точная, а вместо
+    сырых TimeEntry сканируются сотни строк итогов.
+    """
+    rollups = DailyWorkRollup.objects.filter(user_id__in=user_ids)
+    if start_date:
+        rollups = rollups.filter(date__gte=start_date)
+    if end_date:
+        rollups = rollups.filter(date__lte=end_date)
+
+    totals = defaultdict(int)
+    grouped = rollups.values('project_id', 'task_id').annotate(total=Sum('seconds')).order_by()
+    for row in grouped:
+        totals[(row['project_id'], row['task_id'])] += row['total'] or 0
+    return totals
+
+
+def build_team_report(team, start_date=None, end_date=None):
+    """
+    Данные отчёта по списку сотрудников (queryset Profile).
+    Выполняет фиксированное число запросов: сотрудники, проекты с агрегатами,
+    задачи и время за период из суточных итогов.
+    """
+    employees = list(team.select_related('user', 'department'))
+    user_ids = team.values('user_id')
+
+    # Время за период по проектам и задачам
+    seconds_by_key = period_seconds(user_ids, start_date, end_date)
+    seconds_by_project = defaultdict(int)
+    for (project_id, _), value in seconds_by_key.items():
+        seconds_by_project[project_id] += value
+
+    # Только неархивные и принятые проекты, в которых есть выполненные задачи за период
+    task_filter = _completed_tasks_q(start_date, end_date, prefix='tasks__')
+    projects = (
+        Project.objects
+        .filter(user_id__in=user_ids, is_archived=False, review_status='approved')
+        .annotate(
+            done_tasks_count=Count('tasks', filter=task_filter),
+            last_completed_at=Max('tasks__completed_at', filter=task_filter),
+        )
+        .filter(done_tasks_count__gt=0)
+        .order_by('user_id', 'id')
+    )
+
+    completed_tasks = (
+        Task.objects
+        .filter(
+            _completed_tasks_q(start_date, end_date),
+            project__user_id__in=user_ids,
+            project__is_archived=False,
+            project__review_status='approved',
+        )
+        .order_by('project_id', 'id')
+    )
+
+    tasks_by_project = defaultdict(list)
+    for task in completed_tasks:
+        tasks_by_project[task.project_id].append(task)
+
+    projects_by_user = defaultdict(list)
+    for project in projects:
+        # Подставляем уже загруженный проект, чтобы task.project не делал запросов
+        tasks = tasks_by_project.get(project.id, [])
+        for task in tasks:
+            task.project = project
+        projects_by_user[project.user_id].append((project, tasks))
+
+    team_report = []
+    for employee in employees:
+        employee_data = {
+            'employee': employee,
+            'project_data': [],
+            'total_tasks': 0,
+            'work_days': 0,
+            'completed_tasks': [],
+        }
+
+        total_seconds = 0
+        for project, tasks in projects_by_user.get(employee.user_id, []):
+            proj_seconds = seconds_by_project.get(project.id, 0)
+            total_seconds += proj_seconds
+            hours, minutes, seconds = split_seconds(proj_seconds)
+
+            employee_data['project_data'].append({
+                'project': project,
+                'tasks': [_task_data(task, seconds_by_key.get((project.id, task.id), 0)) for task in tasks],
+                'hours': hours,
+                'minutes': minutes,
+                'seconds': seconds,
+                'created_at': project.created_at,
+                # Дата завершения — дата последней выполненной задачи
+                'completed_at': project.last_completed_at,
+            })
+            employee_data['total_tasks'] += project.done_tasks_count
+            employee_data['completed_tasks'].extend(tasks)
+
+        # Общее время по сотруднику
+        (employee_data['total_hours'],
+         employee_data['total_minutes'],
+         employee_data['total_seconds']) = split_seconds(total_seconds)
+        employee_data['seconds'] = total_seconds
+        # Нормированные отработанные дни: 1 день = 8 часов
+        employee_data['work_days'] = round(total_seconds / (8 * 3600), 2)
+
+        team_report.append(employee_data)
+
+    return team_report
+
+
+def _task_data(task, task_seconds):
+    hours, minutes, seconds = split_seconds(task_seconds)
+    return {
+        'task': task,
+        'started_at': task.started_at,
+        'completed_at': task.completed_at,
+        'hours': hours,
+        'minutes': minutes,
+        'seconds': seconds,
+    }
+
+
+def group_by_department(team_report):
+    """Группирует данные сотрудников по отделам и считает итоги"""
+    dept_data = defaultdict(lambda: {'tasks': 0, 'seconds': 0, 'employees': []})
+    for employee_data in team_report:
+        dept = employee_data['employee'].department
+        dept_key = dept.name if dept else 'Без отдела'
+        dept_data[dept_key]['tasks'] += employee_data['total_tasks']
+        dept_data[dept_key]['seconds'] += employee_data['seconds']
+        dept_data[dept_key]['employees'].append(employee_data)
+
+    department_totals = []
+    for dept_name, data in dept_data.items():
+        hours, minutes, seconds = split_seconds(data['seconds'])
+        department_totals.append({
+            'name': dept_name,
+            'tasks': data['tasks'],
+            'hours': hours,
+            'minutes': minutes,
+            'seconds': seconds,
+            'total_seconds': data['seconds'],
+            'employees': data['employees'],
+        })
+    return department_totals
+
+
+def parse_report_date(value):
+    """Дата периода в формате YYYY-MM-DD (None, если не задана или некорректна)"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def report_params(query, **extra):
+    """Нормализованные параметры отчёта (сохраняются в задании на формирование PDF)"""
+    params = {}
+    for key in ('start_date', 'end_date'):
+        value = parse_report_date(query.get(key))
+        if value:
+            params[key] = value.isoformat()
+    params.update({key: value for key, value in extra.items() if value is not None})
+    return params
+
+
+def signature_context(session_id, now_dt):
+    """Данные штампа ПЭП: SHA-256(session_id + '|' + YYYY-MM-DD)"""
+    signature_source = f"{session_id}|{now_dt.strftime('%Y-%m-%d')}".encode('utf-8')
+    return {
+        'session_id': session_id,
+        'signature_hash': hashlib.sha256(signature_source).hexdigest(),
+        'signature_valid_from': now_dt,
+        'signature_valid_to': now_dt + timedelta(days=365),
+    }
+
+
+def team_for(author, department=None):
+    """Сотрудники, попадающие в отчёт автора"""
+    if author.role == 'director':
+        if department:
+            return Profile.objects.filter(department=department)
+        return Profile.objects.all()
+    # Для начальника — только его подчинённые
+    return Profile.objects.filter(manager=author)
+
+
+def team_report_context(author, department=None, start_date=None, end_date=None):
+    team_report = build_team_report(team_for(author, department), start_date, end_date)
+    department_totals = [] if department else group_by_department(team_report)
+    total_department_time = sum(item['seconds'] for item in team_report)
+    dept_total_hours, dept_total_minutes, dept_total_seconds = split_seconds(total_department_time)
+
+    return {
+        'manager': author,
+        'team_report': team_report,
+        'dept_total_hours': dept_total_hours,
+        'dept_total_minutes': dept_total_minutes,
+        'dept_total_tasks': sum(item['total_tasks'] for item in team_report),
+        'dept_total_seconds': dept_total_seconds,
+        'report_department': department,
+        # Если отчет по всей компании, группируем по отделам для подсчета итогов
+        'department_totals': department_totals,
+        'department_count': len(department_totals),
+    }
+
+
+def company_departments(author):
+    """
+    Отделы отчёта по компании: [(область, сотрудники отдела)] по названию
+    отдела, сотрудники без отдела — последними. Данные отдела загружает
+    department_totals, когда до него доходит очередь.
+    """
+    team = team_for(author)
+    department_ids = set(team.order_by().values_list('department_id', flat=True).distinct())
+    departments = [
+        (f'department:{department.pk}', team.filter(department=department))
+        for department in Department.objects.filter(pk__in=department_ids - {None}).order_by('name')
+    ]
+    if None in department_ids:
+        departments.append(('department:none', team.filter(department__isnull=True)))
+    return departments
+
+
+def department_totals(team, start_date=None, end_date=None):
+    """Итоги одного отдела отчёта по компании (как в group_by_department)"""
+    return group_by_department(build_team_report(team, start_date, end_date))
+
+
+def employee_report_context(employee, start_date=None, end_date=None):
+    employee_data = build_team_report(Profile.objects.filter(pk=employee.pk), start_date, end_date)[0]
+    total_time_seconds = employee_data['seconds']
+    total_hours, total_minutes, _ = split_seconds(total_time_seconds)
+    work_days = employee_data['work_days']
+
+    return {
+        'employee': employee,
+        'report_data': employee_data['project_data'],
+        'completed_tasks': employee_data['completed_tasks'],
+        'total_hours': total_hours,
+        'total_minutes': total_minutes,
+        'total_seconds': total_time_seconds,
+        'work_days': work_days,
+        # Эффективность (часов в день)
+        'efficiency_hours_per_day': round((total_hours + total_minutes / 60), 1) if work_days > 0 else 0,
+    }
+
+
+# Стили отчётов лежат в static и для PDF разбираются один раз (см. rendering)
+REPORT_STYLESHEETS = {
+    'accounts/employee_report.html': 'css/reports/employee_report.css',
+    'accounts/team_report.html': 'css/reports/team_report.css',
+    'accounts/company_report.html': 'css/reports/company_report.css',
+}
+
+
+def report_template(kind, params):
+    """Шаблон отчёта: по сотруднику, по отделу или по компании"""
+    if kind == 'employee':
+        return 'accounts/employee_report.html'
+    # Используем разные шаблоны для отчета по отделу и по компании
+    if params.get('department_id'):
+        return 'accounts/team_report.html'
+    return 'accounts/company_report.html'
+
+
+def _report_meta(context, template_name, author, session_id, now_dt, start_date, end_date):
+    # Общая часть контекста всех отчётов: период, автор, штамп ПЭП
+    context.update(signature_context(session_id, now_dt))
+    context.update({
+        'now': now_dt,
+        'author': author,
+        'start_date': start_date,
+        'end_date': end_date,
+        'report_stylesheet': REPORT_STYLESHEETS[template_name],
+    })
+    return context
+
+
+def company_report_filename(now_dt):
+    return f'отчет_компании_{now_dt.strftime("%Y%m%d")}.pdf'
+
+
+def build_report(kind, author, params, session_id, now_dt=None):
+    """
+    Полный контекст отчёта без обращения к request.
+    Используется и представлениями, и фоновым формированием PDF.
+    Возвращает (template_name, context, filename).
+    """
+    now_dt = now_dt or timezone.now()
+    start_date = parse_report_date(params.get('start_date'))
+    end_date = parse_report_date(params.get('end_date'))
+    template_name = report_template(kind, params)
+
+    if kind == 'employee':
+        employee = Profile.objects.select_related('user', 'department').get(pk=params['employee_id'])
+        context = employee_report_context(employee, start_date, end_date)
+        filename = f'отчет_{employee.user.last_name}_{now_dt.strftime("%Y%m%d")}.pdf'
+    else:
+        department = None
+        if params.get('department_id'):
+            department = Department.objects.get(pk=params['department_id'])
+        context = team_report_context(author, department, start_date, end_date)
+        if department:
+            filename = f'отчет_отдела_{department.name}_{now_dt.strftime("%Y%m%d")}.pdf'
+        else:
+            filename = company_report_filename(now_dt)
+
+    _report_meta(context, template_name, author, session_id, now_dt, start_date, end_date)
+    return template_name, context, filename
+
+
+def build_company_report_stream(author, params, session_id, now_dt=None):
+    """
+    Отчёт по компании для потоковой выдачи.
+    Возвращает (template_name, context, departments, filename): context — без данных
+    отделов, departments — список company_departments.
+    """
+    now_dt = now_dt or timezone.now()
+    start_date = parse_report_date(params.get('start_date'))
+    end_date = parse_report_date(params.get('end_date'))
+    template_name = report_template('team', params)
+    context = _report_meta({'manager': author}, template_name, author, session_id, now_dt, start_date, end_date)
+    return template_name, context, company_departments(author), company_report_filename(now_dt)
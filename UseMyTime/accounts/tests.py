@@ -1,9 +1,29 @@
+import io
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import mock
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from pypdf import PdfReader, PdfWriter
 
+from accounts import hierarchy, jobs, rendering, visibility
+from accounts.context_processors import profile_context
 from accounts.forms import UserRegistrationForm
-from accounts.models import Profile, Department
+from accounts.navigation import Navigation
+from accounts.models import Profile, Department, ReportJob
+from accounts.report_cache import SIGNATURE_PLACEHOLDER, render_report_pdf
+from accounts.rendering import local_url_fetcher, merge_pdfs
+from accounts.reports import build_report, build_team_report, period_seconds
+from projects.models import Project, ProjectTimer, Task, TimeEntry
+from projects.services import record_time_entry
 
 
 class ProfileViewTests(TestCase):
@@ -71,6 +91,222 @@ class MyTeamViewTests(TestCase):
         self.assertEqual(len(team_tasks), 1)
         self.assertEqual(team_tasks[0]["employee"], self.employee_profile)
 
+    def _add_employee(self, username, tasks=0):
+        profile = User.objects.create_user(username=username, password="pass").profile
+        profile.manager = self.manager_profile
+        profile.save()
+        project = Project.objects.create(user=profile.user, title=f"Проект {username}")
+        Task.objects.bulk_create([Task(project=project, text=f"Задача {index}", is_done=index % 2 == 0) for index in range(tasks)])
+        return profile
+
+    def _page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("my_team"))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_my_team_query_count_does_not_grow_with_team(self):
+        self.client.login(username="manager", password="managerpass")
+        self._add_employee("team_a", tasks=3)
+        baseline = self._page_queries()
+
+        for index in range(5):
+            self._add_employee(f"team_b{index}", tasks=4)
+
+        self.assertEqual(self._page_queries(), baseline)
+        counts = {
+            item["employee"].user.username: (item["employee"].done_task_count, item["employee"].task_count)
+            for item in self.client.get(reverse("my_team")).context["team_tasks"]
+        }
+        self.assertEqual(counts["team_a"], (2, 3))
+        self.assertEqual(counts["employee"], (0, 0))
+
+    def test_team_member_tasks_are_paginated(self):
+        from accounts import views
+
+        employee = self._add_employee("team_c", tasks=views.TEAM_TASKS_PAGE_SIZE + 1)
+        self.client.login(username="manager", password="managerpass")
+        url = reverse("team_member_tasks", args=[employee.user_id])
+
+        first = self.client.get(url).json()
+        second = self.client.get(url, {"cursor": first["next_cursor"]}).json()
+
+        self.assertEqual(len(first["tasks"]), views.TEAM_TASKS_PAGE_SIZE)
+        self.assertEqual(len(second["tasks"]), 1)
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(self.client.get(url, {"cursor": "broken"}).status_code, 400)
+
+    def test_team_member_tasks_hidden_from_other_managers(self):
+        outsider = User.objects.create_user(username="outsider", password="pass")
+        outsider.profile.role = "manager"
+        outsider.profile.save()
+        self.client.login(username="outsider", password="pass")
+
+        response = self.client.get(reverse("team_member_tasks", args=[self.employee_user.id]))
+
+        self.assertEqual(response.status_code, 403)
+
+
+class ProfileHierarchyTests(TestCase):
+    def _profile(self, username, manager=None):
+        profile = User.objects.create_user(username=username, password="pass").profile
+        profile.manager = manager
+        profile.save()
+        return profile
+
+    def setUp(self):
+        self.director = self._profile("h_director")
+        self.manager = self._profile("h_manager", self.director)
+        self.sector = self._profile("h_sector", self.manager)
+        self.employee = self._profile("h_employee", self.sector)
+        self.other_manager = self._profile("h_other", self.director)
+
+    def _paths(self):
+        return dict(Profile.objects.values_list("user__username", "path"))
+
+    def test_subtree_at_any_depth_in_one_query(self):
+        with self.assertNumQueries(1):
+            names = set(hierarchy.descendants(self.manager).values_list("user__username", flat=True))
+
+        self.assertEqual(names, {"h_sector", "h_employee"})
+        self.assertTrue(hierarchy.is_ancestor(self.director, self.employee))
+        self.assertFalse(hierarchy.is_ancestor(self.employee, self.director))
+        self.assertFalse(hierarchy.is_ancestor(self.manager, self.manager))
+
+    def test_moving_manager_moves_subtree(self):
+        self.sector.manager = self.other_manager
+        self.sector.save()
+
+        employee = Profile.objects.get(pk=self.employee.pk)
+        self.assertTrue(hierarchy.is_ancestor(self.other_manager, employee))
+        self.assertFalse(hierarchy.is_ancestor(Profile.objects.get(pk=self.manager.pk), employee))
+
+    def test_save_without_manager_change_skips_hierarchy(self):
+        employee = Profile.objects.get(pk=self.employee.pk)
+        employee.position = "Инженер"
+
+        with mock.patch("accounts.hierarchy.creates_cycle") as creates_cycle, \
+                mock.patch("accounts.hierarchy.save_path") as save_path:
+            employee.save()
+
+        creates_cycle.assert_not_called()
+        save_path.assert_not_called()
+        self.assertEqual(Profile.objects.get(pk=self.employee.pk).position, "Инженер")
+
+    def test_stale_instance_does_not_overwrite_path(self):
+        employee = Profile.objects.get(pk=self.employee.pk)
+        self.sector.manager = self.other_manager
+        self.sector.save()
+
+        employee.position = "Инженер"
+        employee.save()
+
+        stored = Profile.objects.get(pk=self.employee.pk)
+        self.assertEqual(stored.position, "Инженер")
+        self.assertTrue(hierarchy.is_ancestor(self.other_manager, stored))
+
+    def test_cycle_is_rejected(self):
+        self.director.manager = self.employee
+        with self.assertRaises(ValueError):
+            self.director.save()
+
+    def test_deleted_manager_subtree_becomes_root(self):
+        self.manager.user.delete()
+
+        sector = Profile.objects.get(pk=self.sector.pk)
+        self.assertIsNone(sector.manager_id)
+        self.assertEqual(sector.path, f"/{sector.pk}/")
+        self.assertEqual(Profile.objects.get(pk=self.employee.pk).path, f"/{sector.pk}/{self.employee.pk}/")
+
+    def test_rebuild_restores_paths(self):
+        expected = self._paths()
+        Profile.objects.update(path="")
+
+        call_command("rebuild_profile_paths", stdout=io.StringIO())
+
+        self.assertEqual(self._paths(), expected)
+
+
+class VisibilityTests(TestCase):
+    def _profile(self, username, role="employee", manager=None):
+        profile = User.objects.create_user(username=username, password="pass").profile
+        profile.role = role
+        profile.manager = manager
+        profile.save()
+        return profile
+
+    def setUp(self):
+        cache.clear()
+        self.director = self._profile("v_director", "director")
+        self.manager = self._profile("v_manager", "manager", self.director)
+        self.sector = self._profile("v_sector", "sector_manager", self.manager)
+        self.employee = self._profile("v_employee", manager=self.sector)
+        self.other = self._profile("v_other", manager=self.director)
+        for profile in (self.director, self.manager, self.sector, self.employee, self.other):
+            Project.objects.create(user=profile.user, title=f"Проект {profile.user.username}")
+
+    def _user(self, profile):
+        # Новый объект пользователя — как в следующем запросе
+        return User.objects.get(pk=profile.user_id)
+
+    def _visible(self, profile):
+        projects = visibility.scope(self._user(profile)).filter(Project.objects.all())
+        return set(projects.values_list("user__username", flat=True))
+
+    def test_visible_owners_by_role(self):
+        self.assertEqual(self._visible(self.director), {"v_director", "v_manager", "v_sector", "v_employee", "v_other"})
+        self.assertEqual(self._visible(self.manager), {"v_manager", "v_sector", "v_employee"})
+        self.assertEqual(self._visible(self.sector), {"v_sector", "v_employee"})
+        self.assertEqual(self._visible(self.employee), {"v_employee"})
+
+    def test_scope_is_computed_once_and_cached_between_requests(self):
+        user = self._user(self.manager)
+        with self.assertNumQueries(2):
+            scope = visibility.scope(user)
+        with self.assertNumQueries(0):
+            self.assertIs(visibility.scope(user), scope)
+            self.assertTrue(scope.can_view(self.employee.user_id))
+            self.assertFalse(scope.can_view(self.other.user_id))
+
+        user = self._user(self.manager)
+        with self.assertNumQueries(0):
+            self.assertTrue(visibility.scope(user).can_view(self.employee.user_id))
+
+    def test_manager_change_invalidates_cached_scope(self):
+        self.assertTrue(visibility.scope(self._user(self.manager)).can_view(self.employee.user_id))
+
+        self.employee.manager = self.other
+        self.employee.save()
+
+        self.assertFalse(visibility.scope(self._user(self.manager)).can_view(self.employee.user_id))
+
+    def test_review_is_limited_to_direct_manager(self):
+        project = Project.objects.get(user=self.employee.user)
+        project.review_status = "in_review"
+        project.save()
+
+        self.client.force_login(self.manager.user)
+        response = self.client.get(reverse("project_detail", args=[project.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context["can_review"])
+        self.client.post(reverse("project_review_approve", args=[project.pk]))
+        project.refresh_from_db()
+        self.assertEqual(project.review_status, "in_review")
+
+        self.client.force_login(self.sector.user)
+        response = self.client.get(reverse("project_detail", args=[project.pk]))
+        self.assertTrue(response.context["can_review"])
+        self.client.post(reverse("project_review_approve", args=[project.pk]))
+        project.refresh_from_db()
+        self.assertEqual(project.review_status, "approved")
+
+    def test_employee_report_hidden_outside_scope(self):
+        self.client.force_login(self.employee.user)
+        response = self.client.get(reverse("employee_report", args=[self.other.pk]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse("profile"))
+
 
 class RegisterFormTests(TestCase):
     def test_registration_form_rejects_duplicate_email(self):
@@ -145,3 +381,534 @@ class EditEmployeeViewTests(TestCase):
         self.assertTemplateUsed(response, "accounts/edit.html")
         self.assertIn("user_form", response.context)
         self.assertIn("profile_form", response.context)
+
+
+class TeamReportQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name="Отдел отчётов")
+
+    def _add_employees(self, count):
+        for _ in range(count):
+            index = Profile.objects.count()
+            user = User.objects.create_user(username=f"report_emp_{index}", password="pass")
+            profile = Profile.objects.get(user=user)
+            profile.department = self.department
+            profile.save()
+            for p in range(2):
+                project = Project.objects.create(
+                    user=user,
+                    title=f"Проект {p}",
+                    description="",
+                    review_status="approved",
+                )
+                for t in range(3):
+                    Task.objects.create(
+                        project=project,
+                        text=f"Задача {t}",
+                        is_done=True,
+                        status="done",
+                        completed_at=timezone.now(),
+                    )
+
+    def _count_queries(self):
+        team = Profile.objects.filter(department=self.department)
+        with CaptureQueriesContext(connection) as ctx:
+            team_report = build_team_report(team)
+        return len(ctx.captured_queries), team_report
+
+    def test_query_count_does_not_grow_with_team_size(self):
+        self._add_employees(2)
+        small_count, small_report = self._count_queries()
+        self._add_employees(8)
+        large_count, large_report = self._count_queries()
+
+        self.assertEqual(len(small_report), 2)
+        self.assertEqual(len(large_report), 10)
+        self.assertEqual(small_count, large_count)
+
+    def test_report_tree_contains_projects_and_tasks(self):
+        self._add_employees(1)
+        _, team_report = self._count_queries()
+
+        employee_data = team_report[0]
+        self.assertEqual(employee_data["total_tasks"], 6)
+        self.assertEqual(len(employee_data["project_data"]), 2)
+        self.assertEqual(len(employee_data["project_data"][0]["tasks"]), 3)
+        self.assertIsNotNone(employee_data["project_data"][0]["completed_at"])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.director_user = User.objects.create_user(username="director", password="directorpass")
+        profile = Profile.objects.get(user=cls.director_user)
+        profile.role = "director"
+        profile.save()
+
+    def setUp(self):
+        self.client.login(username="director", password="directorpass")
+
+    def test_pdf_request_enqueues_job_instead_of_rendering(self):
+        response = self.client.get(reverse("generate_report"), {"format": "pdf", "start_date": "2025-01-01"})
+
+        job = ReportJob.objects.get()
+        self.assertRedirects(response, reverse("report_job", args=[job.id]))
+        self.assertEqual(job.status, "pending")
+        self.assertEqual(job.params, {"start_date": "2025-01-01"})
+
+        status = self.client.get(reverse("report_job_status", args=[job.id])).json()
+        self.assertEqual(status["status"], "pending")
+        self.assertIsNone(status["download_url"])
+
+    def test_worker_renders_job_and_exposes_download(self):
+        self.client.get(reverse("generate_report"), {"format": "pdf"})
+        job = ReportJob.objects.get()
+
+        # Закрытие соединений между заданиями оборвало бы транзакцию теста
+        with mock.patch("accounts.management.commands.process_report_jobs.close_old_connections"):
+            call_command("process_report_jobs", "--once", stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        status = self.client.get(reverse("report_job_status", args=[job.id])).json()
+        self.assertEqual(status["download_url"], reverse("report_job_download", args=[job.id]))
+        response = self.client.get(status["download_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def _stale_running_job(self, attempts):
+        self.client.get(reverse("generate_report"), {"format": "pdf"})
+        ReportJob.objects.update(status="running", attempts=attempts,
+                                 started_at=timezone.now() - timedelta(minutes=31))
+        return ReportJob.objects.get()
+
+    @override_settings(REPORT_JOB_LEASE_MINUTES=30, REPORT_JOB_MAX_ATTEMPTS=2)
+    def test_stale_running_job_is_reclaimed(self):
+        job = self._stale_running_job(attempts=1)
+
+        claimed = jobs.claim_next_job()
+
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, "running")
+        self.assertEqual(claimed.attempts, 2)
+        self.assertGreater(claimed.started_at, timezone.now() - timedelta(minutes=1))
+
+    @override_settings(REPORT_JOB_LEASE_MINUTES=30, REPORT_JOB_MAX_ATTEMPTS=2)
+    def test_stale_job_fails_after_max_attempts(self):
+        job = self._stale_running_job(attempts=2)
+
+        self.assertIsNone(jobs.claim_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertTrue(job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_result_of_expired_lease_is_discarded(self):
+        self.client.get(reverse("generate_report"), {"format": "pdf"})
+        job = jobs.claim_next_job()
+        # Пока задание формировалось, аренда истекла и его забрал другой обработчик
+        ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now())
+
+        with mock.patch("accounts.jobs.render_report_pdf", return_value=(b"%PDF-1.4", "report.pdf")):
+            jobs.run_report_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "running")
+        self.assertFalse(job.file)
+
+    def test_job_is_visible_only_to_requester(self):
+        self.client.get(reverse("generate_report"), {"format": "pdf"})
+        job = ReportJob.objects.get()
+        User.objects.create_user(username="stranger", password="strangerpass")
+        self.client.login(username="stranger", password="strangerpass")
+
+        response = self.client.get(reverse("report_job_status", args=[job.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ReportCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_user = User.objects.create_user(username="cache_manager", password="managerpass")
+        cls.manager_profile = Profile.objects.get(user=cls.manager_user)
+        cls.manager_profile.role = "manager"
+        cls.manager_profile.save()
+
+        cls.employee_user = User.objects.create_user(username="cache_employee", password="employeepass")
+        employee_profile = Profile.objects.get(user=cls.employee_user)
+        employee_profile.manager = cls.manager_profile
+        employee_profile.save()
+
+        cls.project = Project.objects.create(
+            user=cls.employee_user, title="Кэшируемый проект", description="", review_status="approved")
+        Task.objects.create(project=cls.project, text="Задача", is_done=True, status="done",
+                            completed_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username="cache_manager", password="managerpass")
+
+    def test_repeated_report_is_served_from_cache(self):
+        with mock.patch("accounts.report_cache.build_report", wraps=build_report) as build:
+            first = self.client.get(reverse("generate_report"))
+            second = self.client.get(reverse("generate_report"))
+
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, "Кэшируемый проект")
+
+    def test_time_entry_invalidates_cached_report(self):
+        with mock.patch("accounts.report_cache.build_report", wraps=build_report) as build:
+            self.client.get(reverse("generate_report"))
+            now = timezone.now()
+            with self.captureOnCommitCallbacks(execute=True):
+                TimeEntry.objects.create(user=self.employee_user, project=self.project,
+                                         started_at=now, ended_at=now, seconds=0)
+            self.client.get(reverse("generate_report"))
+
+        self.assertEqual(build.call_count, 2)
+
+    def test_signature_is_stamped_per_viewer(self):
+        first = self.client.get(reverse("generate_report")).content.decode()
+        other_client = Client()
+        other_client.login(username="cache_manager", password="managerpass")
+        second = other_client.get(reverse("generate_report")).content.decode()
+
+        self.assertNotIn(SIGNATURE_PLACEHOLDER, first)
+        self.assertNotEqual(first, second)
+
+
+class CompanyReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.director_user = User.objects.create_user(username="parts_director", password="directorpass")
+        cls.director = Profile.objects.get(user=cls.director_user)
+        cls.director.role = "director"
+        cls.director.save()
+
+        for name in ("Отдел А", "Отдел Б"):
+            department = Department.objects.create(name=name)
+            user = User.objects.create_user(username=f"parts_{department.pk}", password="employeepass")
+            Profile.objects.filter(user=user).update(department=department)
+            project = Project.objects.create(
+                user=user, title=f"Проект {name}", description="", review_status="approved")
+            Task.objects.create(project=project, text="Задача", is_done=True, status="done",
+                                completed_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(REPORT_PDF_WORKERS=2)
+    def test_company_pdf_is_rendered_per_department(self):
+        with mock.patch("accounts.report_cache.render_pdf_parts", return_value=b"%PDF") as render_parts:
+            pdf, _ = render_report_pdf("team", self.director, {}, "session", "http://testserver/")
+
+        self.assertEqual(pdf, b"%PDF")
+        parts, base_url, workers, titles, options = render_parts.call_args.args
+        # По части на каждый отдел (включая «Без отдела» у директора) и итоговая часть
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(titles[-1], "Общий итог")
+        self.assertIn("ОТЧЁТ ПО КОМПАНИИ", parts[0])
+        self.assertNotIn("ОТЧЁТ ПО КОМПАНИИ", parts[1])
+        self.assertIn("Проект Отдел Б", "".join(parts[:-1]))
+        self.assertIn("ОБЩИЙ ИТОГ ПО КОМПАНИИ", parts[-1])
+        self.assertNotIn(SIGNATURE_PLACEHOLDER, parts[-1])
+        self.assertEqual(workers, 2)
+        self.assertTrue(options["stylesheets"][0].endswith("company_report.css"))
+
+    def test_company_html_is_streamed_department_by_department(self):
+        self.client.login(username="parts_director", password="directorpass")
+        with mock.patch("accounts.reports.build_team_report", wraps=build_team_report) as build:
+            response = self.client.get(reverse("generate_report"))
+            self.assertTrue(response.streaming)
+            chunks = iter(response.streaming_content)
+            self.assertIn("ОТЧЁТ ПО КОМПАНИИ", next(chunks).decode())
+            # Данные загружаются по мере вывода отделов
+            self.assertEqual(build.call_count, 0)
+            self.assertIn("Отдел А", next(chunks).decode())
+            self.assertEqual(build.call_count, 1)
+            body = b"".join(chunks).decode()
+
+        self.assertEqual(build.call_count, 3)
+        self.assertIn("Количество отделов: 3", body)
+        self.assertNotIn(SIGNATURE_PLACEHOLDER, body)
+
+    def test_streamed_report_is_cached(self):
+        self.client.login(username="parts_director", password="directorpass")
+        first = b"".join(self.client.get(reverse("generate_report")).streaming_content)
+        with mock.patch("accounts.reports.build_team_report") as build:
+            second = b"".join(self.client.get(reverse("generate_report")).streaming_content)
+
+        build.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_streamed_report_rebuilds_only_changed_department(self):
+        self.client.login(username="parts_director", password="directorpass")
+        b"".join(self.client.get(reverse("generate_report")).streaming_content)
+        project = Project.objects.get(title="Проект Отдел Б")
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(project=project, text="Ещё задача", is_done=True, status="done",
+                                completed_at=timezone.now())
+
+        with mock.patch("accounts.reports.build_team_report", wraps=build_team_report) as build:
+            response = self.client.get(reverse("generate_report"))
+            body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/html; charset=utf-8")
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(list(build.call_args.args[0].values_list("user__username", flat=True)),
+                         [project.user.username])
+        self.assertIn("Количество отделов: 3", body)
+
+    def test_merge_keeps_part_order(self):
+        documents = []
+        for width in (100, 200, 300):
+            writer = PdfWriter()
+            writer.add_blank_page(width=width, height=100)
+            output = io.BytesIO()
+            writer.write(output)
+            documents.append(output.getvalue())
+
+        merged = PdfReader(io.BytesIO(merge_pdfs(documents, ["А", None, "В"])))
+
+        self.assertEqual([int(page.mediabox.width) for page in merged.pages], [100, 200, 300])
+        self.assertEqual([item.title for item in merged.outline], ["А", "В"])
+
+
+class LocalUrlFetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.static_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.static_dir.cleanup)
+        self.css_path = f"{self.static_dir.name}/report.css"
+        with open(self.css_path, "w") as f:
+            f.write("body { color: red; }")
+        self.fetcher = local_url_fetcher(
+            "http://testserver/", [("/static/", [self.static_dir.name])], preparsed=[self.css_path])
+
+    def test_static_files_are_read_from_disk(self):
+        with open(f"{self.static_dir.name}/logo.png", "wb") as f:
+            f.write(b"png")
+
+        result = self.fetcher("http://testserver/static/logo.png")
+
+        self.assertEqual(result["string"], b"png")
+        self.assertEqual(result["mime_type"], "image/png")
+
+    def test_preparsed_stylesheet_is_not_loaded_again(self):
+        self.assertEqual(self.fetcher("http://testserver/static/report.css")["string"], b"")
+
+    def test_other_urls_use_default_fetcher(self):
+        with mock.patch("accounts.rendering.default_url_fetcher", return_value={"string": b"remote"}) as default:
+            self.fetcher("http://testserver/static/../settings.py")
+            self.fetcher("http://example.com/static/logo.png")
+
+        self.assertEqual(default.call_count, 2)
+
+
+class RenderingStateTests(SimpleTestCase):
+    def setUp(self):
+        rendering._image_cache.clear()
+        self.addCleanup(rendering._image_cache.clear)
+
+    def _render_with_cached(self, data):
+        def write_pdf(*args, cache, **kwargs):
+            cache[("image", "source")] = data
+            return b"%PDF"
+        with mock.patch("accounts.rendering.HTML") as html:
+            html.return_value.write_pdf.side_effect = write_pdf
+            rendering.render_pdf("<p></p>", "http://testserver/")
+
+    @mock.patch("accounts.rendering.IMAGE_CACHE_MAX_BYTES", 10)
+    def test_image_cache_is_kept_below_limit(self):
+        self._render_with_cached(b"small")
+        self.assertEqual(len(rendering._image_cache), 1)
+
+        self._render_with_cached(b"much larger image data")
+        self.assertEqual(rendering._image_cache, {})
+
+    def test_pool_does_not_fork_worker_process(self):
+        with mock.patch("accounts.rendering._executor", None):
+            pool = rendering._pool(2)
+            self.addCleanup(pool.shutdown)
+            self.assertIn(pool._mp_context.get_start_method(), ("forkserver", "spawn"))
+
+
+class NavigationContextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_user = User.objects.create_user(username="nav_manager", password="managerpass")
+        cls.manager_profile = Profile.objects.get(user=cls.manager_user)
+        cls.manager_profile.role = "manager"
+        cls.manager_profile.save()
+
+        cls.employee_user = User.objects.create_user(username="nav_employee", password="employeepass")
+        employee_profile = Profile.objects.get(user=cls.employee_user)
+        employee_profile.manager = cls.manager_profile
+        employee_profile.save()
+
+        cls.project = Project.objects.create(user=cls.employee_user, title="Проект в шапке", description="")
+
+    def setUp(self):
+        cache.clear()
+
+    def _render(self, user, source):
+        request = RequestFactory().get("/")
+        request.user = user
+        return Template(source).render(Context(profile_context(request))).strip()
+
+    def test_repeated_render_uses_cached_values(self):
+        source = "{{ user_profile.role }} {{ review_queue_count }} {{ attention_projects_count }}"
+        self._render(self.manager_user, source)
+        with self.assertNumQueries(0):
+            rendered = self._render(self.manager_user, source)
+
+        self.assertEqual(rendered, "manager 0 0")
+
+    def test_values_are_not_computed_until_used(self):
+        with self.assertNumQueries(0):
+            self._render(self.manager_user, "")
+
+    def test_cache_holds_only_primitives(self):
+        ProjectTimer.objects.create(user=self.employee_user, project=self.project,
+                                    in_work=True, last_started_at=timezone.now())
+        rendered = self._render(self.employee_user,
+                                "{{ user_profile.role }} {{ active_project_info.project_title }} {{ review_queue_count }}")
+        self.assertEqual(rendered, "employee Проект в шапке 0")
+
+        def primitives(value):
+            if isinstance(value, dict):
+                return all(isinstance(key, str) and primitives(item) for key, item in value.items())
+            return value is None or isinstance(value, (bool, int, str))
+
+        cached = cache.get(f"nav:v2:user:{self.employee_user.pk}")["values"]
+        self.assertEqual(set(cached), {"user_profile", "active_project_info", "review_queue_count"})
+        self.assertTrue(primitives(cached))
+
+    def test_review_and_timer_actions_invalidate_cache(self):
+        self.assertEqual(self._render(self.manager_user, "{{ review_queue_count }}"), "0")
+        self.assertEqual(self._render(self.employee_user, "{{ active_project_info.project_title }}"), "")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.review_status = "in_review"
+            self.project.save()
+            ProjectTimer.objects.create(user=self.employee_user, project=self.project,
+                                        in_work=True, last_started_at=timezone.now())
+
+        self.assertEqual(self._render(self.manager_user, "{{ review_queue_count }}"), "1")
+        self.assertEqual(self._render(self.employee_user, "{{ active_project_info.project_title }}"), "Проект в шапке")
+
+    def test_value_computed_before_invalidation_is_not_kept(self):
+        navigation = Navigation(self.manager_user)
+        self.assertEqual(navigation.get("user_profile")["role"], "manager")
+
+        # Сброс приходит, пока запрос ещё досчитывает значения
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.review_status = "in_review"
+            self.project.save()
+        with mock.patch("accounts.navigation._review_queue_count", return_value=0):
+            navigation.get("review_queue_count")
+
+        self.assertEqual(self._render(self.manager_user, "{{ review_queue_count }}"), "1")
+
+
+class PeriodSecondsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="period_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Проект", description="",
+                                             review_status="approved")
+        cls.task = Task.objects.create(project=cls.project, text="Задача", is_done=True, status="done",
+                                       completed_at=timezone.make_aware(datetime(2025, 3, 15, 12)))
+
+    def _entry(self, start, end, task=None):
+        started_at = timezone.make_aware(start)
+        ended_at = timezone.make_aware(end)
+        record_time_entry(user=self.user, project=self.project, task=task,
+                          started_at=started_at, ended_at=ended_at,
+                          seconds=int((ended_at - started_at).total_seconds()))
+
+    def test_entries_are_clipped_to_period(self):
+        # Целиком внутри марта: 1 час
+        self._entry(datetime(2025, 3, 10, 9), datetime(2025, 3, 10, 10), task=self.task)
+        # Пересекает начало периода: внутри 30 минут
+        self._entry(datetime(2025, 2, 28, 23, 30), datetime(2025, 3, 1, 0, 30))
+        # Пересекает конец периода: внутри 15 минут
+        self._entry(datetime(2025, 3, 31, 23, 45), datetime(2025, 4, 1, 1))
+        # Вне периода
+        self._entry(datetime(2025, 4, 5, 9), datetime(2025, 4, 5, 18))
+
+        totals = period_seconds([self.user.id], date(2025, 3, 1), date(2025, 3, 31))
+
+        self.assertEqual(totals[(self.project.id, self.task.id)], 3600)
+        self.assertEqual(totals[(self.project.id, None)], 45 * 60)
+
+    def test_report_uses_period_time_instead_of_lifetime_total(self):
+        self.project.total_time = timedelta(hours=100)
+        self.project.save()
+        self._entry(datetime(2025, 3, 10, 9), datetime(2025, 3, 10, 11), task=self.task)
+        self._entry(datetime(2025, 1, 10, 9), datetime(2025, 1, 10, 18), task=self.task)
+
+        team_report = build_team_report(Profile.objects.filter(user=self.user),
+                                        date(2025, 3, 1), date(2025, 3, 31))
+
+        self.assertEqual(team_report[0]["seconds"], 2 * 3600)
+        self.assertEqual(team_report[0]["project_data"][0]["tasks"][0]["hours"], 2)
+
+
+class ExportTimeEntriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name="Бухгалтерия")
+        cls.director_user = User.objects.create_user(username="export_director", password="directorpass")
+        profile = Profile.objects.get(user=cls.director_user)
+        profile.role = "director"
+        profile.save()
+
+        cls.employee_user = User.objects.create_user(username="export_employee", password="pass",
+                                                     first_name="Иван", last_name="Петров")
+        employee_profile = Profile.objects.get(user=cls.employee_user)
+        employee_profile.department = cls.department
+        employee_profile.save()
+
+        project = Project.objects.create(user=cls.employee_user, title="Квартальный отчёт", description="")
+        for day in (10, 20):
+            started_at = timezone.make_aware(datetime(2025, 3, day, 9))
+            TimeEntry.objects.create(user=cls.employee_user, project=project, started_at=started_at,
+                                     ended_at=started_at + timedelta(hours=1), seconds=3600)
+        started_at = timezone.make_aware(datetime(2025, 5, 1, 9))
+        TimeEntry.objects.create(user=cls.employee_user, project=project, started_at=started_at,
+                                 ended_at=started_at + timedelta(hours=1), seconds=3600)
+
+    def test_export_streams_csv_rows_for_period(self):
+        self.client.login(username="export_director", password="directorpass")
+        response = self.client.get(reverse("export_time_entries"),
+                                   {"start_date": "2025-01-01", "end_date": "2025-03-31"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = b"".join(response.streaming_content).decode("utf-8-sig").strip().splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertIn("Петров Иван", rows[1])
+        self.assertIn("Бухгалтерия", rows[1])
+        self.assertTrue(rows[1].endswith(";3600"))
+
+    def test_export_escapes_formula_cells(self):
+        project = Project.objects.create(user=self.employee_user, title='=HYPERLINK("http://x")', description="")
+        started_at = timezone.make_aware(datetime(2025, 2, 1, 9))
+        TimeEntry.objects.create(user=self.employee_user, project=project, started_at=started_at,
+                                 ended_at=started_at + timedelta(hours=1), seconds=3600)
+        self.client.login(username="export_director", password="directorpass")
+
+        response = self.client.get(reverse("export_time_entries"),
+                                   {"start_date": "2025-02-01", "end_date": "2025-02-28"})
+
+        row = b"".join(response.streaming_content).decode("utf-8-sig").strip().splitlines()[1]
+        self.assertIn(';"\'=HYPERLINK(""http://x"")";', row)
+
+    def test_export_requires_director(self):
+        self.client.login(username="export_employee", password="pass")
+        response = self.client.get(reverse("export_time_entries"))
+        self.assertEqual(response.status_code, 302)
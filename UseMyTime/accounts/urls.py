@@ -10,8 +10,14 @@ urlpatterns = [
     path('edit/', views.edit, name='profile_edit'),
     # Добавлены новые пути
     path('my-team/', views.my_team, name='my_team'),
+    path('my-team/<int:user_id>/tasks/', views.team_member_tasks, name='team_member_tasks'),
     path('employee/<int:user_id>/edit/', views.edit_employee, name='edit_employee'),
     path('report/', views.generate_report, name='generate_report'),
     path('report/<int:employee_id>/', views.employee_report, name='employee_report'),
     path('company-reports/', views.company_reports, name='company_reports'),
+    path('company-reports/export/', views.export_time_entries, name='export_time_entries'),
+    # Фоновое формирование PDF-отчётов
+    path('report/jobs/<int:job_id>/', views.report_job, name='report_job'),
+    path('report/jobs/<int:job_id>/status/', views.report_job_status, name='report_job_status'),
+    path('report/jobs/<int:job_id>/download/', views.report_job_download, name='report_job_download'),
 ]
\ No newline at end of file
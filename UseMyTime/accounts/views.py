@@ -1,20 +1,26 @@
-from django.http import HttpResponse
-import hashlib
-from datetime import timedelta
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegistrationForm, UserEditForm, ProfileEditForm
-from .models import Profile, Department
+from .models import Profile, Department, ReportJob
 from django.contrib import messages
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
+from django.db.models import Count, Q
 
 # Добавлены библиотеки
-from projects.models import Project, Task
+from projects.models import Task
+from projects.pagination import keyset_page
+from django.urls import reverse
 from django.utils import timezone
-from django.template.loader import render_to_string
-from weasyprint import HTML # Библиотека для формирования отчетов
 from .decorators import role_required # Кастомный декоратор для проверки роли пользователя
+from . import visibility
+from .exports import stream_time_entries_csv, time_entries_for_export
+from .jobs import enqueue_report_job
+from .report_cache import (
+    cached_report_body, cached_report_pdf, is_company_report, stamp_report, stream_company_report,
+)
+from .reports import parse_report_date, report_params
 
 # Отображение профиля
 @login_required
@@ -76,21 +82,16 @@ def edit(request):
 def my_team(request):
     profile = request.user.profile
 
-    # Все подчинённые (кто имеет этого пользователя как manager)
-    team = profile.subordinates.all()
+    # Все подчинённые (кто имеет этого пользователя как manager) одним запросом
+    # со счётчиками задач в неархивных проектах; сами задачи панель сотрудника
+    # загружает при раскрытии (team_member_tasks)
+    active_tasks = Q(user__projects__is_archived=False)
+    team = profile.subordinates.select_related('user').annotate(
+        task_count=Count('user__projects__tasks', filter=active_tasks),
+        done_task_count=Count('user__projects__tasks', filter=active_tasks & Q(user__projects__tasks__is_done=True)),
+    ).order_by('user__last_name', 'user__first_name', 'pk')
 
-    # Собираем задачи для каждого сотрудника
-    team_tasks = []
-    for employee in team:
-        # Находим все проекты, где employee.user — владелец
-        employee_projects = Project.objects.filter(user=employee.user, is_archived=False)
-        # Находим все задачи из этих проектов
-        tasks = Task.objects.filter(project__in=employee_projects)
-
-        team_tasks.append({
-            'employee': employee,
-            'tasks': tasks
-        })
+    team_tasks = [{'employee': employee} for employee in team]
 
     # Дефолтный период: текущий месяц
     now = timezone.now()
@@ -109,6 +110,35 @@ def my_team(request):
     }
     return render(request, 'accounts/my_team.html', context)
 
+# Задачи сотрудника для панели на странице "Мой отдел" (постранично по ключу, JSON)
+# Следующая страница запрашивается с параметром cursor из ответа (next_cursor)
+TEAM_TASKS_PAGE_SIZE = 50
+
+
+@login_required
+@require_GET
+@role_required(['manager', 'sector_manager'])
+def team_member_tasks(request, user_id):
+    if not visibility.scope(request.user).can_view(user_id):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    tasks = Task.objects.filter(project__user_id=user_id, project__is_archived=False).select_related('project')
+    try:
+        tasks, next_cursor = keyset_page(tasks, request.GET.get('cursor'), TEAM_TASKS_PAGE_SIZE)
+    except (ValueError, OverflowError):
+        return JsonResponse({'error': 'Неверный курсор страницы'}, status=400)
+    return JsonResponse({
+        'tasks': [
+            {
+                'project': task.project.title,
+                'text': task.text,
+                'is_done': task.is_done,
+                'created_at': timezone.localtime(task.created_at).strftime('%d.%m.%Y'),
+            }
+            for task in tasks
+        ],
+        'next_cursor': next_cursor,
+    })
+
     
 
 # Добавлена возможность редактировать профили добалвенных сотрудников
@@ -116,15 +146,15 @@ def my_team(request):
 @role_required(['manager', 'sector_manager'])
 def edit_employee(request, user_id):
     """Редактирование профиля сотрудника (только для своего отдела)"""
-    user = User.objects.get(id=user_id)
-    profile = request.user.profile
+    user = get_object_or_404(User.objects.select_related('profile'), id=user_id)
+    scope = visibility.scope(request.user)
 
-    # Проверяем, что сотрудник в подчинении
-    if user.profile.manager != profile and profile.role != 'director':
+    # Проверяем, что сотрудник в непосредственном подчинении
+    if not scope.is_direct_manager(user.id):
         messages.error(request, "Нет доступа.")
         return redirect('my_team')
-    # Дополнительная проверка: отдел должен совпадать (кроме директора)
-    if profile.role != 'director' and user.profile.department != profile.department:
+    # Дополнительная проверка: отдел должен совпадать
+    if user.profile.department_id != scope.department_id:
         messages.error(request, "Нет доступа к сотруднику из другого отдела.")
         return redirect('my_team')
 
@@ -173,6 +203,23 @@ def company_reports(request):
     }
     return render(request, 'accounts/company_reports.html', context)
 
+# Потоковая выгрузка записей времени (CSV) для директора
+@login_required
+@role_required(['director'])
+def export_time_entries(request):
+    params = report_params(request.GET)
+    start_date = parse_report_date(params.get('start_date'))
+    end_date = parse_report_date(params.get('end_date'))
+    department_id = None
+    if request.GET.get('department'):
+        department_id = get_object_or_404(Department, id=request.GET['department']).id
+
+    entries = time_entries_for_export(start_date, end_date, department_id)
+    response = StreamingHttpResponse(stream_time_entries_csv(entries), content_type='text/csv; charset=utf-8')
+    filename = f'записи_времени_{timezone.now().strftime("%Y%m%d")}.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 # Добавлена возможность генерировать отчет по отделу
 @login_required
 @role_required(['manager', 'sector_manager', 'director'])
@@ -180,194 +227,16 @@ def generate_report(request):
     profile = request.user.profile
 
     # Если директор, можно выбрать отдел (или все отделы)
-    report_department = None
+    department_id = None
     if profile.role == 'director':
         dept_id = request.GET.get('department')
         if dept_id:
-            report_department = get_object_or_404(Department, id=dept_id)
-            team = Profile.objects.filter(department=report_department)
-        else:
-            team = Profile.objects.all()
-    else:
-        # Для начальника — только его подчинённые
-        team = Profile.objects.filter(manager=profile)
+            department_id = get_object_or_404(Department, id=dept_id).id
 
     # Период (необязательный)
-    start_date_str = request.GET.get('start_date')
-    end_date_str = request.GET.get('end_date')
-    start_date = None
-    end_date = None
-    if start_date_str:
-        try:
-            start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        except Exception:
-            start_date = None
-    if end_date_str:
-        try:
-            end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        except Exception:
-            end_date = None
-
-    team_report = []
-    total_department_time = 0
-    total_department_tasks = 0
-
-    for employee in team:
-        user = employee.user
-
-        # Только неархивные и принятые проекты
-        projects = Project.objects.filter(user=user, is_archived=False, review_status='approved')
-        completed_tasks = Task.objects.filter(
-            project__in=projects,
-            is_done=True
-        ).select_related('project')
-        if start_date:
-            completed_tasks = completed_tasks.filter(completed_at__date__gte=start_date)
-        if end_date:
-            completed_tasks = completed_tasks.filter(completed_at__date__lte=end_date)
-
-        employee_data = {
-            'employee': employee,
-            'project_data': [],
-            'total_hours': 0,
-            'total_minutes': 0,
-            'total_tasks': completed_tasks.count(),
-            'work_days': 0,
-        }
-
-        total_seconds = 0
-
-        for project in projects:
-            tasks = completed_tasks.filter(project=project)
-            if tasks.exists():
-                proj_seconds = int(project.total_time.total_seconds())
-                total_seconds += proj_seconds
-                hours, minutes, seconds = project.get_hours_minutes_seconds()
-
-                # Дата завершения — дата последней выполненной задачи
-                last_task = tasks.order_by('-completed_at').first()
-
-                # Добавляем время начала и завершения для каждой задачи
-                tasks_with_times = []
-                for task in tasks:
-                    tasks_with_times.append({
-                        'task': task,
-                        'started_at': task.started_at,
-                        'completed_at': task.completed_at,
-                    })
-
-                employee_data['project_data'].append({
-                    'project': project,
-                    'tasks': tasks_with_times,  # Теперь каждая задача содержит время
-                    'hours': hours,
-                    'minutes': minutes,
-                    'seconds': seconds,
-                    'created_at': project.created_at,
-                    'completed_at': last_task.completed_at,
-                })
-
-        # Общее время по сотруднику
-        employee_data['total_hours'] = total_seconds // 3600
-        employee_data['total_minutes'] = (total_seconds % 3600) // 60
-        employee_data['total_seconds'] = total_seconds % 60
-        # Нормированные отработанные дни: 1 день = 8 часов
-        employee_data['work_days'] = round(total_seconds / (8 * 3600), 2)
-        total_department_time += total_seconds
-        total_department_tasks += employee_data['total_tasks']
-
-        team_report.append(employee_data)
-
-    # Общее время по отделу
-    dept_total_hours = total_department_time // 3600
-    dept_total_minutes = (total_department_time % 3600) // 60
-
-    # Если отчет по всей компании, группируем по отделам для подсчета итогов
-    department_totals = []
-    if not report_department:
-        from collections import defaultdict
-        dept_data = defaultdict(lambda: {'tasks': 0, 'seconds': 0, 'employees': []})
-        
-        for employee_data in team_report:
-            dept = employee_data['employee'].department
-            dept_key = dept.name if dept else 'Без отдела'
-            dept_data[dept_key]['tasks'] += employee_data['total_tasks']
-            dept_data[dept_key]['seconds'] += employee_data['total_hours'] * 3600 + employee_data['total_minutes'] * 60 + employee_data['total_seconds']
-            dept_data[dept_key]['employees'].append(employee_data)
-        
-        for dept_name, data in dept_data.items():
-            total_seconds = data['seconds']
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-            
-            department_totals.append({
-                'name': dept_name,
-                'tasks': data['tasks'],
-                'hours': hours,
-                'minutes': minutes,
-                'seconds': seconds,
-                'employees': data['employees']
-            })
-
-    # Гарантируем наличие session_key для штампа ПЭП
-    if not request.session.session_key:
-        request.session.save()
-    session_id = request.session.session_key
-
-    # Дата формирования (единая для отображения и подписи)
-    now_dt = timezone.now()
-
-    # Отпечаток подписи: SHA-256(session_id + '|' + YYYY-MM-DD)
-    signature_source = f"{session_id}|{now_dt.strftime('%Y-%m-%d')}".encode('utf-8')
-    signature_hash = hashlib.sha256(signature_source).hexdigest()
+    params = report_params(request.GET, department_id=department_id)
 
-    signature_valid_from = now_dt
-    signature_valid_to = now_dt + timedelta(days=365)
-
-    context = {
-        'manager': profile,
-        'team_report': team_report,
-        'dept_total_hours': dept_total_hours,
-        'dept_total_minutes': dept_total_minutes,
-        'dept_total_tasks': total_department_tasks,
-        'dept_total_seconds': total_department_time % 60,
-        'now': now_dt,
-        'author': request.user.profile,
-        'report_department': report_department,
-        'department_totals': department_totals,
-        'session_id': session_id,
-        'signature_hash': signature_hash,
-        'signature_valid_from': signature_valid_from,
-        'signature_valid_to': signature_valid_to,
-        'start_date': start_date,
-        'end_date': end_date,
-    }
-
-    # Если запрос на PDF
-    if request.GET.get('format') == 'pdf':
-        # Используем разные шаблоны для отчета по отделу и по компании
-        if report_department:
-            template_name = 'accounts/team_report.html'
-            filename = f'отчет_отдела_{report_department.name}_{timezone.now().strftime("%Y%m%d")}.pdf'
-        else:
-            template_name = 'accounts/company_report.html'
-            filename = f'отчет_компании_{timezone.now().strftime("%Y%m%d")}.pdf'
-        
-        html_string = render_to_string(template_name, context)
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        result = html.write_pdf()
-
-        response = HttpResponse(result, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-
-    # Используем разные шаблоны для отображения
-    if report_department:
-        template_name = 'accounts/team_report.html'
-    else:
-        template_name = 'accounts/company_report.html'
-    
-    return render(request, template_name, context)
+    return report_response(request, 'team', profile, params)
 
 # Добавлена возможность генерировать отчет по каждому сотруднику отдельно
 @login_required
@@ -375,26 +244,11 @@ def generate_report(request):
 def employee_report(request, employee_id):
     # Получаем сотрудника
     employee = get_object_or_404(Profile, id=employee_id)
-    user = employee.user
-    requester = request.user
-    requester_profile = requester.profile
-
-    # Проверка прав доступа:
-    # - суперпользователь всегда может
-    # - директор всегда может
-    # - сам сотрудник может смотреть свой отчёт
-    # - начальник сотрудника (из того же отдела) может
-    allowed = False
-    if requester.is_superuser:
-        allowed = True
-    elif requester_profile.role == 'director':
-        allowed = True
-    elif user.id == requester.id:
-        allowed = True
-    elif requester_profile.role in ['manager', 'sector_manager'] and employee.manager_id == requester_profile.id:
-        allowed = True
-
-    if not allowed:
+    requester_profile = request.user.profile
+
+    # Отчёт доступен всем, кому видны данные сотрудника: суперпользователю,
+    # директору, самому сотруднику и его руководителям
+    if not visibility.scope(request.user).can_view(employee.user_id):
         messages.error(request, "Нет доступа к отчёту этого сотрудника.")
         # Менеджеров/директоров ведём в их отдел, остальных — в профиль
         if requester_profile.role in ['manager', 'sector_manager', 'director']:
@@ -402,112 +256,55 @@ def employee_report(request, employee_id):
         return redirect('profile')
 
     # Период (необязательный)
-    start_date_str = request.GET.get('start_date')
-    end_date_str = request.GET.get('end_date')
-    start_date = None
-    end_date = None
-    if start_date_str:
-        try:
-            start_date = timezone.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        except Exception:
-            start_date = None
-    if end_date_str:
-        try:
-            end_date = timezone.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        except Exception:
-            end_date = None
-
-    # Только неархивные и принятые проекты
-    projects = Project.objects.filter(user=user, is_archived=False, review_status='approved')
-
-    # Только выполненные задачи
-    completed_tasks = Task.objects.filter(
-        project__in=projects,
-        is_done=True
-    ).select_related('project')
-    if start_date:
-        completed_tasks = completed_tasks.filter(completed_at__date__gte=start_date)
-    if end_date:
-        completed_tasks = completed_tasks.filter(completed_at__date__lte=end_date)
-
-    # Подготовка данных: группировка по проектам
-    report_data = []
-    total_time_seconds = 0
-
-    for project in projects:
-        tasks = completed_tasks.filter(project=project)
-        if tasks.exists():
-            hours, minutes, seconds = project.get_hours_minutes_seconds()  # [ч, м]
-            total_time_seconds += int(project.total_time.total_seconds())
-
-            # Добавляем время начала и завершения для каждой задачи
-            tasks_with_times = []
-            for task in tasks:
-                tasks_with_times.append({
-                    'task': task,
-                    'started_at': task.started_at,
-                    'completed_at': task.completed_at,
-                })
-
-            report_data.append({
-                'project': project,
-                'tasks': tasks_with_times,  # Теперь каждая задача содержит время
-                'hours': hours,
-                'minutes': minutes,
-                'seconds': seconds,
-                'created_at': project.created_at,
-                # Завершение — дата последней выполненной задачи
-                'completed_at': tasks.order_by('-completed_at').first().completed_at,
-            })
-
-    # Общее время
-    total_hours = total_time_seconds // 3600
-    total_minutes = (total_time_seconds % 3600) // 60
-    work_days = round(total_time_seconds / (8 * 3600), 2)
-
-    # Рассчитываем эффективность (часов в день)
-    if work_days > 0:
-        efficiency_hours_per_day = round((total_hours + total_minutes / 60), 1)
-    else:
-        efficiency_hours_per_day = 0
+    params = report_params(request.GET, employee_id=employee.id)
 
-    # Подготовка данных для штампа ПЭП
+    return report_response(request, 'employee', requester_profile, params)
+
+def report_response(request, kind, author, params):
+    """Отдаёт отчёт из кэша или строит его; PDF при промахе кэша формируется в фоне"""
+    # Гарантируем наличие session_key для штампа ПЭП
     if not request.session.session_key:
         request.session.save()
     session_id = request.session.session_key
-    now_dt = timezone.now()
-    signature_source = f"{session_id}|{now_dt.strftime('%Y-%m-%d')}".encode('utf-8')
-    signature_hash = hashlib.sha256(signature_source).hexdigest()
-    signature_valid_from = now_dt
-    signature_valid_to = now_dt + timedelta(days=365)
-
-    context = {
-        'employee': employee,
-        'report_data': report_data,
-        'completed_tasks': completed_tasks,
-        'total_hours': total_hours,
-        'total_minutes': total_minutes,
-        'total_seconds': total_time_seconds,
-        'work_days': work_days,
-        'efficiency_hours_per_day': efficiency_hours_per_day,
-        'now': now_dt,
-        'author': request.user.profile,
-        'session_id': session_id,
-        'signature_hash': signature_hash,
-        'signature_valid_from': signature_valid_from,
-        'signature_valid_to': signature_valid_to,
-        'start_date': start_date,
-        'end_date': end_date,
-    }
 
-    # Если запрос на PDF
     if request.GET.get('format') == 'pdf':
-        html_string = render_to_string('accounts/employee_report.html', context)
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        result = html.write_pdf()
+        cached = cached_report_pdf(kind, author, params, session_id)
+        if cached is not None:
+            result, filename = cached
+            response = HttpResponse(result, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+        # PDF формируется в фоне, страница задания опрашивает его статус
+        job = enqueue_report_job(request, kind, params)
+        return redirect('report_job', job_id=job.id)
+
+    if author.role == 'director' and is_company_report(kind, params):
+        # Отчёт по всей компании выдаётся потоком, по одному отделу за раз
+        return StreamingHttpResponse(stream_company_report(author, params, session_id),
+                                     content_type='text/html; charset=utf-8')
+
+    body, _ = cached_report_body(kind, author, params)
+    return HttpResponse(stamp_report(body, session_id))
+
+# Страница ожидания PDF-отчёта (опрашивает статус задания)
+@login_required
+def report_job(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, requested_by=request.user)
+    return render(request, 'accounts/report_job.html', {'job': job})
 
-        response = HttpResponse(result, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="отчет_{employee.user.last_name}_{now_dt.strftime("%Y%m%d")}.pdf"'
-        return response
+@login_required
+def report_job_status(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, requested_by=request.user)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'download_url': reverse('report_job_download', args=[job.id]) if job.status == 'done' else None,
+        'error': job.error if job.status == 'failed' else None,
+    })
 
-    return render(request, 'accounts/employee_report.html', context)
\ No newline at end of file
+@login_required
+def report_job_download(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, requested_by=request.user, status='done')
+    return FileResponse(job.file.open('rb'), as_attachment=True,
+                        filename=job.filename or job.file.name.split('/')[-1],
+                        content_type='application/pdf')
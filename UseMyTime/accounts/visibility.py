@@ -0,0 +1,124 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import hierarchy
+from .models import Profile
+
+# Чьи данные видит пользователь (проекты, вложения, отчёты сотрудников)
+#   суперпользователь и директор — всех;
+#   руководитель (manager, sector_manager) — свои и всего поддерева подчинения;
+#   остальные — только свои.
+# Действия над чужими данными (принять/вернуть проект, изменить профиль)
+# доступны только непосредственному руководителю владельца.
+# Область видимости считается один раз на запрос (хранится на объекте
+# пользователя) и кэшируется между запросами. Запись в кэше помечена общей
+# версией, которая меняется при сохранении или удалении любого профиля
+# (начальник, роль, отдел): смена начальника меняет области всех его
+# руководителей вверх по иерархии.
+
+MANAGER_ROLES = ('manager', 'sector_manager')
+VERSION_KEY = 'visibility:ver'
+
+
+def _cache_key(user_id):
+    return f'visibility:user:{user_id}'
+
+
+def bump_version():
+    """Инвалидирует закэшированные области видимости всех пользователей"""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def _compute(user):
+    profile = Profile.objects.filter(user=user).values('pk', 'role', 'department_id', 'path').first()
+    if profile is None:
+        return {'profile_id': None, 'role': None, 'department_id': None, 'owners': [], 'direct': []}
+    owners, direct = [], []
+    if profile['role'] in MANAGER_ROLES:
+        # Всё поддерево одним запросом; непосредственные подчинённые — его часть.
+        # Пока путь не построен (rebuild_profile_paths), видны только непосредственные
+        if profile['path']:
+            rows = hierarchy.descendants(Profile(pk=profile['pk'], path=profile['path']))
+        else:
+            rows = Profile.objects.filter(manager_id=profile['pk'])
+        for user_id, manager_id in rows.values_list('user_id', 'manager_id'):
+            owners.append(user_id)
+            if manager_id == profile['pk']:
+                direct.append(user_id)
+    elif profile['role'] == 'director':
+        # Директор видит всех; очередь проверки — только непосредственных подчинённых
+        direct = list(Profile.objects.filter(manager_id=profile['pk']).values_list('user_id', flat=True))
+    return {
+        'profile_id': profile['pk'],
+        'role': profile['role'],
+        'department_id': profile['department_id'],
+        'owners': owners,
+        'direct': direct,
+    }
+
+
+def _load(user):
+    key = _cache_key(user.pk)
+    cached = cache.get_many([VERSION_KEY, key])
+    version = cached.get(VERSION_KEY)
+    entry = cached.get(key)
+    if version is not None and entry is not None and entry['version'] == version:
+        return entry
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    entry = {**_compute(user), 'version': version}
+    cache.set(key, entry, settings.VISIBILITY_CACHE_TIMEOUT)
+    return entry
+
+
+class Scope:
+    """Область видимости пользователя: фильтр выборок и проверки доступа"""
+
+    def __init__(self, user, entry):
+        self.user_id = user.pk
+        self.role = entry['role']
+        self.profile_id = entry['profile_id']
+        self.department_id = entry['department_id']
+        self.sees_all = user.is_superuser or self.role == 'director'
+        # Пользователи, чьи данные видны (кроме своих), и непосредственные подчинённые
+        self.subordinate_ids = frozenset(entry['owners'])
+        self.direct_ids = frozenset(entry['direct'])
+
+    @property
+    def owner_ids(self):
+        """Видимые владельцы; None — все"""
+        return None if self.sees_all else self.subordinate_ids | {self.user_id}
+
+    def can_view(self, owner_id):
+        return self.sees_all or owner_id == self.user_id or owner_id in self.subordinate_ids
+
+    def filter(self, queryset, field='user'):
+        """Оставляет в выборке только данные видимых владельцев"""
+        if self.sees_all:
+            return queryset
+        return queryset.filter(**{f'{field}__in': list(self.owner_ids)})
+
+    def is_direct_manager(self, owner_id):
+        """Пользователь — непосредственный руководитель владельца"""
+        return self.role in MANAGER_ROLES and owner_id != self.user_id and owner_id in self.direct_ids
+
+
+def scope(user):
+    """Область видимости пользователя; считается один раз на запрос"""
+    current = getattr(user, '_visibility_scope', None)
+    if current is None:
+        current = Scope(user, _load(user))
+        user._visibility_scope = current
+    return current
+
+
+# Обработчики сигналов
+
+def profile_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    bump_version()
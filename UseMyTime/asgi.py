@@ -5,6 +5,14 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Под ASGI (процесс events в Procfile: gunicorn с UvicornWorker) работает только
+поток событий для шапки (projects.views.live_events): он держит долгие
+соединения, которые под WSGI заняли бы по рабочему потоку на каждую вкладку.
+Остальные запросы обслуживает WSGI (wsgi.py), прокси направляет сюда только
+адрес потока. Под ASGI Django читает синхронный потоковый ответ целиком
+в память до отправки (выгрузка CSV, отчёты, скачивание вложений), поэтому
+прочие адреса здесь не обслуживаются.
 """
 
 import os
@@ -13,4 +21,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.urls import reverse  # noqa: E402 — после настройки Django
+
+_events_path = reverse('live_events')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] != _events_path:
+        await send({'type': 'http.response.start', 'status': 404,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': b'Not Found'})
+        return
+    await django_application(scope, receive, send)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Task, Project, TaskAttachment, ProjectAttachment
+from .models import Task, Project, TaskAttachment, ProjectAttachment, TimerEvent
 
 # Настройка отображения Проектов
 class ProjectAttachmentInline(admin.TabularInline):
@@ -51,3 +51,20 @@ class TaskAdmin(admin.ModelAdmin):
         updated = queryset.update(status='in_progress', is_done=False)
         self.message_user(request, f'Возвращено в работу: {updated}')
     reject_to_in_progress.short_description = 'Вернуть в работу'
+
+
+# Журнал событий таймеров (только просмотр: разбор спорных случаев)
+@admin.register(TimerEvent)
+class TimerEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'project', 'task', 'kind', 'occurred_at', 'compacted_at']
+    search_fields = ['user__username', 'project__title']
+    list_filter = ['kind', 'occurred_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -4,4 +4,31 @@ class ProjectsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'projects'
     verbose_name = 'Проекты пользователей'
-    
\ No newline at end of file
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.models.signals import post_save, post_delete, pre_save
+        from . import bus
+        from .models import Project, ProjectTimer, Task, TimeEntry
+
+        # Изменения проектов, задач, времени и таймеров публикуются в шину событий
+        for model, handler in ((Project, bus.project_changed),
+                               (Task, bus.task_changed),
+                               (TimeEntry, bus.time_entry_changed),
+                               (ProjectTimer, bus.timer_changed)):
+            post_save.connect(handler, sender=model, dispatch_uid=f'bus_{model.__name__}_save')
+            post_delete.connect(handler, sender=model, dispatch_uid=f'bus_{model.__name__}_delete')
+
+        # Суточные итоги для записей времени, сохранённых по одной (админка, shell)
+        from . import services
+        pre_save.connect(services.time_entry_pre_save, sender=TimeEntry, dispatch_uid='rollup_TimeEntry_pre_save')
+        post_save.connect(services.time_entry_saved, sender=TimeEntry, dispatch_uid='rollup_TimeEntry_save')
+        post_delete.connect(services.time_entry_deleted, sender=TimeEntry, dispatch_uid='rollup_TimeEntry_delete')
+
+        # Собираемый файл загрузки удаляется вместе с сессией
+        from . import uploads
+        from .models import UploadSession
+        post_delete.connect(uploads.session_deleted, sender=UploadSession, dispatch_uid='uploads_UploadSession_delete')
+
+        # Веб-процесс начинает слушать события других процессов с первого запроса
+        request_started.connect(lambda **kwargs: bus.start(), weak=False, dispatch_uid='bus_start')
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .models import Project, Task
+
+logger = logging.getLogger(__name__)
+
+# Шина изменений между рабочими процессами
+# Событие — компактный словарь {'model': 'project', 'id': 5, 'user': 3, 'action': 'save'},
+# где user — владелец данных (пользователь, чьи отчёты, таймер и счётчики затронуты),
+# id — None, если событие сообщает о пачке записей владельца.
+# Событие публикуется после фиксации транзакции: подписчики своего процесса
+# вызываются сразу, остальные процессы получают его через бэкенд:
+#   memory   — только текущий процесс (SQLite, тесты, runserver);
+#   postgres — LISTEN/NOTIFY, фоновый поток слушает канал в каждом процессе.
+# Подписчики вызываются из разных потоков и не должны долго блокировать.
+
+# Метка процесса: свои уведомления из канала повторно не обрабатываются
+_origin = uuid.uuid4().hex
+_subscribers = []
+_lock = threading.Lock()
+_backend = None
+
+
+def subscribe(callback):
+    """Регистрирует обработчик событий; возвращает его для последующей отписки"""
+    with _lock:
+        _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def _dispatch(event):
+    with _lock:
+        callbacks = list(_subscribers)
+    for callback in callbacks:
+        try:
+            callback(event)
+        except Exception:
+            logger.exception('Ошибка обработчика события %s', event)
+
+
+def publish(model, pk, user_id, action='save'):
+    """Публикует событие об изменении после фиксации текущей транзакции"""
+    event = {'model': model, 'id': pk, 'user': user_id, 'action': action}
+
+    def send():
+        _dispatch(event)
+        get_backend().send({**event, 'origin': _origin})
+
+    transaction.on_commit(send)
+
+
+class MemoryBackend:
+    """Без межпроцессной доставки: события видны только своему процессу"""
+
+    def send(self, event):
+        pass
+
+    def start(self):
+        pass
+
+
+class PostgresBackend:
+    """Доставка событий другим процессам через LISTEN/NOTIFY"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._thread = None
+
+    def send(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def start(self):
+        with _lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._listen_forever, name='event-bus', daemon=True)
+        self._thread.start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Шина событий: соединение потеряно, переподключение')
+                time.sleep(5)
+            finally:
+                # Обработчики могли открыть соединения Django в этом потоке
+                close_old_connections()
+
+    def _listen(self):
+        # Отдельное соединение вне пула Django: оно всё время занято ожиданием
+        conn = connection.get_new_connection(connection.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                if not select.select([conn], [], [], 60)[0]:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    event = json.loads(conn.notifies.pop(0).payload)
+                    if event.pop('origin', None) != _origin:
+                        _dispatch(event)
+                close_old_connections()
+        finally:
+            conn.close()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = settings.EVENT_BUS_BACKEND
+        if name == 'auto':
+            name = 'postgres' if connection.vendor == 'postgresql' else 'memory'
+        _backend = PostgresBackend(settings.EVENT_BUS_CHANNEL) if name == 'postgres' else MemoryBackend()
+    return _backend
+
+
+def start():
+    """Запускает приём событий других процессов (вызывается веб-процессами и обработчиками)"""
+    get_backend().start()
+
+
+class AsyncSubscription:
+    """
+    Подписка для асинхронного кода (потоки событий SSE).
+    События копятся с момента создания, поэтому изменение между чтением
+    состояния и ожиданием не теряется.
+    """
+
+    def __init__(self, predicate):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._predicate = predicate
+        subscribe(self._on_event)
+
+    def _on_event(self, event):
+        if self._predicate(event):
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    async def wait(self, timeout):
+        """True — были подходящие события, False — истёк таймаут"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._changed.clear()
+        return True
+
+    def close(self):
+        unsubscribe(self._on_event)
+
+
+# Публикация изменений моделей (обработчики post_save/post_delete)
+
+def _action(kwargs):
+    return 'save' if 'created' in kwargs else 'delete'
+
+
+def project_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    publish('project', instance.pk, instance.user_id, _action(kwargs))
+
+
+def _task_owner(task):
+    # Владелец — из уже загруженного проекта, иначе только user_id без загрузки проекта
+    if not task.project_id:
+        return None
+    if Task.project.is_cached(task):
+        return task.project.user_id
+    return Project.objects.filter(pk=task.project_id).values_list('user_id', flat=True).first()
+
+
+def task_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    publish('task', instance.pk, _task_owner(instance), _action(kwargs))
+
+
+def time_entry_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    publish('timeentry', instance.pk, instance.user_id, _action(kwargs))
+
+
+def timer_changed(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    publish('projecttimer', instance.pk, instance.user_id, _action(kwargs))
@@ -0,0 +1,152 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+# Выдача файлов (вложений) после проверки прав
+# ATTACHMENT_DELIVERY:
+#   python   — файл отдаёт Django: ETag/Last-Modified (повторная загрузка — 304)
+#              и запросы диапазонов Range (докачка — 206);
+#   accel    — передача прокси nginx заголовком X-Accel-Redirect на внутренний
+#              location ATTACHMENT_ACCEL_PREFIX, который смотрит в MEDIA_ROOT;
+#   sendfile — заголовок X-Sendfile с путём к файлу (Apache mod_xsendfile,
+#              lighttpd); диапазоны и кэширование берёт на себя сервер.
+# При передаче прокси рабочий процесс освобождается сразу после проверки прав.
+# Под ASGI синхронный итератор ответа Django читает целиком в память до отправки,
+# поэтому там файл отдаётся асинхронным генератором (чтение блоков в потоке).
+
+_READ_BLOCK = 64 * 1024
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _content_type(filename):
+    content_type, encoding = mimetypes.guess_type(filename)
+    # Сжатые архивы отдаём как есть, без Content-Encoding
+    return 'application/octet-stream' if encoding or not content_type else content_type
+
+
+def _byte_range(header, size):
+    """
+    (начало, конец включительно) из заголовка Range; None — отдать файл
+    целиком (нет заголовка, несколько диапазонов, неизвестный формат);
+    ValueError — диапазон за пределами файла (у пустого файла — любой)
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    if size == 0:
+        # В пустом файле нет ни одного байта, который можно было бы выбрать
+        raise ValueError('Пустой файл')
+    start, end = match.groups()
+    if not start:
+        # Последние N байт
+        length = int(end)
+        if length == 0:
+            raise ValueError('Пустой диапазон')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError('Диапазон за пределами файла')
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length:
+            block = handle.read(min(_READ_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+async def _aread_range(path, start, length):
+    handle = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+    try:
+        await sync_to_async(handle.seek, thread_sensitive=False)(start)
+        while length:
+            block = await sync_to_async(handle.read, thread_sensitive=False)(min(_READ_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        handle.close()
+
+
+def _offloaded(fieldfile, filename):
+    response = HttpResponse(content_type=_content_type(filename))
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    if settings.ATTACHMENT_DELIVERY == 'accel':
+        response['X-Accel-Redirect'] = settings.ATTACHMENT_ACCEL_PREFIX.rstrip('/') + '/' + quote(fieldfile.name)
+    else:
+        response['X-Sendfile'] = fieldfile.path
+    return response
+
+
+def _range_matches(request, etag, last_modified):
+    # If-Range: диапазон отдаётся, только если файл не изменился.
+    # Сравнение только сильное (RFC 9110, 13.1.5): слабый ETag (W/...) не совпадает никогда
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('W/'):
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve(request, fieldfile, filename):
+    """Ответ со скачиванием файла из FileField по способу ATTACHMENT_DELIVERY"""
+    if settings.ATTACHMENT_DELIVERY in ('accel', 'sendfile'):
+        return _offloaded(fieldfile, filename)
+
+    path = fieldfile.path
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # Не совпавший If-Range отменяет Range: файл отдаётся целиком (RFC 9110, 13.1.5)
+    range_header = request.headers.get('Range') if _range_matches(request, etag, last_modified) else None
+    try:
+        byte_range = _byte_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None and isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_aread_range(path, 0, size), content_type=_content_type(filename))
+        response['Content-Length'] = str(size)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    elif byte_range is None:
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename,
+                                content_type=_content_type(filename))
+    else:
+        start, end = byte_range
+        read = _aread_range if isinstance(request, ASGIRequest) else _read_range
+        response = StreamingHttpResponse(read(path, start, end - start + 1), status=206,
+                                         content_type=_content_type(filename))
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Вложения доступны не всем: промежуточные кэши их хранить не должны
+    response['Cache-Control'] = 'private, no-cache'
+    return response
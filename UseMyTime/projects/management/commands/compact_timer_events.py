@@ -0,0 +1,43 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from projects import timers
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Сводит журнал событий таймеров в записи времени и общее время проектов (запускается отдельным процессом)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать накопленные события и завершиться')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Пауза между опросами пустого журнала, сек.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько событий сводить за одну транзакцию')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                processed = timers.compact(batch_size=options['batch_size'])
+            except Exception:
+                # Порция откатилась целиком и будет сведена повторно;
+                # процесс продолжает работу
+                logger.exception('Ошибка сжатия журнала таймеров')
+                if options['once']:
+                    raise
+                time.sleep(options['interval'])
+                continue
+            if processed:
+                self.stdout.write(f'Учтено событий: {processed}')
+                continue
+            # Журнал пуст — переносим в базу сигналы открытых страниц
+            timers.flush_heartbeats()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import uploads
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные загрузки вложений вместе с недокачанными файлами. Для cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=settings.UPLOAD_SESSION_MAX_AGE_HOURS,
+                            help='Загрузка считается брошенной, если части не приходили дольше (часов)')
+
+    def handle(self, *args, **options):
+        if options['hours'] <= 0:
+            raise CommandError('Порог должен быть больше нуля')
+        purged = uploads.purge(timedelta(hours=options['hours']))
+        self.stdout.write(f'Удалено загрузок: {purged}')
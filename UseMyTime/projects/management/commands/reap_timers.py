@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import timers
+
+
+class Command(BaseCommand):
+    help = 'Останавливает забытые таймеры (страница молчит или таймер идёт дольше порога). Для cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-hours', type=float, default=settings.TIMER_REAP_AFTER_HOURS,
+                            help='Таймер без сигналов страницы считается забытым, если идёт дольше (часов)')
+        parser.add_argument('--silence-minutes', type=float, default=settings.TIMER_HEARTBEAT_TIMEOUT_MINUTES,
+                            help='Таймер считается забытым, если страница молчит дольше (минут)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать таймеры, ничего не меняя')
+
+    def handle(self, *args, **options):
+        if options['idle_hours'] <= 0 or options['silence_minutes'] <= 0:
+            raise CommandError('Порог должен быть больше нуля')
+        idle = timedelta(hours=options['idle_hours'])
+        silence = timedelta(minutes=options['silence_minutes'])
+        reaped = timers.reap(idle, silence, dry_run=options['dry_run'])
+        for user_id, project_id, started_at, ended_at in reaped:
+            self.stdout.write(f'Пользователь {user_id}, проект {project_id}: '
+                              f'{started_at:%Y-%m-%d %H:%M} — {ended_at:%Y-%m-%d %H:%M}')
+        verb = 'Будет остановлено' if options['dry_run'] else 'Остановлено'
+        self.stdout.write(f'{verb} таймеров: {len(reaped)}')
@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from accounts.reports import parse_report_date, period_bounds
+from projects.models import DailyWorkRollup, TimeEntry
+from projects.services import rollup_rows
+
+
+# Разовая ручная команда (после loaddata), не часть запуска приложения: порция
+# итогов удаляется и создаётся заново, а параллельная запись времени за те же дни
+# прибавляла бы к строкам, которые сейчас перестраиваются. Запускать при
+# остановленных процессах web и timers.
+
+class Command(BaseCommand):
+    help = 'Перестраивает суточные итоги DailyWorkRollup по записям TimeEntry (порциями по дням)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Начальная дата YYYY-MM-DD (по умолчанию — первая запись)')
+        parser.add_argument('--until', help='Конечная дата YYYY-MM-DD (по умолчанию — последняя запись)')
+        parser.add_argument('--chunk-days', type=int, default=7,
+                            help='Сколько дней перестраивать за одну транзакцию')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = parse_report_date(options['since'])
+        until = parse_report_date(options['until'])
+        if options['since'] and not since or options['until'] and not until:
+            raise CommandError('Даты указываются в формате YYYY-MM-DD')
+
+        bounds = TimeEntry.objects.aggregate(first=Min('started_at'), last=Max('ended_at'))
+        if bounds['first'] is None:
+            self.stdout.write('Записей времени нет')
+            return
+        since = since or bounds['first'].date()
+        until = until or bounds['last'].date()
+
+        chunk_start = since
+        while chunk_start <= until:
+            chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), until)
+            rows = self.rebuild_chunk(chunk_start, chunk_end, options['batch_size'])
+            self.stdout.write(f'{chunk_start} — {chunk_end}: {rows} строк итогов')
+            chunk_start = chunk_end + timedelta(days=1)
+
+    def rebuild_chunk(self, chunk_start, chunk_end, batch_size):
+        start, end = period_bounds(chunk_start, chunk_end)
+        with transaction.atomic():
+            entries = (
+                TimeEntry.objects
+                .filter(started_at__lt=end, ended_at__gt=start)
+                .values_list('user_id', 'project_id', 'task_id', 'started_at', 'ended_at')
+                .iterator(chunk_size=batch_size)
+            )
+            rollups = [
+                DailyWorkRollup(user_id=user_id, project_id=project_id, task_id=task_id,
+                                date=day, seconds=seconds, entries=count)
+                for (user_id, project_id, task_id, day), (seconds, count) in rollup_rows(entries).items()
+                # Части записей за соседние дни перестраиваются в своих порциях
+                if chunk_start <= day <= chunk_end
+            ]
+            DailyWorkRollup.objects.filter(date__gte=chunk_start, date__lte=chunk_end).delete()
+            DailyWorkRollup.objects.bulk_create(rollups, batch_size=batch_size)
+        return len(rollups)
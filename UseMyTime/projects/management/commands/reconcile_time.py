@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DurationField, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from accounts.reports import parse_report_date, period_bounds
+from projects import bus
+from projects.models import Project, TimeEntry
+
+
+class Command(BaseCommand):
+    help = 'Сверяет общее время проектов с суммой записей TimeEntry и исправляет расхождения порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Сверять только проекты с записями времени начиная с даты YYYY-MM-DD')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько проектов исправлять одним запросом')
+
+    def handle(self, *args, **options):
+        since = parse_report_date(options['since'])
+        if options['since'] and not since:
+            raise CommandError('Дата указывается в формате YYYY-MM-DD')
+
+        # Сумма записей и общее время читаются одним сгруппированным запросом
+        projects = Project.objects.values('pk', 'user_id', 'total_time').annotate(
+            entry_seconds=Coalesce(Sum('time_entries__seconds'), 0))
+        if since:
+            start, _ = period_bounds(since)
+            projects = projects.filter(
+                pk__in=TimeEntry.objects.filter(ended_at__gte=start).values('project_id'))
+        rows = projects.values_list('pk', 'user_id', 'total_time', 'entry_seconds').order_by('pk')
+
+        drifted = []
+        verbose = options['dry_run'] or options['verbosity'] > 1
+        for project_id, user_id, total_time, entry_seconds in rows.iterator(chunk_size=options['chunk_size']):
+            delta = timedelta(seconds=entry_seconds) - total_time
+            if not delta:
+                continue
+            drifted.append((project_id, user_id, delta))
+            if verbose:
+                self.stdout.write(f'Проект {project_id}: {total_time} -> {timedelta(seconds=entry_seconds)}')
+
+        if not options['dry_run']:
+            for index in range(0, len(drifted), options['chunk_size']):
+                self.fix_chunk(drifted[index:index + options['chunk_size']])
+        total_drift = sum((delta for _, _, delta in drifted), timedelta(0))
+        verb = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(f'{verb} расхождений: {len(drifted)} (в сумме {total_drift})')
+
+    def fix_chunk(self, chunk):
+        # Поправка прибавляется к текущему значению: остановки таймеров во время
+        # сверки (F() в projects.timers) не затираются
+        with transaction.atomic():
+            Project.objects.filter(pk__in=[project_id for project_id, _, _ in chunk]).update(
+                total_time=Case(
+                    *[When(pk=project_id, then=F('total_time') + Value(delta, output_field=DurationField()))
+                      for project_id, _, delta in chunk],
+                    output_field=DurationField(),
+                ))
+            # update() не вызывает сигналы: сбрасываем кэши отчётов и навигации
+            for project_id, user_id, _ in chunk:
+                bus.publish('project', project_id, user_id)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_timeentry_period_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWorkRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('seconds', models.PositiveIntegerField(default=0, verbose_name='Секунды')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='Записей времени')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='projects.project', verbose_name='Проект')),
+                ('task', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='projects.task', verbose_name='Задача')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог за день',
+                'verbose_name_plural': 'Итоги за день',
+                'indexes': [models.Index(fields=['user', 'date'], name='rollup_user_date_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('task__isnull', False)), fields=('user', 'project', 'task', 'date'), name='uniq_rollup_user_project_task_date'), models.UniqueConstraint(condition=models.Q(('task__isnull', True)), fields=('user', 'project', 'date'), name='uniq_rollup_user_project_date_no_task')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fold_active_projects(apps, schema_editor):
+    # Активные проекты (ActiveProject) переносятся в таймеры: отметка is_active,
+    # а идущий отсчёт — в таймер того же проекта. Если идут оба, оставляем
+    # более ранний старт: оба отрезка длятся до текущего момента.
+    ActiveProject = apps.get_model('projects', 'ActiveProject')
+    ProjectTimer = apps.get_model('projects', 'ProjectTimer')
+    for active in ActiveProject.objects.exclude(project=None).iterator():
+        timer, _ = ProjectTimer.objects.get_or_create(user_id=active.user_id, project_id=active.project_id)
+        timer.is_active = True
+        if active.in_work and active.last_started_at:
+            if not timer.in_work or not timer.last_started_at or active.last_started_at < timer.last_started_at:
+                timer.last_started_at = active.last_started_at
+            timer.in_work = True
+        timer.save()
+
+
+def unfold_active_projects(apps, schema_editor):
+    ActiveProject = apps.get_model('projects', 'ActiveProject')
+    ProjectTimer = apps.get_model('projects', 'ProjectTimer')
+    for timer in ProjectTimer.objects.filter(is_active=True).iterator():
+        ActiveProject.objects.update_or_create(user_id=timer.user_id, defaults={'project_id': timer.project_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0013_dailyworkrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projecttimer',
+            name='is_active',
+            field=models.BooleanField(default=False, verbose_name='Активный проект'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttimer',
+            index=models.Index(fields=['user', 'in_work'], name='timer_user_in_work_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='projecttimer',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user',), name='uniq_user_active_timer'),
+        ),
+        migrations.RunPython(fold_active_projects, unfold_active_projects),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0014_projecttimer_is_active'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ActiveProject',
+        ),
+    ]
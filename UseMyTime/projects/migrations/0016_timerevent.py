@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_delete_activeproject'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('start', 'Запуск'), ('stop', 'Остановка')], max_length=10, verbose_name='Событие')),
+                ('occurred_at', models.DateTimeField(verbose_name='Время события')),
+                ('compacted_at', models.DateTimeField(blank=True, null=True, verbose_name='Учтено')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timer_events', to='projects.project', verbose_name='Проект')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='timer_events', to='projects.task', verbose_name='Задача')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timer_events', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Событие таймера',
+                'verbose_name_plural': 'События таймеров',
+                'indexes': [models.Index(condition=models.Q(('compacted_at__isnull', True)), fields=['user', 'id'], name='timerevent_pending_idx'), models.Index(fields=['user', 'occurred_at'], name='timerevent_user_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0016_timerevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timerevent',
+            name='client_id',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Ключ клиента'),
+        ),
+        migrations.AddField(
+            model_name='timerevent',
+            name='recorded_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Получено'),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='timerevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_id', ''), _negated=True), fields=('user', 'client_id'), name='uniq_timerevent_user_client_id'),
+        ),
+    ]
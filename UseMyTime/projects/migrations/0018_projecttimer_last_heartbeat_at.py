@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0017_timerevent_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projecttimer',
+            name='last_heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний сигнал'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def fill_rollups(apps, schema_editor):
+    # Итоги за прошлые периоды по уже существующим записям времени
+    # (таблица итогов создана пустой в 0013). Разбивка по дням повторяет
+    # projects.services.rollup_rows на момент миграции: код приложения может
+    # измениться, а миграция должна давать тот же результат
+    TimeEntry = apps.get_model('projects', 'TimeEntry')
+    DailyWorkRollup = apps.get_model('projects', 'DailyWorkRollup')
+    entries = TimeEntry.objects.values_list(
+        'user_id', 'project_id', 'task_id', 'started_at', 'ended_at').iterator(chunk_size=1000)
+
+    totals = defaultdict(lambda: [0, 0])
+    for user_id, project_id, task_id, started_at, ended_at in entries:
+        current = timezone.localtime(started_at)
+        ended_at = timezone.localtime(ended_at)
+        while current < ended_at:
+            next_day = timezone.make_aware(datetime.combine(current.date() + timedelta(days=1), time.min))
+            part_end = min(next_day, ended_at)
+            row = totals[(user_id, project_id, task_id, current.date())]
+            row[0] += int((part_end - current).total_seconds())
+            row[1] += 1
+            current = part_end
+
+    rollups = [
+        DailyWorkRollup(user_id=user_id, project_id=project_id, task_id=task_id,
+                        date=day, seconds=seconds, entries=count)
+        for (user_id, project_id, task_id, day), (seconds, count) in totals.items()
+    ]
+    DailyWorkRollup.objects.all().delete()
+    DailyWorkRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0020_uploadsession'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
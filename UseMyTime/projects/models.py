@@ -1,7 +1,6 @@
 from django.db import models
 from django.conf import settings
 from datetime import timedelta
-from django.utils import timezone
 
 # Модель проектов
 class Project(models.Model):
@@ -52,55 +51,41 @@ class Project(models.Model):
     class Meta:
         verbose_name = 'Проект'
         verbose_name_plural = 'Проекты'
+        # Списки проектов (активные, архив, очередь проверки) выводятся
+        # постранично по ключу (created_at, id) от новых к старым
+        indexes = [
+            models.Index(fields=['user', 'is_archived', 'created_at', 'id'], name='project_user_archived_idx'),
+            models.Index(fields=['review_status', 'created_at', 'id'], name='project_review_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
-# Модель активного проекта
-# Используется для отслеживания текущего проекта пользователя
-class ActiveProject(models.Model):
-    user = models.OneToOneField(settings.AUTH_USER_MODEL,
-                                on_delete=models.CASCADE,
-                                related_name='active_project')
-    project = models.ForeignKey(Project, 
-                                on_delete=models.CASCADE, 
-                                null=True, blank=True)
-    in_work = models.BooleanField(default=False, verbose_name='Запущен')
-    last_started_at = models.DateTimeField(null=True, blank=True, verbose_name='Время запуска')
-
-    class Meta:
-        verbose_name = 'Активный проект'
-        verbose_name_plural = 'Активные проекты'
-
 # Таймеры по проектам (независимые, можно запускать несколько одновременно)
-# Позволяют вести учёт времени по разным проектам одновременно
+# Позволяют вести учёт времени по разным проектам одновременно.
+# Состояние таймеров: is_active отмечает «активный проект» пользователя (в шапке),
+# in_work и last_started_at сводятся из журнала TimerEvent (projects.timers)
 class ProjectTimer(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='project_timers', verbose_name='Пользователь')
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='timers', verbose_name='Проект')
     current_task = models.ForeignKey('Task', on_delete=models.SET_NULL, null=True, blank=True, related_name='running_timers', verbose_name='Текущая задача')
     in_work = models.BooleanField(default=False, verbose_name='Идёт отсчёт')
+    is_active = models.BooleanField(default=False, verbose_name='Активный проект')
     last_started_at = models.DateTimeField(null=True, blank=True, verbose_name='Время запуска')
-
-    def start(self, program=None):
-        if self.in_work:
-            return
-        self.in_work = True
-        self.last_started_at = timezone.now()
-        self.save()
-
-    def stop(self):
-        if not self.in_work or not self.last_started_at:
-            return timedelta(0)
-        duration = timezone.now() - self.last_started_at
-        self.in_work = False
-        self.save()
-        return duration
+    # Последний сигнал открытой страницы (пишется пакетами из кэша, см. projects.timers)
+    last_heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний сигнал')
 
     class Meta:
         verbose_name = 'Таймер проекта'
         verbose_name_plural = 'Таймеры проектов'
         constraints = [
-            models.UniqueConstraint(fields=['user', 'project'], name='uniq_user_project_timer')
+            models.UniqueConstraint(fields=['user', 'project'], name='uniq_user_project_timer'),
+            models.UniqueConstraint(fields=['user'], condition=models.Q(is_active=True),
+                                    name='uniq_user_active_timer'),
+        ]
+        # Состояние таймеров пользователя читается одним запросом по (user, in_work)
+        indexes = [
+            models.Index(fields=['user', 'in_work'], name='timer_user_in_work_idx'),
         ]
 
 # Модель подзадач проекта
@@ -128,6 +113,14 @@ class Task(models.Model):
     class Meta:
         verbose_name = 'Задача'
         verbose_name_plural = 'Задачи'
+        # Список задач пользователя (MyTasksView) — постранично по ключу
+        # (created_at, id) среди задач его проектов. Индекс ведёт от проекта:
+        # читаются только задачи проектов пользователя, а не вся таблица по
+        # дате. Задачи нескольких проектов база сливает сортировкой, поэтому
+        # цена страницы растёт с числом задач пользователя (но не всех задач)
+        indexes = [
+            models.Index(fields=['project', 'created_at', 'id'], name='task_project_created_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -156,6 +149,72 @@ class TimeEntry(models.Model):
     class Meta:
         verbose_name = 'Запись времени'
         verbose_name_plural = 'Записи времени'
+        # Выборки за период по сотрудникам (отчёты): начало и конец записи
+        indexes = [
+            models.Index(fields=['user', 'started_at'], name='timeentry_user_started_idx'),
+            models.Index(fields=['user', 'ended_at'], name='timeentry_user_ended_idx'),
+        ]
+
+# Журнал событий таймеров (только добавление)
+# Запуск, остановка и смена задачи — вставка строки без изменения других таблиц.
+# Фоновое сжатие (projects.timers.compact) сводит события в состояние ProjectTimer,
+# записи TimeEntry и общее время проектов и отмечает их compacted_at; сами
+# события не удаляются и остаются журналом для разбора спорных случаев.
+class TimerEvent(models.Model):
+    KIND_CHOICES = (
+        ('start', 'Запуск'),
+        ('stop', 'Остановка'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timer_events', verbose_name='Пользователь')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='timer_events', verbose_name='Проект')
+    task = models.ForeignKey(Task, on_delete=models.SET_NULL, null=True, blank=True, related_name='timer_events', verbose_name='Задача')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name='Событие')
+    occurred_at = models.DateTimeField(verbose_name='Время события')
+    # Ключ идемпотентности события из браузера (синхронизация пакетом), пусто — событие сервера
+    client_id = models.CharField(max_length=64, blank=True, default='', verbose_name='Ключ клиента')
+    recorded_at = models.DateTimeField(auto_now_add=True, verbose_name='Получено')
+    compacted_at = models.DateTimeField(null=True, blank=True, verbose_name='Учтено')
+
+    class Meta:
+        verbose_name = 'Событие таймера'
+        verbose_name_plural = 'События таймеров'
+        indexes = [
+            # Очередь на сжатие и несжатые события пользователя (состояние таймеров)
+            models.Index(fields=['user', 'id'], condition=models.Q(compacted_at__isnull=True),
+                         name='timerevent_pending_idx'),
+            models.Index(fields=['user', 'occurred_at'], name='timerevent_user_time_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_id'], condition=~models.Q(client_id=''),
+                                    name='uniq_timerevent_user_client_id'),
+        ]
+
+# Суточные итоги отработанного времени (user, project, task, date)
+# Обновляются при каждой записи TimeEntry (projects.services.record_time_entry),
+# перестраиваются командой rebuild_work_rollup. Отчёты за период читают их
+# вместо сырых записей времени.
+class DailyWorkRollup(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_rollups', verbose_name='Пользователь')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='daily_rollups', verbose_name='Проект')
+    # Без ограничения целостности: при удалении задачи её время остаётся в итогах проекта
+    task = models.ForeignKey(Task, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+', verbose_name='Задача')
+    date = models.DateField(verbose_name='Дата')
+    seconds = models.PositiveIntegerField(default=0, verbose_name='Секунды')
+    entries = models.PositiveIntegerField(default=0, verbose_name='Записей времени')
+
+    class Meta:
+        verbose_name = 'Итог за день'
+        verbose_name_plural = 'Итоги за день'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'project', 'task', 'date'], condition=models.Q(task__isnull=False),
+                                    name='uniq_rollup_user_project_task_date'),
+            models.UniqueConstraint(fields=['user', 'project', 'date'], condition=models.Q(task__isnull=True),
+                                    name='uniq_rollup_user_project_date_no_task'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'], name='rollup_user_date_idx'),
+        ]
 
 # Вложения к проектам
 # Файлы, прикреплённые при отправке на проверку
@@ -167,4 +226,27 @@ class ProjectAttachment(models.Model):
 
     class Meta:
         verbose_name = 'Вложение проекта'
-        verbose_name_plural = 'Вложения проекта'
\ No newline at end of file
+        verbose_name_plural = 'Вложения проекта'
+
+# Загрузка файла частями (возобновляемая)
+# Файл собирается на диске (UPLOAD_SESSION_DIR) по мере прихода частей;
+# received — сколько байт от начала файла уже записано и проверено по
+# контрольной сумме, с этого места загрузка продолжается после обрыва.
+# Готовый файл становится вложением проекта при отправке на проверку
+# (projects.uploads.attach), после чего сессия удаляется.
+class UploadSession(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='Проект')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='Пользователь')
+    filename = models.CharField(max_length=255, verbose_name='Имя файла')
+    size = models.BigIntegerField(verbose_name='Размер')
+    received = models.BigIntegerField(default=0, verbose_name='Получено байт')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Начало загрузки')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Последняя часть')
+
+    class Meta:
+        verbose_name = 'Загрузка файла'
+        verbose_name_plural = 'Загрузки файлов'
+
+    @property
+    def is_complete(self):
+        return self.received == self.size
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+from django.http import Http404
+
+# Постраничный вывод по ключу (keyset) для длинных списков
+# Записи идут от новых к старым по (created_at, id); курсор — ключ последней
+# записи страницы, следующая страница выбирается условием «раньше курсора»
+# по индексу. Без OFFSET и COUNT(*): стоимость страницы не зависит от глубины.
+# Есть ли следующая страница, показывает одна лишняя запись.
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(obj):
+    """Курсор записи: микросекунды created_at от эпохи и id"""
+    return f'{(obj.created_at - _EPOCH) // timedelta(microseconds=1)}_{obj.pk}'
+
+
+def decode_cursor(value):
+    """(created_at, id) из курсора; ValueError/OverflowError — курсор повреждён"""
+    micros, pk = value.split('_')
+    return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def keyset_page(queryset, cursor=None, size=30):
+    """Страница записей после курсора и курсор следующей страницы (или None)"""
+    queryset = queryset.order_by('-created_at', '-pk')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    items = list(queryset[:size + 1])
+    if len(items) <= size:
+        return items, None
+    items = items[:size]
+    return items, encode_cursor(items[-1])
+
+
+class KeysetPaginationMixin:
+    """Постраничный вывод ListView по ключу; курсор передаётся параметром cursor"""
+
+    keyset_page_size = 30
+
+    def get_context_data(self, **kwargs):
+        queryset = kwargs.pop('object_list', self.object_list)
+        try:
+            items, next_cursor = keyset_page(queryset, self.request.GET.get('cursor'), self.keyset_page_size)
+        except (ValueError, OverflowError):
+            raise Http404('Неверный курсор страницы')
+        self.object_list = items
+        context = super().get_context_data(object_list=items, **kwargs)
+        context['next_cursor'] = next_cursor
+        return context
@@ -0,0 +1,123 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import bus
+from .models import DailyWorkRollup, TimeEntry
+
+
+# Учёт отработанного времени: записи TimeEntry и суточные итоги DailyWorkRollup
+# (остановка таймеров и общее время проектов — projects.timers)
+
+def split_by_day(started_at, ended_at):
+    """Разбивает интервал по календарным дням: [(дата, секунды), ...]"""
+    parts = []
+    current = timezone.localtime(started_at)
+    ended_at = timezone.localtime(ended_at)
+    while current < ended_at:
+        next_day = timezone.make_aware(datetime.combine(current.date() + timedelta(days=1), time.min))
+        part_end = min(next_day, ended_at)
+        parts.append((current.date(), int((part_end - current).total_seconds())))
+        current = part_end
+    return parts
+
+
+def rollup_rows(entries):
+    """
+    Суточные итоги по записям времени.
+    entries — итерируемое кортежей (user_id, project_id, task_id, started_at, ended_at).
+    Возвращает {(user_id, project_id, task_id, date): [секунды, записей]}.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for user_id, project_id, task_id, started_at, ended_at in entries:
+        for day, seconds in split_by_day(started_at, ended_at):
+            row = totals[(user_id, project_id, task_id, day)]
+            row[0] += seconds
+            row[1] += 1
+    return totals
+
+
+def _add_to_rollup(user_id, project_id, task_id, day, seconds, entries):
+    lookup = {'user_id': user_id, 'project_id': project_id, 'task_id': task_id, 'date': day}
+    updated = DailyWorkRollup.objects.filter(**lookup).update(
+        seconds=F('seconds') + seconds, entries=F('entries') + entries)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            DailyWorkRollup.objects.create(seconds=seconds, entries=entries, **lookup)
+    except IntegrityError:
+        # Строку за этот день успели создать параллельно
+        DailyWorkRollup.objects.filter(**lookup).update(
+            seconds=F('seconds') + seconds, entries=F('entries') + entries)
+
+
+def _rollup_key(entry):
+    return entry.user_id, entry.project_id, entry.task_id, entry.started_at, entry.ended_at
+
+
+def _remove_from_rollup(user_id, project_id, task_id, day, seconds, entries):
+    rollups = DailyWorkRollup.objects.filter(user_id=user_id, project_id=project_id, task_id=task_id, date=day)
+    rollups.update(seconds=Greatest(F('seconds') - seconds, Value(0)),
+                   entries=Greatest(F('entries') - entries, Value(0)))
+    rollups.filter(entries=0).delete()
+
+
+def _apply_to_rollup(entries, remove=False):
+    change = _remove_from_rollup if remove else _add_to_rollup
+    for (user_id, project_id, task_id, day), (seconds, count) in rollup_rows(entries).items():
+        change(user_id, project_id, task_id, day, seconds, count)
+
+
+def record_time_entries(entries):
+    """
+    Сохраняет записи TimeEntry одним запросом и учитывает их в суточных итогах.
+    bulk_create не вызывает сигналы моделей, поэтому события в шину публикуются
+    здесь: одно на пользователя за всю пачку (подписчикам важен владелец, а не запись).
+    """
+    entries = TimeEntry.objects.bulk_create(entries)
+    _apply_to_rollup(_rollup_key(entry) for entry in entries)
+    for user_id in {entry.user_id for entry in entries}:
+        bus.publish('timeentry', None, user_id)
+    return entries
+
+
+def record_time_entry(**fields):
+    """Создаёт TimeEntry и сразу учитывает её в суточных итогах"""
+    return record_time_entries([TimeEntry(**fields)])[0]
+
+
+# Записи времени, изменённые в обход record_time_entries (админка, shell),
+# учитываются в итогах сигналами. bulk_create и загрузка фикстур (raw)
+# сигналы не вызывают: после loaddata итоги перестраиваются командой
+# rebuild_work_rollup.
+
+def time_entry_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._rollup_previous = TimeEntry.objects.filter(pk=instance.pk).values_list(
+        'user_id', 'project_id', 'task_id', 'started_at', 'ended_at').first()
+
+
+def time_entry_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = instance.__dict__.pop('_rollup_previous', None)
+    current = _rollup_key(instance)
+    if previous == current:
+        return
+    if previous:
+        _apply_to_rollup([previous], remove=True)
+    _apply_to_rollup([current])
+
+
+def time_entry_deleted(sender, instance, origin=None, **kwargs):
+    # Удаление пользователя или проекта удаляет и их итоги (CASCADE)
+    origin_model = getattr(origin, 'model', None) or getattr(getattr(origin, '_meta', None), 'model', None)
+    if origin_model is not None and origin_model is not TimeEntry:
+        return
+    _apply_to_rollup([_rollup_key(instance)], remove=True)
@@ -1,3 +1,946 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Profile
+
+from projects import bus
+from projects import timers
+from projects.pagination import keyset_page
+from projects.models import (
+    DailyWorkRollup, Project, ProjectAttachment, ProjectTimer, Task, TimeEntry, TimerEvent, UploadSession,
+)
+from projects.services import record_time_entries, record_time_entry
+
+
+def aware(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class DailyWorkRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="rollup_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Проект", description="")
+        cls.task = Task.objects.create(project=cls.project, text="Задача")
+
+    def _record(self, started_at, ended_at, task=None):
+        return record_time_entry(user=self.user, project=self.project, task=task,
+                                 started_at=started_at, ended_at=ended_at,
+                                 seconds=int((ended_at - started_at).total_seconds()))
+
+    def test_time_entry_updates_rollup_incrementally(self):
+        self._record(aware(2025, 3, 10, 9), aware(2025, 3, 10, 10), task=self.task)
+        self._record(aware(2025, 3, 10, 11), aware(2025, 3, 10, 11, 30), task=self.task)
+
+        rollup = DailyWorkRollup.objects.get(task=self.task)
+        self.assertEqual(rollup.date, date(2025, 3, 10))
+        self.assertEqual(rollup.seconds, 5400)
+        self.assertEqual(rollup.entries, 2)
+
+    def test_entry_crossing_midnight_is_split_by_day(self):
+        self._record(aware(2025, 3, 10, 23), aware(2025, 3, 11, 1))
+
+        rollups = dict(DailyWorkRollup.objects.values_list("date", "seconds"))
+        self.assertEqual(rollups, {date(2025, 3, 10): 3600, date(2025, 3, 11): 3600})
+
+    def test_rebuild_command_matches_incremental_rollup(self):
+        self._record(aware(2025, 3, 10, 23), aware(2025, 3, 11, 1), task=self.task)
+        self._record(aware(2025, 3, 20, 9), aware(2025, 3, 20, 17))
+        # Запись, созданная по одной (админка, shell), учитывается сигналом
+        TimeEntry.objects.create(user=self.user, project=self.project, started_at=aware(2025, 3, 21, 9),
+                                 ended_at=aware(2025, 3, 21, 10), seconds=3600)
+        incremental = set(DailyWorkRollup.objects.values_list("project_id", "task_id", "date", "seconds", "entries"))
+
+        call_command("rebuild_work_rollup", "--chunk-days", "3", stdout=io.StringIO())
+
+        rebuilt = set(DailyWorkRollup.objects.values_list("project_id", "task_id", "date", "seconds", "entries"))
+        self.assertEqual(rebuilt, incremental)
+        self.assertIn((self.project.id, None, date(2025, 3, 21), 3600, 1), rebuilt)
+
+    def test_edited_and_deleted_entries_update_rollup(self):
+        entry = TimeEntry.objects.create(user=self.user, project=self.project, started_at=aware(2025, 3, 10, 9),
+                                         ended_at=aware(2025, 3, 10, 10), seconds=3600)
+        self._record(aware(2025, 3, 10, 11), aware(2025, 3, 10, 11, 30))
+
+        entry.started_at, entry.ended_at = aware(2025, 3, 12, 9), aware(2025, 3, 12, 11)
+        entry.save()
+        self.assertEqual(dict(DailyWorkRollup.objects.values_list("date", "seconds")),
+                         {date(2025, 3, 10): 1800, date(2025, 3, 12): 7200})
+
+        entry.delete()
+        self.assertEqual(dict(DailyWorkRollup.objects.values_list("date", "seconds")), {date(2025, 3, 10): 1800})
+
+    def test_migration_backfills_existing_entries(self):
+        from django.apps import apps
+        from importlib import import_module
+
+        self._record(aware(2025, 3, 10, 23), aware(2025, 3, 11, 1), task=self.task)
+        expected = set(DailyWorkRollup.objects.values_list("project_id", "task_id", "date", "seconds", "entries"))
+        DailyWorkRollup.objects.all().delete()
+
+        import_module("projects.migrations.0021_backfill_dailyworkrollup").fill_rollups(apps, None)
+
+        self.assertEqual(set(DailyWorkRollup.objects.values_list("project_id", "task_id", "date", "seconds", "entries")),
+                         expected)
+
+
+@override_settings(LIVE_EVENTS_MAX_AGE=5)
+class LiveEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_user = User.objects.create_user(username="live_manager", password="managerpass")
+        Profile.objects.filter(user=cls.manager_user).update(role="manager")
+        cls.employee_user = User.objects.create_user(username="live_employee", password="employeepass")
+        Profile.objects.filter(user=cls.employee_user).update(manager=cls.manager_user.profile)
+        cls.project = Project.objects.create(user=cls.employee_user, title="Проект", description="")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_wsgi_request_falls_back_to_polling(self):
+        self.client.login(username="live_manager", password="managerpass")
+        response = self.client.get(reverse("live_events"))
+        self.assertEqual(response.status_code, 204)
+
+    def _submit_for_review(self):
+        # Событие публикуется после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.review_status = "in_review"
+            self.project.save()
+
+    async def test_review_submission_is_pushed_to_manager(self):
+        await self.async_client.alogin(username="live_manager", password="managerpass")
+        response = await self.async_client.get(reverse("live_events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+
+        self.assertTrue((await anext(events)).startswith(b"retry:"))
+        first = await anext(events)
+        self.assertIn(b'"review_count": 0', first)
+
+        # Дальше поток базу не читает: только оповещение, состояние — отдельным запросом
+        with mock.patch("accounts.navigation.live_state", side_effect=AssertionError):
+            await sync_to_async(self._submit_for_review)()
+            self.assertEqual(await anext(events), b"event: changed\ndata: {}\n\n")
+
+        state = await self.async_client.get(reverse("live_events_state"))
+        self.assertEqual(state.json()["review_count"], 1)
+
+
+class EventBusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="bus_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Проект", description="")
+
+    def setUp(self):
+        self.events = []
+        bus.subscribe(self.events.append)
+        self.addCleanup(bus.unsubscribe, self.events.append)
+
+    def test_events_are_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = Task.objects.create(project=self.project, text="Задача")
+            self.assertEqual(self.events, [])
+
+        self.assertEqual(self.events, [{"model": "task", "id": task.pk, "user": self.user.pk, "action": "save"}])
+
+    def test_task_owner_is_read_without_loading_project(self):
+        task = Task.objects.create(project=self.project, text="Задача")
+        task = Task.objects.get(pk=task.pk)
+        self.events.clear()
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            task.save()
+
+        self.assertEqual(self.events, [{"model": "task", "id": task.pk, "user": self.user.pk, "action": "save"}])
+        owner_queries = [query["sql"] for query in queries if "projects_project" in query["sql"]]
+        self.assertEqual(len(owner_queries), 1)
+        self.assertNotIn("title", owner_queries[0])
+
+    def test_time_entries_batch_publishes_one_event_per_user(self):
+        other = User.objects.create_user(username="bus_other", password="pass")
+        start = timezone.now() - timedelta(hours=1)
+        entries = [TimeEntry(user=user, project=self.project, started_at=start, ended_at=start + timedelta(minutes=1),
+                             seconds=60)
+                   for user in (self.user, self.user, self.user, other)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_time_entries(entries)
+
+        self.assertCountEqual(self.events, [
+            {"model": "timeentry", "id": None, "user": self.user.pk, "action": "save"},
+            {"model": "timeentry", "id": None, "user": other.pk, "action": "save"},
+        ])
+
+    def test_delete_is_published_with_owner(self):
+        timer = ProjectTimer.objects.create(user=self.user, project=self.project)
+        timer_id = timer.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            timer.delete()
+
+        self.assertEqual(self.events, [{"model": "projecttimer", "id": timer_id, "user": self.user.pk, "action": "delete"}])
+
+
+def _whole_seconds(duration):
+    # Общее время проекта копится целыми секундами, как TimeEntry.seconds
+    return timedelta(seconds=int(duration.total_seconds()))
+
+
+class TimerStopTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="stop_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Проект", description="")
+
+    def _start(self, minutes_ago):
+        started_at = timezone.now() - timedelta(minutes=minutes_ago)
+        return ProjectTimer.objects.create(user=self.user, project=self.project,
+                                           in_work=True, last_started_at=started_at)
+
+    def test_timer_stop_view_accumulates_time(self):
+        self._start(minutes_ago=10)
+        self.client.login(username="stop_user", password="pass")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("project_timer_stop"), {"project_id": self.project.id})
+
+        self.assertTrue(response.json()["is_success"])
+        self.project.refresh_from_db()
+        self.assertGreaterEqual(self.project.total_time, timedelta(minutes=10))
+        self.assertEqual(TimeEntry.objects.filter(project=self.project).count(), 1)
+        self.assertFalse(ProjectTimer.objects.get(project=self.project).in_work)
+
+    def test_repeated_stop_counts_session_once(self):
+        timer = self._start(minutes_ago=30)
+        now = timezone.now()
+        stale = ProjectTimer.objects.get(pk=timer.pk)
+
+        timers.stop_timers(self.user, [timer], now)
+        timers.stop_timers(self.user, [stale], now)
+        timers.compact()
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.total_time, _whole_seconds(now - timer.last_started_at))
+        self.assertEqual(TimeEntry.objects.filter(project=self.project).count(), 1)
+
+    def test_stops_of_different_sessions_do_not_overwrite_each_other(self):
+        timer = self._start(minutes_ago=60)
+        other_user = User.objects.create_user(username="stop_other", password="pass")
+        other = ProjectTimer.objects.create(user=other_user, project=self.project, in_work=True,
+                                            last_started_at=timezone.now() - timedelta(minutes=30))
+        now = timezone.now()
+
+        # Обе остановки работают с устаревшими копиями проекта
+        timers.stop_timers(other_user, [other], now)
+        timers.stop_timers(self.user, [timer], now)
+        timers.compact()
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.total_time,
+                         _whole_seconds(now - timer.last_started_at) + _whole_seconds(now - other.last_started_at))
+
+    def test_task_done_stops_timer_in_same_transaction(self):
+        self.client.login(username="stop_user", password="pass")
+        started_at = timezone.now() - timedelta(minutes=10)
+        task = Task.objects.create(project=self.project, text="Задача", status="in_progress",
+                                   started_at=started_at)
+        ProjectTimer.objects.create(user=self.user, project=self.project, in_work=True,
+                                    last_started_at=started_at, current_task=task)
+
+        # Сбой остановки таймера откатывает и смену статуса
+        with mock.patch("projects.views.timers.stop_timers", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse("change_task_status", args=[task.id]))
+        task.refresh_from_db()
+        self.assertEqual(task.status, "in_progress")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("change_task_status", args=[task.id]))
+
+        self.assertTrue(response.json()["is_success"])
+        task.refresh_from_db()
+        self.assertEqual(task.status, "done")
+        self.assertFalse(ProjectTimer.objects.get(project=self.project).in_work)
+        self.assertEqual(TimeEntry.objects.filter(task=task).count(), 1)
+
+
+class TimerServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="timer_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Первый", description="")
+        cls.other_project = Project.objects.create(user=cls.user, title="Второй", description="")
+
+    def test_state_includes_pending_events(self):
+        timers.activate(self.user, self.project)
+        timers.start(self.user, self.other_project)
+
+        # Строки таймеров и несжатые события
+        with self.assertNumQueries(2):
+            state = timers.state(self.user)
+            header = state.header
+
+        self.assertEqual(header.project, self.other_project)
+        self.assertTrue(state.is_running(self.other_project.id))
+        self.assertFalse(state.is_running(self.project.id))
+
+    def test_start_twice_keeps_first_session(self):
+        self.assertTrue(timers.start(self.user, self.project))
+        self.assertFalse(timers.start(self.user, self.project))
+        # Вторая вкладка успела прочитать старое состояние
+        timers.start(self.user, self.project, current=timers.TimerState([]))
+
+        timers.compact()
+        first = TimerEvent.objects.filter(kind="start").earliest("id")
+        timer = ProjectTimer.objects.get(user=self.user, project=self.project)
+        self.assertTrue(timer.in_work)
+        self.assertEqual(timer.last_started_at, first.occurred_at)
+
+    def test_compaction_pairs_events_into_entries(self):
+        task = Task.objects.create(project=self.project, text="Задача")
+        started_at = timezone.now() - timedelta(hours=2)
+        timers.start(self.user, self.project, now=started_at)
+        timers.switch(self.user, self.project, task, now=started_at + timedelta(hours=1))
+        timers.stop(self.user, self.project, now=started_at + timedelta(hours=1, minutes=30))
+
+        # Запросы только пишут в журнал
+        self.assertFalse(TimeEntry.objects.exists())
+        self.assertEqual(timers.compact(), 3)
+
+        entries = TimeEntry.objects.order_by("started_at")
+        self.assertEqual([(entry.task_id, entry.seconds) for entry in entries], [(None, 3600), (task.id, 1800)])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.total_time, timedelta(hours=1, minutes=30))
+        self.assertFalse(ProjectTimer.objects.get(user=self.user, project=self.project).in_work)
+        self.assertFalse(TimerEvent.objects.filter(compacted_at=None).exists())
+        self.assertEqual(timers.compact(), 0)
+
+    def test_compaction_updates_timer_created_meanwhile(self):
+        timers.start(self.user, self.project)
+        apply = timers._apply
+
+        def activate_meanwhile(timer, event):
+            # Строку таймера создаёт activate уже после выборки в compact
+            timers.activate(self.user, self.project)
+            return apply(timer, event)
+
+        with mock.patch("projects.timers._apply", side_effect=activate_meanwhile):
+            self.assertEqual(timers.compact(), 1)
+
+        timer = ProjectTimer.objects.get(user=self.user, project=self.project)
+        self.assertTrue(timer.in_work)
+        self.assertTrue(timer.is_active)
+
+    def test_compaction_worker_survives_failed_batch(self):
+        with mock.patch("projects.timers.compact", side_effect=[RuntimeError, 0]) as compact, \
+                mock.patch("projects.management.commands.compact_timer_events.close_old_connections"), \
+                mock.patch("time.sleep", side_effect=[None, KeyboardInterrupt]), \
+                self.assertLogs("projects.management.commands.compact_timer_events", "ERROR"), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command("compact_timer_events", stdout=io.StringIO())
+
+        self.assertEqual(compact.call_count, 2)
+
+    def test_activate_moves_active_mark(self):
+        timers.activate(self.user, self.project)
+        timers.activate(self.user, self.other_project)
+
+        active = ProjectTimer.objects.filter(user=self.user, is_active=True)
+        self.assertEqual([timer.project for timer in active], [self.other_project])
+
+    def test_archive_stops_and_releases_project(self):
+        self.client.login(username="timer_user", password="pass")
+        self.client.post(reverse("projects_activate"), {"project_id": self.project.id})
+        self.client.post(reverse("projects_start"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("projects_archivate", args=[self.project.id]))
+
+        timer = ProjectTimer.objects.get(user=self.user, project=self.project)
+        self.assertFalse(timer.in_work)
+        self.assertFalse(timer.is_active)
+        self.assertEqual(TimeEntry.objects.filter(project=self.project).count(), 1)
+
+
+class TimerSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="sync_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Первый", description="")
+        cls.other_project = Project.objects.create(user=cls.user, title="Второй", description="")
+        cls.task = Task.objects.create(project=cls.other_project, text="Задача")
+
+    def setUp(self):
+        self.client.login(username="sync_user", password="pass")
+
+    def _sync(self, events, sent_at):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("project_timer_sync"), {"sent_at": sent_at, "events": events},
+                                        content_type="application/json")
+        return response
+
+    def test_offline_batch_is_applied_once(self):
+        now_ms = int(timezone.now().timestamp() * 1000)
+        hour = 3600 * 1000
+        events = [
+            {"id": "e1", "kind": "start", "project_id": self.project.id, "at": now_ms - hour},
+            {"id": "e2", "kind": "switch", "project_id": self.other_project.id, "task_id": self.task.id,
+             "at": now_ms - hour // 2},
+            {"id": "e3", "kind": "stop", "project_id": self.other_project.id, "at": now_ms - hour // 4},
+        ]
+
+        response = self._sync(events, now_ms)
+        repeat = self._sync(events, now_ms)
+
+        self.assertEqual([result["status"] for result in response.json()["results"]], ["applied"] * 3)
+        self.assertEqual([result["status"] for result in repeat.json()["results"]], ["duplicate"] * 3)
+        entries = TimeEntry.objects.order_by("started_at")
+        self.assertEqual([(entry.project_id, entry.task_id) for entry in entries],
+                         [(self.project.id, None), (self.other_project.id, self.task.id)])
+        self.assertEqual(sum(entry.seconds for entry in entries), 45 * 60)
+        self.assertFalse(timers.state(self.user).is_running())
+
+    def test_client_clock_skew_is_corrected(self):
+        now = timezone.now()
+        # Часы клиента спешат на час
+        client_now_ms = int((now + timedelta(hours=1)).timestamp() * 1000)
+        events = [{"id": "s1", "kind": "start", "project_id": self.project.id, "at": client_now_ms - 10 * 60 * 1000}]
+
+        results = self._sync(events, client_now_ms).json()["results"]
+
+        self.assertEqual(results[0]["status"], "applied")
+        event = TimerEvent.objects.get(client_id="s1")
+        self.assertAlmostEqual((now - event.occurred_at).total_seconds(), 600, delta=5)
+
+    def test_invalid_events_are_rejected(self):
+        stranger = User.objects.create_user(username="sync_stranger", password="pass")
+        foreign = Project.objects.create(user=stranger, title="Чужой", description="")
+        now_ms = int(timezone.now().timestamp() * 1000)
+        events = [
+            {"id": "f1", "kind": "start", "project_id": foreign.id, "at": now_ms},
+            {"id": "f2", "kind": "start", "project_id": self.project.id, "at": now_ms + 60 * 1000},
+            {"id": "f3", "kind": "start", "project_id": self.project.id, "at": now_ms - 2 * 86400 * 1000},
+            {"id": "f4", "kind": "start", "project_id": self.project.id, "at": now_ms},
+            {"id": "f5", "kind": "stop", "project_id": self.project.id, "at": now_ms - 1000},
+        ]
+
+        results = self._sync(events, now_ms).json()["results"]
+
+        self.assertEqual([result["status"] for result in results],
+                         ["rejected", "rejected", "rejected", "applied", "rejected"])
+        self.assertEqual(results[4]["error"], "Событие раньше уже учтённых")
+
+    def test_malformed_batch(self):
+        response = self.client.post(reverse("project_timer_sync"), "not json", content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ReapTimersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reap_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Забытый", description="")
+        cls.fresh_project = Project.objects.create(user=cls.user, title="Текущий", description="")
+
+    def setUp(self):
+        now = timezone.now()
+        self.forgotten = ProjectTimer.objects.create(user=self.user, project=self.project, in_work=True,
+                                                     last_started_at=now - timedelta(hours=15))
+        ProjectTimer.objects.create(user=self.user, project=self.fresh_project, in_work=True,
+                                    last_started_at=now - timedelta(hours=1))
+
+    def test_forgotten_timer_is_closed_with_capped_entry(self):
+        call_command("reap_timers", idle_hours=10, stdout=io.StringIO())
+        call_command("reap_timers", idle_hours=10, stdout=io.StringIO())
+
+        entry = TimeEntry.objects.get()
+        self.assertEqual(entry.project, self.project)
+        self.assertEqual(entry.seconds, 10 * 3600)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.total_time, timedelta(hours=10))
+        self.assertEqual([timer.project for timer in timers.state(self.user).running], [self.fresh_project])
+
+    def test_timer_restarted_after_decision_is_kept(self):
+        compact_all = timers.compact_all
+
+        def restart_after_compaction(*args, **kwargs):
+            processed = compact_all(*args, **kwargs)
+            if not TimerEvent.objects.exists():
+                # Пользователь перезапускает таймер, пока reaper выбирает забытые
+                timers.stop(self.user, self.project)
+                timers.start(self.user, self.project)
+            return processed
+
+        with override_settings(TIMER_COMPACTION="worker"), \
+                mock.patch("projects.timers.compact_all", side_effect=restart_after_compaction):
+            timers.reap(timedelta(hours=10), timedelta(minutes=15))
+        compact_all()
+
+        self.assertFalse(TimerEvent.objects.filter(client_id__startswith="reaper:").exists())
+        self.assertIn(self.project, [timer.project for timer in timers.state(self.user).running])
+
+    def test_stale_reaper_stop_does_not_end_new_run(self):
+        started_at = self.forgotten.last_started_at
+        with override_settings(TIMER_COMPACTION="worker"):
+            timers.stop(self.user, self.project)
+            timers.start(self.user, self.project)
+        timers.compact_all()
+        TimerEvent.objects.create(user=self.user, project=self.project, kind="stop",
+                                  occurred_at=started_at + timedelta(hours=10),
+                                  client_id=f"reaper:{self.project.pk}:{int(started_at.timestamp())}")
+
+        timers.compact_all()
+
+        self.assertIn(self.project, [timer.project for timer in timers.state(self.user).running])
+
+    def test_dry_run_changes_nothing(self):
+        out = io.StringIO()
+        call_command("reap_timers", idle_hours=10, dry_run=True, stdout=out)
+
+        self.assertIn("Будет остановлено таймеров: 1", out.getvalue())
+        self.assertFalse(TimerEvent.objects.exists())
+        self.forgotten.refresh_from_db()
+        self.assertTrue(self.forgotten.in_work)
+
+
+class TimerHeartbeatTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="beat_user", password="pass")
+        cls.project = Project.objects.create(user=cls.user, title="Проект", description="")
+        cls.idle_project = Project.objects.create(user=cls.user, title="Брошенный", description="")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_heartbeats_are_flushed_in_one_update(self):
+        timer = ProjectTimer.objects.create(user=self.user, project=self.project, in_work=True,
+                                            last_started_at=timezone.now() - timedelta(minutes=5))
+        beat_at = timezone.now()
+
+        with self.assertNumQueries(0):
+            timers.heartbeat(self.user, beat_at)
+            timers.heartbeat(self.user, beat_at)
+        # Выборка пользователей с запущенными таймерами и один UPDATE
+        with self.assertNumQueries(2):
+            self.assertEqual(timers.flush_heartbeats(), 1)
+
+        timer.refresh_from_db()
+        self.assertAlmostEqual((timer.last_heartbeat_at - beat_at).total_seconds(), 0, delta=0.001)
+
+    def test_reaper_cuts_silent_timer_at_last_heartbeat(self):
+        now = timezone.now()
+        ProjectTimer.objects.create(user=self.user, project=self.idle_project, in_work=True,
+                                    last_started_at=now - timedelta(hours=3),
+                                    last_heartbeat_at=now - timedelta(hours=2))
+        ProjectTimer.objects.create(user=self.user, project=self.project, in_work=True,
+                                    last_started_at=now - timedelta(hours=1),
+                                    last_heartbeat_at=now - timedelta(minutes=5))
+
+        call_command("reap_timers", silence_minutes=15, stdout=io.StringIO())
+
+        entry = TimeEntry.objects.get()
+        self.assertEqual((entry.project, entry.seconds), (self.idle_project, 3600))
+        self.assertEqual([timer.project for timer in timers.state(self.user).running], [self.project])
+
+
+class ReconcileTimeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reconcile_user", password="pass")
+        cls.drifted = Project.objects.create(user=cls.user, title="Расхождение", description="",
+                                             total_time=timedelta(hours=5))
+        cls.correct = Project.objects.create(user=cls.user, title="Верный", description="",
+                                             total_time=timedelta(hours=1))
+        cls.empty = Project.objects.create(user=cls.user, title="Без записей", description="",
+                                           total_time=timedelta(minutes=7))
+        started_at = timezone.make_aware(datetime(2026, 3, 2, 9, 0))
+        for project, hours in ((cls.drifted, 2), (cls.correct, 1)):
+            TimeEntry.objects.create(user=cls.user, project=project, started_at=started_at,
+                                     ended_at=started_at + timedelta(hours=hours), seconds=hours * 3600)
+
+    def _total(self, project):
+        project.refresh_from_db()
+        return project.total_time
+
+    def test_dry_run_reports_without_changes(self):
+        out = io.StringIO()
+        call_command("reconcile_time", dry_run=True, stdout=out)
+
+        self.assertIn("Найдено расхождений: 2", out.getvalue())
+        self.assertEqual(self._total(self.drifted), timedelta(hours=5))
+
+    def test_drift_is_fixed(self):
+        # Сгруппированная выборка и один UPDATE на порцию (в транзакции)
+        with self.assertNumQueries(4):
+            call_command("reconcile_time", stdout=io.StringIO())
+
+        self.assertEqual(self._total(self.drifted), timedelta(hours=2))
+        self.assertEqual(self._total(self.correct), timedelta(hours=1))
+        self.assertEqual(self._total(self.empty), timedelta(0))
+
+    def test_since_limits_to_recent_projects(self):
+        call_command("reconcile_time", since="2026-03-03", stdout=io.StringIO())
+        self.assertEqual(self._total(self.drifted), timedelta(hours=5))
+
+        call_command("reconcile_time", since="2026-03-02", stdout=io.StringIO())
+        self.assertEqual(self._total(self.drifted), timedelta(hours=2))
+        self.assertEqual(self._total(self.empty), timedelta(minutes=7))
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="keyset_user", password="pass")
+        projects = Project.objects.bulk_create([
+            Project(user=cls.user, title=f"Проект {index}", description="") for index in range(7)
+        ])
+        # Одинаковое время создания у части проектов: порядок решает id
+        for index, project in enumerate(projects):
+            Project.objects.filter(pk=project.pk).update(created_at=aware(2026, 1, 1 + index // 3, 9, 0))
+        cls.expected = list(Project.objects.order_by("-created_at", "-pk").values_list("pk", flat=True))
+
+    def test_pages_cover_all_rows_in_order(self):
+        seen, cursor = [], None
+        while True:
+            items, cursor = keyset_page(Project.objects.filter(user=self.user), cursor, size=3)
+            seen.extend(project.pk for project in items)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, self.expected)
+
+    def test_deep_page_has_no_offset_or_count(self):
+        _, cursor = keyset_page(Project.objects.all(), size=5)
+        with CaptureQueriesContext(connection) as queries:
+            items, next_cursor = keyset_page(Project.objects.all(), cursor, size=5)
+
+        self.assertEqual([project.pk for project in items], self.expected[5:])
+        self.assertIsNone(next_cursor)
+        sql = queries[0]["sql"].upper()
+        self.assertNotIn("OFFSET", sql)
+        self.assertNotIn("COUNT(", sql)
+
+    def test_list_view_follows_cursor(self):
+        from projects.views import ProjectListView
+
+        self.client.force_login(self.user)
+        with mock.patch.object(ProjectListView, "keyset_page_size", 4):
+            first = self.client.get(reverse("project_list"))
+            second = self.client.get(reverse("project_list"), {"cursor": first.context["next_cursor"]})
+
+        self.assertEqual([project.pk for project in first.context["object_list"]], self.expected[:4])
+        self.assertEqual([project.pk for project in second.context["object_list"]], self.expected[4:])
+        self.assertIsNone(second.context["next_cursor"])
+        self.assertEqual(self.client.get(reverse("project_list"), {"cursor": "broken"}).status_code, 404)
+
+
+class ChunkedUploadTests(TestCase):
+    DATA = b"0123456789abcdef-chunked"
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media, UPLOAD_SESSION_DIR=os.path.join(self.media, "sessions"), UPLOAD_CHUNK_SIZE=10,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username="upload_user", password="pass")
+        self.project = Project.objects.create(user=self.user, title="Загрузки", description="")
+        self.client.force_login(self.user)
+
+    def _open(self):
+        response = self.client.post(reverse("project_upload_create", args=[self.project.pk]),
+                                    data={"filename": "../design.zip", "size": len(self.DATA)},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def _chunk(self, url, offset, data, checksum=None):
+        return self.client.post(url, data=data, content_type="application/octet-stream",
+                                headers={"X-Upload-Offset": str(offset),
+                                         "X-Chunk-Sha256": checksum or hashlib.sha256(data).hexdigest()})
+
+    def test_resumable_upload_is_attached_on_submit(self):
+        upload = self._open()
+        url = upload["url"]
+
+        self.assertEqual(self._chunk(url, 0, self.DATA[:10]).json()["offset"], 10)
+        # Повтор принятой части: сервер сообщает, откуда продолжать
+        repeated = self._chunk(url, 0, self.DATA[:10])
+        self.assertEqual(repeated.status_code, 409)
+        self.assertEqual(repeated.json()["offset"], 10)
+        # Повреждённая часть не записывается
+        self.assertEqual(self._chunk(url, 10, self.DATA[10:20], checksum="0" * 64).status_code, 400)
+        self.assertEqual(self.client.get(url).json()["offset"], 10)
+
+        self._chunk(url, 10, self.DATA[10:20])
+        self.assertTrue(self._chunk(url, 20, self.DATA[20:]).json()["complete"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("project_submit_review", args=[self.project.pk]),
+                             {"upload_ids": [upload["id"]]})
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.review_status, "in_review")
+        attachment = self.project.attachments.get()
+        self.assertTrue(attachment.file.name.endswith("design.zip"))
+        with attachment.file.open("rb") as handle:
+            self.assertEqual(handle.read(), self.DATA)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media, "sessions")), [])
+
+    def test_incomplete_upload_blocks_submit(self):
+        upload = self._open()
+        self._chunk(upload["url"], 0, self.DATA[:10])
+
+        self.client.post(reverse("project_submit_review", args=[self.project.pk]), {"upload_ids": [upload["id"]]})
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.review_status, "none")
+        self.assertFalse(self.project.attachments.exists())
+
+    def _complete(self):
+        upload = self._open()
+        self._chunk(upload["url"], 0, self.DATA[:10])
+        self._chunk(upload["url"], 10, self.DATA[10:20])
+        self._chunk(upload["url"], 20, self.DATA[20:])
+        return upload
+
+    def test_failed_submit_keeps_uploads(self):
+        upload = self._complete()
+
+        with mock.patch.object(Project, "save", side_effect=RuntimeError):
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                self.client.post(reverse("project_submit_review", args=[self.project.pk]),
+                                 {"upload_ids": [upload["id"]]})
+
+        # Ни вложений, ни перенесённых файлов: загрузку можно отправить ещё раз
+        self.assertFalse(self.project.attachments.exists())
+        self.assertTrue(UploadSession.objects.get(pk=upload["id"]).is_complete)
+        self.assertEqual(os.listdir(os.path.join(self.media, "sessions")), [f"{upload['id']}.part"])
+        self.assertFalse(os.path.exists(os.path.join(self.media, "project_attachments")))
+
+    def test_same_file_names_in_one_submit_do_not_collide(self):
+        uploads = [self._complete(), self._complete()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("project_submit_review", args=[self.project.pk]),
+                             {"upload_ids": [upload["id"] for upload in uploads]})
+
+        names = [attachment.file.name for attachment in self.project.attachments.all()]
+        self.assertEqual(len(set(names)), 2)
+        for attachment in self.project.attachments.all():
+            with attachment.file.open("rb") as handle:
+                self.assertEqual(handle.read(), self.DATA)
+
+    def test_move_does_not_overwrite_file_saved_meanwhile(self):
+        upload = self._complete()
+        field = ProjectAttachment._meta.get_field("file")
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse("project_submit_review", args=[self.project.pk]),
+                             {"upload_ids": [upload["id"]]})
+        # Выбранное имя занимает другой файл до переноса
+        taken = self.project.attachments.get().file.name
+        field.storage.save(taken, ContentFile(b"other"))
+        for callback in callbacks:
+            callback()
+
+        attachment = self.project.attachments.get()
+        self.assertNotEqual(attachment.file.name, taken)
+        with attachment.file.open("rb") as handle:
+            self.assertEqual(handle.read(), self.DATA)
+        with field.storage.open(taken, "rb") as handle:
+            self.assertEqual(handle.read(), b"other")
+
+    @override_settings(UPLOAD_MAX_SESSIONS_PER_USER=2)
+    def test_open_uploads_are_limited_per_user(self):
+        self._open()
+        self._open()
+
+        response = self.client.post(reverse("project_upload_create", args=[self.project.pk]),
+                                    data={"filename": "more.zip", "size": 1}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(UploadSession.objects.count(), 2)
+
+    def test_staged_bytes_are_limited_per_user(self):
+        with override_settings(UPLOAD_MAX_STAGED_BYTES_PER_USER=len(self.DATA) + 5):
+            self._open()
+            response = self.client.post(reverse("project_upload_create", args=[self.project.pk]),
+                                        data={"filename": "more.zip", "size": 6}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_upload_of_other_user_is_hidden(self):
+        upload = self._open()
+        User.objects.create_user(username="upload_other", password="pass")
+        self.client.login(username="upload_other", password="pass")
+
+        self.assertEqual(self.client.get(upload["url"]).status_code, 404)
+        self.assertEqual(self._chunk(upload["url"], 0, self.DATA[:10]).status_code, 404)
+
+    def test_purge_removes_abandoned_uploads(self):
+        upload = self._open()
+        self._chunk(upload["url"], 0, self.DATA[:10])
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(hours=72))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("purge_upload_sessions", hours=48, stdout=io.StringIO())
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media, "sessions")), [])
+
+
+class AttachmentDownloadTests(TestCase):
+    DATA = b"attachment-bytes-0123456789"
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username="download_user", password="pass")
+        project = Project.objects.create(user=self.user, title="Выдача", description="")
+        self.attachment = ProjectAttachment(project=project, uploaded_by=self.user)
+        self.attachment.file.save("report.bin", ContentFile(self.DATA))
+        self.url = reverse("project_attachment_download", args=[project.pk, self.attachment.pk])
+        self.client.force_login(self.user)
+
+    def test_full_download_and_revalidation(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.DATA)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("report.bin", response["Content-Disposition"])
+
+        repeated = self.client.get(self.url, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(repeated.status_code, 304)
+
+    def test_range_resumes_download(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        response = self.client.get(self.url, headers={"Range": "bytes=11-", "If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.DATA[11:])
+        self.assertEqual(response["Content-Range"], f"bytes 11-{len(self.DATA) - 1}/{len(self.DATA)}")
+
+        suffix = self.client.get(self.url, headers={"Range": "bytes=-4"})
+        self.assertEqual(b"".join(suffix.streaming_content), self.DATA[-4:])
+
+        # Файл изменился (другой ETag) — отдаётся целиком
+        changed = self.client.get(self.url, headers={"Range": "bytes=11-", "If-Range": '"stale"'})
+        self.assertEqual(changed.status_code, 200)
+
+        outside = self.client.get(self.url, headers={"Range": "bytes=1000-"})
+        self.assertEqual(outside.status_code, 416)
+        self.assertEqual(outside["Content-Range"], f"bytes */{len(self.DATA)}")
+
+        # Слабый ETag в If-Range не подходит даже при совпадении значения
+        weak = self.client.get(self.url, headers={"Range": "bytes=11-", "If-Range": "W/" + etag})
+        self.assertEqual(weak.status_code, 200)
+        self.assertEqual(b"".join(weak.streaming_content), self.DATA)
+
+    def test_range_of_empty_file_is_not_satisfiable(self):
+        self.attachment.file.save("empty.bin", ContentFile(b""))
+        url = reverse("project_attachment_download", args=[self.attachment.project_id, self.attachment.pk])
+
+        for header in ("bytes=0-", "bytes=-5"):
+            response = self.client.get(url, headers={"Range": header})
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response["Content-Range"], "bytes */0")
+
+    @override_settings(ATTACHMENT_DELIVERY="accel", ATTACHMENT_ACCEL_PREFIX="/protected-media/")
+    def test_accel_redirect_hands_off_to_proxy(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.attachment.file.name)
+        self.assertEqual(response.content, b"")
+
+    async def test_asgi_download_streams_asynchronously(self):
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), self.DATA)
+        self.assertEqual(response["Content-Length"], str(len(self.DATA)))
+
+        partial = await self.async_client.get(self.url, headers={"Range": "bytes=11-"})
+        self.assertEqual(partial.status_code, 206)
+        self.assertTrue(partial.is_async)
+        self.assertEqual(b"".join([chunk async for chunk in partial.streaming_content]), self.DATA[11:])
+
+    def test_permission_checked_before_delivery(self):
+        User.objects.create_user(username="download_other", password="pass")
+        self.client.login(username="download_other", password="pass")
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 302)
+
+
+# Тестовая база в файле (settings_test): у каждого потока своё соединение
+@override_settings(TIMER_COMPACTION='inline')
+class ParallelTimerStopTests(TransactionTestCase):
+    def test_parallel_stops_from_two_sessions_count_once(self):
+        user = User.objects.create_user(username="parallel_user", password="pass")
+        project = Project.objects.create(user=user, title="Проект", description="")
+        started_at = timezone.now() - timedelta(hours=1)
+        ProjectTimer.objects.create(user=user, project=project, in_work=True, is_active=True,
+                                    last_started_at=started_at)
+        # Две вкладки (сессии) одного пользователя останавливают таймер одновременно
+        sessions = [Client(), Client()]
+        for session in sessions:
+            session.force_login(user)
+        barrier = threading.Barrier(len(sessions))
+        errors = []
+
+        def stop(session):
+            try:
+                barrier.wait()
+                session.post(reverse("projects_stop"))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=stop, args=(session,)) for session in sessions]
+        # Сжатие после фиксации идёт в тех же потоках одновременно; его ошибки только логируются
+        with self.assertNoLogs('django.db.backends.base', 'ERROR'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertFalse(TimerEvent.objects.filter(compacted_at=None).exists())
+        self.assertFalse(ProjectTimer.objects.get(user=user, project=project).in_work)
+        entry = TimeEntry.objects.get(project=project)
+        project.refresh_from_db()
+        self.assertEqual(project.total_time, timedelta(seconds=entry.seconds))
+        self.assertAlmostEqual(entry.seconds, 3600, delta=60)
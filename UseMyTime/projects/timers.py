@@ -0,0 +1,414 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Max, Q, Value, When
+from django.utils import timezone
+
+from . import bus
+from .models import Project, ProjectTimer, Task, TimeEntry, TimerEvent
+from .services import record_time_entries
+
+# Таймеры пользователя
+# Запуск, остановка и смена задачи — только вставка в журнал TimerEvent.
+# Сжатие (compact) применяет события по порядку к состоянию ProjectTimer
+# (строка на пару пользователь—проект), создаёт записи TimeEntry и прибавляет
+# общее время проектов одним UPDATE на проект за порцию.
+#   in_work   — идёт отсчёт с last_started_at;
+#   is_active — «активный проект» в шапке (не больше одного на пользователя).
+# Состояние для запросов (state) — строки ProjectTimer плюс ещё не сжатые
+# события пользователя, поэтому оно не отстаёт от журнала.
+#
+# Повторы безопасны: запуск идущего таймера с той же задачей и остановка
+# остановленного ничего не меняют, поэтому две вкладки не удвоят время.
+
+
+def _apply(timer, event):
+    """
+    Применяет событие к состоянию таймера.
+    Возвращает завершённый отрезок (task_id, started_at, ended_at) или None.
+    """
+    session = None
+    if event.client_id and event.client_id.startswith('reaper:') and timer.in_work \
+            and event.client_id != _reaper_client_id(timer.project_id, timer.last_started_at):
+        # Остановка забытого таймера относится к отрезку, который уже сменился
+        return None
+    if event.kind == 'start':
+        if timer.in_work and (event.task_id is None or event.task_id == timer.current_task_id):
+            return None
+        if timer.in_work:
+            # Смена задачи: отрезок по прежней задаче закрывается
+            session = (timer.current_task_id, timer.last_started_at, event.occurred_at)
+        timer.in_work = True
+        timer.last_started_at = event.occurred_at
+        timer.current_task_id = event.task_id
+    elif timer.in_work:
+        session = (timer.current_task_id, timer.last_started_at, event.occurred_at)
+        timer.in_work = False
+        timer.current_task_id = None
+    return session
+
+
+class TimerState:
+    """Таймеры пользователя, которые запущены или отмечены активными"""
+
+    def __init__(self, timers):
+        self.timers = timers
+        self.running = [timer for timer in timers if timer.in_work]
+
+    def get(self, project_id):
+        return next((timer for timer in self.timers if timer.project_id == project_id), None)
+
+    def is_running(self, project_id=None):
+        return any(project_id is None or timer.project_id == project_id for timer in self.running)
+
+    @property
+    def header(self):
+        """Таймер для шапки: запущенный, иначе активный проект"""
+        return self.running[0] if self.running else next(iter(self.timers), None)
+
+
+def state(user):
+    """Состояние таймеров пользователя: строки ProjectTimer и несжатые события (два запроса)"""
+    timers = {
+        timer.project_id: timer
+        for timer in ProjectTimer.objects.select_related('project').filter(Q(in_work=True) | Q(is_active=True), user=user)
+    }
+    pending = TimerEvent.objects.select_related('project').filter(user=user, compacted_at=None).order_by('id')
+    for event in pending:
+        timer = timers.get(event.project_id)
+        if timer is None:
+            # Строка могла существовать и без отметок — для состояния это неважно
+            timer = timers[event.project_id] = ProjectTimer(user=user, project=event.project)
+        _apply(timer, event)
+    ordered = sorted(timers.values(), key=lambda timer: (not timer.in_work, -_epoch(timer.last_started_at)))
+    return TimerState([timer for timer in ordered if timer.in_work or timer.is_active])
+
+
+def _epoch(moment):
+    return moment.timestamp() if moment else 0
+
+
+def _append(user, events):
+    # Горячий путь: одна вставка, сжатие — после фиксации или в фоне
+    TimerEvent.objects.bulk_create(events)
+    bus.publish('projecttimer', None, user.pk)
+    if settings.TIMER_COMPACTION == 'inline':
+        transaction.on_commit(lambda: compact(user=user), robust=True)
+
+
+def start(user, project, task=None, now=None, current=None):
+    """
+    Запускает таймер проекта (или переключает его на задачу); False — уже запущен.
+    current — уже прочитанное состояние пользователя.
+    """
+    timer = (current or state(user)).get(project.pk)
+    if timer and timer.in_work and (task is None or timer.current_task_id == task.pk):
+        return False
+    _append(user, [TimerEvent(user=user, project=project, task=task, kind='start',
+                              occurred_at=now or timezone.now())])
+    return True
+
+
+def stop_timers(user, timers, now=None):
+    """
+    Останавливает таймеры пользователя.
+    Возвращает {project_id: время отрезка} по запущенным таймерам.
+    """
+    now = now or timezone.now()
+    running = [timer for timer in timers if timer.in_work and timer.last_started_at]
+    if running:
+        _append(user, [TimerEvent(user=user, project_id=timer.project_id, kind='stop', occurred_at=now)
+                       for timer in running])
+    return {timer.project_id: max(now - timer.last_started_at, timedelta(0)) for timer in running}
+
+
+def stop(user, project, now=None, current=None):
+    """Останавливает таймер проекта; None — таймер не был запущен"""
+    timer = (current or state(user)).get(project.pk)
+    if not timer or not timer.in_work:
+        return None
+    return stop_timers(user, [timer], now)[project.pk]
+
+
+def stop_all(user, now=None):
+    """Останавливает все запущенные таймеры пользователя; возвращает их число"""
+    return len(stop_timers(user, state(user).running, now))
+
+
+def switch(user, project, task, now=None, current=None):
+    """Останавливает остальные таймеры и запускает проект по задаче — одной вставкой"""
+    now = now or timezone.now()
+    current = current or state(user)
+    events = [TimerEvent(user=user, project_id=timer.project_id, kind='stop', occurred_at=now)
+              for timer in current.running if timer.project_id != project.pk]
+    events.append(TimerEvent(user=user, project=project, task=task, kind='start', occurred_at=now))
+    _append(user, events)
+
+
+def activate(user, project):
+    """Делает проект активным (в шапке); с остальных проектов отметка снимается"""
+    with transaction.atomic():
+        ProjectTimer.objects.filter(user=user, is_active=True).exclude(project=project).update(is_active=False)
+        timer, _ = ProjectTimer.objects.update_or_create(user=user, project=project, defaults={'is_active': True})
+    bus.publish('projecttimer', timer.pk, user.pk)
+    return timer
+
+
+def release(user, project, now=None):
+    """Проект больше не ведётся (архив): таймер останавливается и снимается с шапки"""
+    stop(user, project, now)
+    if ProjectTimer.objects.filter(user=user, project=project, is_active=True).update(is_active=False):
+        bus.publish('projecttimer', None, user.pk)
+
+
+# Синхронизация из браузера
+# Браузер копит события (в том числе без сети) и отправляет их пакетом.
+# Время событий — по часам клиента в мс; расхождение с часами сервера
+# определяется по времени отправки пакета (sent_at) и вычитается.
+# Повтор пакета после обрыва связи безопасен: события с известным ключом
+# клиента пропускаются.
+
+def from_epoch_ms(value):
+    return datetime.fromtimestamp(float(value) / 1000, tz=dt_timezone.utc)
+
+
+def _sync_error(event, now, last, projects, tasks):
+    if event['kind'] not in ('start', 'stop', 'switch'):
+        return 'Неизвестное событие'
+    project = projects.get(event['project_id'])
+    if project is None:
+        return 'Проект не найден'
+    task_id = event.get('task_id')
+    if task_id is not None and getattr(tasks.get(task_id), 'project_id', None) != project.pk:
+        return 'Задача не найдена'
+    if event['kind'] != 'stop' and project.review_status in ('in_review', 'approved'):
+        return 'Проект на проверке/принят: запуск таймера запрещён'
+    if event['at'] > now + timedelta(seconds=settings.TIMER_SYNC_TOLERANCE):
+        return 'Время события в будущем'
+    if event['at'] < now - timedelta(seconds=settings.TIMER_SYNC_MAX_AGE):
+        return 'Событие слишком старое'
+    if last and event['at'] < last:
+        return 'Событие раньше уже учтённых'
+    return None
+
+
+def sync(user, events, now=None):
+    """
+    Применяет пакет событий клиента в одной транзакции.
+    events — [{'id', 'kind' (start/stop/switch), 'project_id', 'task_id', 'at'}] в порядке
+    клиента, время уже приведено к часам сервера.
+    Возвращает [{'id', 'status': applied/duplicate/rejected, 'error'?}] в том же порядке.
+    """
+    now = now or timezone.now()
+    ids = [event['id'] for event in events]
+    results = []
+    created = []
+    with transaction.atomic():
+        seen = set(TimerEvent.objects.filter(user=user, client_id__in=ids).values_list('client_id', flat=True))
+        projects = Project.objects.filter(user=user).in_bulk({event['project_id'] for event in events})
+        tasks = Task.objects.filter(project__user=user).in_bulk(
+            {event['task_id'] for event in events if event.get('task_id') is not None})
+        last = TimerEvent.objects.filter(user=user).aggregate(last=Max('occurred_at'))['last']
+        # Состояние на момент каждого события: switch останавливает то, что идёт
+        current = {timer.project_id: timer for timer in state(user).timers}
+
+        for event in events:
+            if event['id'] in seen:
+                results.append({'id': event['id'], 'status': 'duplicate'})
+                continue
+            error = _sync_error(event, now, last, projects, tasks)
+            if error:
+                results.append({'id': event['id'], 'status': 'rejected', 'error': error})
+                continue
+            seen.add(event['id'])
+            last = event['at']
+            project = projects[event['project_id']]
+            task = tasks.get(event.get('task_id'))
+            batch = []
+            if event['kind'] == 'switch':
+                batch = [TimerEvent(user=user, project_id=timer.project_id, kind='stop', occurred_at=event['at'])
+                         for timer in current.values() if timer.in_work and timer.project_id != project.pk]
+            kind = 'stop' if event['kind'] == 'stop' else 'start'
+            batch.append(TimerEvent(user=user, project=project, task=task, kind=kind,
+                                    occurred_at=event['at'], client_id=event['id']))
+            for timer_event in batch:
+                timer = current.setdefault(timer_event.project_id,
+                                           ProjectTimer(user=user, project_id=timer_event.project_id))
+                _apply(timer, timer_event)
+            created.extend(batch)
+            results.append({'id': event['id'], 'status': 'applied'})
+
+        if created:
+            _append(user, created)
+    return results
+
+
+# Сигналы открытой страницы (heartbeat)
+# Страница с запущенным таймером раз в минуту сообщает, что она открыта.
+# Сигнал — только запись в кэш; в базу (ProjectTimer.last_heartbeat_at) они
+# переносятся пакетом одним UPDATE не чаще раза в TIMER_HEARTBEAT_FLUSH_INTERVAL,
+# поэтому нагрузка на запись не растёт с числом вкладок.
+
+def _heartbeat_key(user_id):
+    return f'timer:heartbeat:{user_id}'
+
+
+def heartbeat(user, now=None):
+    """Отмечает, что страница пользователя открыта; без запросов к базе"""
+    now = now or timezone.now()
+    cache.set(_heartbeat_key(user.pk), now.timestamp(), settings.TIMER_HEARTBEAT_CACHE_TIMEOUT)
+    # Переносим сигналы в базу не чаще раза за интервал (из любого процесса)
+    if cache.add('timer:heartbeat:flush', 1, settings.TIMER_HEARTBEAT_FLUSH_INTERVAL):
+        transaction.on_commit(flush_heartbeats, robust=True)
+
+
+def flush_heartbeats():
+    """Переносит сигналы из кэша в запущенные таймеры; возвращает число обновлённых строк"""
+    user_ids = set(ProjectTimer.objects.filter(in_work=True).values_list('user_id', flat=True))
+    beats = cache.get_many([_heartbeat_key(user_id) for user_id in user_ids])
+    seen = {
+        user_id: datetime.fromtimestamp(beats[_heartbeat_key(user_id)], tz=dt_timezone.utc)
+        for user_id in user_ids if _heartbeat_key(user_id) in beats
+    }
+    if not seen:
+        return 0
+    return ProjectTimer.objects.filter(user_id__in=seen, in_work=True).update(
+        last_heartbeat_at=Case(*[When(user_id=user_id, then=Value(moment)) for user_id, moment in seen.items()]))
+
+
+# Забытые таймеры
+# Остановка при закрытии вкладки ненадёжна, и таймер может идти всю ночь.
+# Таймер, от страницы которого давно нет сигналов, закрывается в момент
+# последнего сигнала. Таймер без сигналов за текущий отрезок (страница не
+# открывалась) закрывается, если идёт дольше порога, в момент «старт + порог»:
+# запись времени не длиннее порога. Ключ события включает время старта,
+# поэтому повторный запуск по тому же отрезку ничего не добавит.
+# Перед вставкой остановок решение перепроверяется под блокировкой строк
+# таймеров: таймер, который успели остановить или перезапустить (в том числе
+# несжатыми событиями), пропускается. Остановка, вставленная одновременно
+# с перезапуском, при сжатии не применяется к новому отрезку (_apply).
+
+def _reaper_client_id(project_id, started_at):
+    return f'reaper:{project_id}:{int(started_at.timestamp())}'
+
+
+def reap(idle, silence, now=None, dry_run=False):
+    """
+    Закрывает таймеры без сигналов дольше silence и таймеры без сигналов
+    вовсе, запущенные раньше now - idle.
+    Возвращает [(user_id, project_id, last_started_at, ended_at)] закрытых отрезков.
+    """
+    now = now or timezone.now()
+    # Несжатые события могли уже остановить или перезапустить таймер
+    if not dry_run:
+        flush_heartbeats()
+        compact_all()
+    alive = Q(last_heartbeat_at__gte=F('last_started_at'))
+    orphaned = (
+        ProjectTimer.objects
+        .filter(in_work=True)
+        .filter(alive & Q(last_heartbeat_at__lt=now - silence) | ~alive & Q(last_started_at__lt=now - idle))
+    )
+    if dry_run:
+        return _orphans(orphaned, idle)
+    with transaction.atomic():
+        orphans = _orphans(orphaned.select_for_update(), idle)
+        # События после сжатия выше (остановка, перезапуск) новее решения
+        busy = set(
+            TimerEvent.objects
+            .filter(compacted_at=None, user_id__in={orphan[0] for orphan in orphans})
+            .values_list('user_id', 'project_id')
+        )
+        orphans = [orphan for orphan in orphans if orphan[:2] not in busy]
+        if not orphans:
+            return orphans
+        TimerEvent.objects.bulk_create(
+            [TimerEvent(user_id=user_id, project_id=project_id, kind='stop', occurred_at=ended_at,
+                        client_id=_reaper_client_id(project_id, started_at))
+             for user_id, project_id, started_at, ended_at in orphans],
+            ignore_conflicts=True,
+        )
+        for user_id in {orphan[0] for orphan in orphans}:
+            bus.publish('projecttimer', None, user_id)
+    compact_all()
+    return orphans
+
+
+def _orphans(timers, idle):
+    rows = timers.values_list('user_id', 'project_id', 'last_started_at', 'last_heartbeat_at')
+    return [
+        (user_id, project_id, started_at,
+         beat_at if beat_at and beat_at >= started_at else started_at + idle)
+        for user_id, project_id, started_at, beat_at in rows
+    ]
+
+
+# Сжатие журнала
+
+def compact(user=None, batch_size=500):
+    """
+    Сводит порцию несжатых событий (по порядку вставки) в состояние таймеров,
+    записи времени и общее время проектов. Возвращает число обработанных событий.
+    """
+    with transaction.atomic():
+        pending = TimerEvent.objects.select_for_update().filter(compacted_at=None)
+        if user is not None:
+            pending = pending.filter(user=user)
+        events = list(pending.order_by('id')[:batch_size])
+        if not events:
+            return 0
+
+        keys = {(event.user_id, event.project_id) for event in events}
+        timers = {
+            (timer.user_id, timer.project_id): timer
+            for timer in ProjectTimer.objects.select_for_update().filter(
+                user_id__in={user_id for user_id, _ in keys},
+                project_id__in={project_id for _, project_id in keys})
+        }
+        changed = {}
+        entries = []
+        totals = defaultdict(timedelta)
+        for event in events:
+            key = (event.user_id, event.project_id)
+            timer = timers.get(key)
+            if timer is None:
+                timer = timers[key] = ProjectTimer(user_id=event.user_id, project_id=event.project_id)
+            session = _apply(timer, event)
+            changed[key] = timer
+            if session:
+                task_id, started_at, ended_at = session
+                # Общее время прибавляется целыми секундами, как в записи времени,
+                # чтобы оно совпадало с суммой TimeEntry.seconds (reconcile_time)
+                seconds = int(max(ended_at - started_at, timedelta(0)).total_seconds())
+                totals[event.project_id] += timedelta(seconds=seconds)
+                entries.append(TimeEntry(user_id=event.user_id, project_id=event.project_id, task_id=task_id,
+                                         started_at=started_at, ended_at=ended_at, seconds=seconds))
+
+        # Строку пары могли создать параллельно (activate): тогда обновляем её
+        ProjectTimer.objects.bulk_create(
+            [timer for timer in changed.values() if timer.pk is None],
+            update_conflicts=True, unique_fields=['user', 'project'],
+            update_fields=['in_work', 'last_started_at', 'current_task'],
+        )
+        ProjectTimer.objects.bulk_update([timer for timer in changed.values() if timer.pk is not None],
+                                         ['in_work', 'last_started_at', 'current_task'])
+        owners = dict(Project.objects.filter(pk__in=totals).values_list('pk', 'user_id'))
+        for project_id, duration in totals.items():
+            Project.objects.filter(pk=project_id).update(total_time=F('total_time') + duration)
+            bus.publish('project', project_id, owners.get(project_id))
+        record_time_entries(entries)
+        TimerEvent.objects.filter(pk__in=[event.pk for event in events]).update(compacted_at=timezone.now())
+        for user_id in {user_id for user_id, _ in keys}:
+            bus.publish('projecttimer', None, user_id)
+    return len(events)
+
+
+def compact_all(batch_size=500):
+    """Сжимает весь накопленный журнал; возвращает число событий"""
+    total = 0
+    while processed := compact(batch_size=batch_size):
+        total += processed
+    return total
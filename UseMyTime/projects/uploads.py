@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import ProjectAttachment, UploadSession
+
+# Возобновляемая загрузка вложений частями
+# Клиент открывает сессию (имя и размер файла) и отправляет части по порядку:
+# тело запроса — байты части, заголовки — смещение части в файле и её SHA-256.
+# Часть сначала читается во временный буфер с подсчётом контрольной суммы
+# (без блокировок), затем под блокировкой сессии дописывается в собираемый
+# файл. После обрыва клиент узнаёт смещение (UploadSession.received) и
+# продолжает с него. Готовые файлы переносятся на место вложений без
+# копирования (жёсткой ссылкой), поэтому каталог сессий должен быть на том же
+# диске, что и MEDIA_ROOT, а хранилище файлов — локальным.
+# Открытые загрузки пользователя ограничены числом и суммарным размером
+# (UPLOAD_MAX_SESSIONS_PER_USER, UPLOAD_MAX_STAGED_BYTES_PER_USER).
+
+_READ_BLOCK = 64 * 1024
+
+
+class UploadError(Exception):
+    """Ошибка загрузки; status — код ответа, offset — смещение для продолжения"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def part_path(session):
+    return Path(settings.UPLOAD_SESSION_DIR) / f'{session.pk}.part'
+
+
+def create(user, project, filename, size):
+    """Открывает сессию загрузки файла в проект"""
+    filename = os.path.basename(str(filename).replace('\\', '/')).strip()[:255]
+    if not filename:
+        raise UploadError('Не указано имя файла')
+    if size <= 0 or size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError('Недопустимый размер файла')
+    with transaction.atomic():
+        # Блокировка пользователя: параллельные открытия не обойдут лимиты
+        User.objects.select_for_update().get(pk=user.pk)
+        staged = UploadSession.objects.filter(user=user).aggregate(count=Count('id'), size=Sum('size'))
+        if staged['count'] >= settings.UPLOAD_MAX_SESSIONS_PER_USER:
+            raise UploadError('Слишком много незавершённых загрузок', status=429)
+        if (staged['size'] or 0) + size > settings.UPLOAD_MAX_STAGED_BYTES_PER_USER:
+            raise UploadError('Превышен общий размер незавершённых загрузок', status=413)
+        session = UploadSession.objects.create(project=project, user=user, filename=filename, size=size)
+    path = part_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return session
+
+
+def write_chunk(user, session_id, offset, checksum, stream, length):
+    """Дописывает часть файла; возвращает обновлённую сессию"""
+    if length <= 0 or length > settings.UPLOAD_CHUNK_SIZE:
+        raise UploadError('Недопустимый размер части')
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_CHUNK_SIZE) as buffer:
+        remaining = length
+        while remaining:
+            block = stream.read(min(_READ_BLOCK, remaining))
+            if not block:
+                raise UploadError('Часть получена не полностью')
+            digest.update(block)
+            buffer.write(block)
+            remaining -= len(block)
+        if digest.hexdigest() != checksum.lower():
+            raise UploadError('Контрольная сумма части не совпала')
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().filter(pk=session_id, user=user).first()
+            if session is None:
+                raise UploadError('Загрузка не найдена', status=404)
+            if offset != session.received:
+                # Повтор уже записанной части или пропуск: клиент продолжит с received
+                raise UploadError('Смещение части не совпадает', status=409, offset=session.received)
+            if offset + length > session.size:
+                raise UploadError('Часть выходит за размер файла')
+            buffer.seek(0)
+            with open(part_path(session), 'r+b') as part:
+                # Хвост после received — остаток прерванной записи, его перезаписываем
+                part.seek(offset)
+                part.truncate()
+                shutil.copyfileobj(buffer, part)
+            session.received = offset + length
+            session.save(update_fields=['received', 'updated_at'])
+    return session
+
+
+def attach(user, project, session_ids):
+    """
+    Превращает завершённые загрузки во вложения проекта.
+    Вызывается внутри transaction.atomic(): файлы переносятся на место
+    вложений только после фиксации, при откате загрузки остаются как были.
+    """
+    session_ids = set(session_ids)
+    sessions = list(UploadSession.objects.select_for_update().filter(pk__in=session_ids, user=user,
+                                                                     project=project))
+    if len(sessions) != len(session_ids) or not all(session.is_complete for session in sessions):
+        raise UploadError('Загрузка файлов не завершена')
+    field = ProjectAttachment._meta.get_field('file')
+    storage = field.storage
+    attachments, moves = [], []
+    for session in sessions:
+        attachment = ProjectAttachment(project=project, uploaded_by=user)
+        # Имя предварительное: окончательно оно занимается при переносе файла
+        attachment.file.name = storage.get_available_name(field.generate_filename(attachment, session.filename))
+        attachments.append(attachment)
+        moves.append((attachment, part_path(session)))
+    ProjectAttachment.objects.bulk_create(attachments)
+    # Перенос регистрируется раньше удаления сессий: их файлы удаляются после него
+    transaction.on_commit(lambda: _move_parts(storage, moves))
+    for session in sessions:
+        session.delete()
+    return attachments
+
+
+def _move_parts(storage, moves):
+    for attachment, source in moves:
+        name = attachment.file.name
+        target = Path(storage.path(name))
+        target.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                # Ссылка создаётся только под свободным именем: файл, успевший
+                # занять его после выбора (другая отправка, сохранение через
+                # хранилище), не перезаписывается
+                os.link(source, target)
+                break
+            except FileExistsError:
+                name = storage.get_available_name(storage.get_alternative_name(*os.path.splitext(name)))
+                target = Path(storage.path(name))
+        source.unlink()
+        if name != attachment.file.name:
+            attachment.file.name = name
+            ProjectAttachment.objects.filter(pk=attachment.pk).update(file=name)
+
+
+def purge(max_age, now=None):
+    """Удаляет брошенные загрузки без новых частей дольше max_age; возвращает их число"""
+    cutoff = (now or timezone.now()) - max_age
+    count, _ = UploadSession.objects.filter(updated_at__lt=cutoff).delete()
+    return count
+
+
+# Обработчики сигналов
+
+def session_deleted(sender, instance, **kwargs):
+    # Собираемый файл удаляется вместе с сессией (в том числе с проектом),
+    # но только после фиксации: при откате сессия и файл остаются
+    path = part_path(instance)
+    transaction.on_commit(lambda: path.unlink(missing_ok=True))
@@ -19,12 +19,18 @@ urlpatterns = [
     path('task/<int:id>/submit/', views.change_task_status, name='task_submit'),
     path('timer/start/', views.project_timer_start, name='project_timer_start'),
     path('timer/stop/', views.project_timer_stop, name='project_timer_stop'),
+    path('timer/heartbeat/', views.project_timer_heartbeat, name='project_timer_heartbeat'),
+    path('timer/sync/', views.project_timer_sync, name='project_timer_sync'),
     path('timer/stop_all/', views.stop_all_timers_on_close, name='stop_all_timers_on_close'),
     # Project review workflow
     path('projects/review/', views.ProjectReviewQueueView.as_view(), name='project_review_queue'),
     path('project/<int:pk>/submit_review/', views.project_submit_review, name='project_submit_review'),
+    path('project/<int:pk>/uploads/', views.project_upload_create, name='project_upload_create'),
+    path('uploads/<int:upload_id>/', views.project_upload, name='project_upload'),
     path('project/<int:pk>/attachment/<int:attachment_id>/', views.project_attachment_download, name='project_attachment_download'),
     path('project/<int:pk>/review/approve/', views.project_review_approve, name='project_review_approve'),
     path('project/<int:pk>/review/reject/', views.project_review_reject, name='project_review_reject'),
     path('projects/review/count/', views.project_review_count, name='project_review_count'),
+    path('live/', views.live_events, name='live_events'),
+    path('live/state/', views.live_events_state, name='live_events_state'),
 ]
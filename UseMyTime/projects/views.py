@@ -1,17 +1,25 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, HttpResponse, HttpResponseRedirect, get_object_or_404
-from django.http import FileResponse
+from django.http import StreamingHttpResponse
 from django.http import JsonResponse
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.views.decorators.http import require_GET
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import UpdateView, CreateView, DeleteView, ListView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import Q
-from .models import Project, ActiveProject, Task, ProjectTimer, TimeEntry, TaskAttachment, ProjectAttachment
+from django.db import IntegrityError, connection, transaction
+from .models import Project, Task, ProjectTimer, TaskAttachment, ProjectAttachment, UploadSession
+from . import bus, downloads, timers, uploads
+from .pagination import KeysetPaginationMixin
+from accounts import navigation, visibility
 
 # Создание проекта
 class ProjectCreateView(LoginRequiredMixin, CreateView):
@@ -58,57 +66,45 @@ class ProjectDeleteView(LoginRequiredMixin, DeleteView):
         return super().get_queryset().filter(user=self.request.user)
 
 # Получение архива проектов
-class ProjectListView(LoginRequiredMixin, ListView):
+class ProjectListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'projects/list.html'
     model = Project
     def get_queryset(self):
         return super().get_queryset().filter(user=self.request.user).filter(is_archived=False)
 
-class ArchiveProjectListView(LoginRequiredMixin, ListView):
+class ArchiveProjectListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'projects/archive.html'
     model = Project
     def get_queryset(self):
         return super().get_queryset().filter(user=self.request.user).filter(is_archived=True)
 
 # Просмотр задач пользователя
-class MyTasksView(LoginRequiredMixin, ListView):
+class MyTasksView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'workflow/my_tasks.html'
     model = Task
     context_object_name = 'object_list'
     
     def get_queryset(self):
-        return Task.objects.filter(project__user=self.request.user).order_by('-created_at')
+        return Task.objects.filter(project__user=self.request.user).select_related('project')
 
 # Получение конкретного проекта
 class ProjectDetailView(LoginRequiredMixin, DetailView):
     template_name = 'projects/detail.html'
     model = Project
     def get_queryset(self):
-        qs = super().get_queryset()
-        # Расширяем доступ для руководителей
-        role = getattr(getattr(self.request.user, 'profile', None), 'role', None)
-        if role == 'director':
-            return qs
-        if role in ['manager', 'sector_manager']:
-            try:
-                from accounts.models import Profile
-                my_profile = self.request.user.profile
-                subs = Profile.objects.filter(manager=my_profile).values_list('user_id', flat=True)
-                return qs.filter(Q(user=self.request.user) | Q(user_id__in=list(subs)))
-            except Exception:
-                return qs.filter(user=self.request.user)
-        # Сотрудник видит только свои проекты
-        return qs.filter(user=self.request.user)
+        # Свои проекты, проекты подчинённых (для руководителей) или все (директор)
+        return visibility.scope(self.request.user).filter(super().get_queryset())
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         project = self.object
-        timer = ProjectTimer.objects.filter(user=self.request.user, project=project).first()
+        timer = timers.state(self.request.user).get(project.id)
         context['project_timer'] = timer
         if timer and timer.last_started_at:
             context['timer_started_at_epoch'] = int(timer.last_started_at.timestamp())
         else:
             context['timer_started_at_epoch'] = None
         context['timer_in_work'] = bool(timer and timer.in_work)
+        context['is_active_project'] = bool(timer and timer.is_active)
         # base total seconds of project from DB (without currently running increment)
         context['project_total_seconds'] = int(project.total_time.total_seconds())
         # precompute flags for template logic
@@ -116,71 +112,51 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
         context['all_tasks_done'] = not tasks_incomplete
         # Разрешаем отправку только если все задачи завершены и проект не принят и не в проверке
         context['can_submit_review'] = (not tasks_incomplete) and (project.review_status in ['none', 'rejected'])
+        # Принять/вернуть проект может только непосредственный руководитель владельца
+        context['can_review'] = visibility.scope(self.request.user).is_direct_manager(project.user_id)
+        context['upload_chunk_size'] = settings.UPLOAD_CHUNK_SIZE
         return context
 
 # Активация проекта
 @require_POST
 @login_required
 def project_activate(request):
-    active_project, _ = ActiveProject.objects.get_or_create(user=request.user)
     project_id = request.POST.get('project_id')
     try:
         project = Project.objects.get(id=project_id, user=request.user)
-    except Project.DoesNotExist:
+    except (Project.DoesNotExist, ValueError, TypeError):
         return JsonResponse({'error': 'Проект не найден'})
     # Запрет активации, если проект на проверке или уже принят
     if project.review_status in ['in_review', 'approved']:
         messages.error(request, 'Нельзя активировать проект: он на проверке или уже принят')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': project_id}))
-    active_project.project = project
-    active_project.save()
-    
-    # Также создаем ProjectTimer для нового механизма
-    timer, _ = ProjectTimer.objects.get_or_create(user=request.user, project=project)
-    
+    timers.activate(request.user, project)
     return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': project_id}))
 
-# Запуска активного проекта
+# Запуск активного проекта
 @require_POST
 @login_required
 def project_start(request):
-    active_project = ActiveProject.objects.filter(user=request.user).first()
-    if not active_project:
+    timer = ProjectTimer.objects.select_related('project').filter(user=request.user, is_active=True).first()
+    if not timer:
         return JsonResponse({'is_success': False, 
                              'error': 'Нет активного проекта'})
-    if active_project.in_work:
+    if not timers.start(request.user, timer.project):
         return JsonResponse({'is_success': False, 
                              'error': 'Проект уже запущен'})
-    active_project.in_work = True
-    active_project.last_started_at = timezone.now()
-    active_project.save()
     return JsonResponse({'is_success': True})
 
 # Остановка активного проекта
 @require_POST
 @login_required
 def project_stop(request):
-    active_project = ActiveProject.objects.filter(user=request.user).first()
-    if not active_project or not active_project.project:
+    timer = ProjectTimer.objects.select_related('project').filter(user=request.user, is_active=True).first()
+    if not timer:
         return JsonResponse({'is_success': False, 
                              'error': 'Нет активного проекта'})
-    if not active_project.in_work:
+    if timers.stop(request.user, timer.project) is None:
         return JsonResponse({'is_success': False, 
                              'error': 'Проект уже остановлен'})
-    started_at = active_project.last_started_at
-    now = timezone.now()
-    duration = now - started_at
-    active_project.in_work = False
-    active_project.project.total_time += duration
-    active_project.save()
-    active_project.project.save()
-    TimeEntry.objects.create(
-        user=request.user,
-        project=active_project.project,
-        started_at=started_at,
-        ended_at=now,
-        seconds=int(duration.total_seconds())
-    )
     return JsonResponse({'is_success': True})
 
 # Архивация проекта
@@ -190,16 +166,8 @@ def project_stop(request):
 def project_archive(request, id):
     try:
         project = Project.objects.get(id=id, user=request.user)
-        # Проверяем, не является ли проект активным
-        try:
-            active_project = ActiveProject.objects.get(user=request.user)
-            if active_project.project == project:
-                # Сбрасываем активный проект
-                active_project.project = None
-                active_project.in_work = False
-                active_project.save()
-        except ActiveProject.DoesNotExist:
-            pass
+        # Останавливаем таймер проекта и снимаем его с активного
+        timers.release(request.user, project)
 
         project.is_archived = True
         project.save()
@@ -211,90 +179,60 @@ def project_archive(request, id):
 @require_POST
 @login_required
 def change_task_status(request, id):
-    try:
-        with transaction.atomic():
-            task = Task.objects.select_for_update().get(id=id, project__user=request.user)
-    except Task.DoesNotExist:
-        return JsonResponse({'is_success': False, 'error': 'Задача не найдена'})
-
-    # Запрет изменения задач, если проект на проверке или принят
-    if task.project.review_status in ['in_review', 'approved']:
-        return JsonResponse({'is_success': False, 'error': 'Проект на проверке/принят: изменение задач запрещено'})
-
-    # Проверка: должен быть запущен какой-либо таймер пользователя (учитываем оба механизма)
-    # Разрешаем переключаться между проектами или запускать таймер для задачи
-    any_timer = ProjectTimer.objects.filter(user=request.user, in_work=True).first()
-    any_active = ActiveProject.objects.filter(user=request.user, in_work=True).first()
-    
-    if not (any_timer or any_active):
-        return JsonResponse({'is_success': False, 'error': 'Ни один таймер не запущен. Сначала запустите таймер проекта.'})
-
-    # Линейный переход статусов: new -> in_progress -> done
-    if task.status == 'new':
-        task.status = 'in_progress'
-        task.is_done = False
-        # Останавливаем все другие таймеры пользователя и фиксируем время
-        now = timezone.now()
-        running = ProjectTimer.objects.filter(user=request.user, in_work=True)
-        for rt in running:
-            started_at = rt.last_started_at
-            if started_at:
-                duration = now - started_at
-                TimeEntry.objects.create(
-                    user=request.user,
-                    project=rt.project,
-                    task=rt.current_task,
-                    started_at=started_at,
-                    ended_at=now,
-                    seconds=int(duration.total_seconds())
-                )
-            rt.in_work = False
-            rt.current_task = None
-            rt.save(update_fields=['in_work', 'current_task'])
-        # Запускаем таймер по текущему проекту и привязываем к задаче
-        timer, _ = ProjectTimer.objects.get_or_create(user=request.user, project=task.project)
-        if not timer.in_work:
-            timer.start()
-        timer.current_task = task
-        timer.save(update_fields=['current_task'])
-        # Фиксируем момент старта задачи
-        task.started_at = now
-    elif task.status == 'in_progress':
-        # Минимальная длительность 60 секунд, если таймер был запущен
-        timer = ProjectTimer.objects.filter(user=request.user, project=task.project).first()
-        now = timezone.now()
-        base_start = task.started_at or (timer.last_started_at if (timer and timer.in_work and timer.current_task_id == task.id) else None)
-        if base_start:
-            worked = (now - base_start).total_seconds()
-            if worked < 60:
-                return JsonResponse({'is_success': False, 'error': 'Минимальная длительность работы над задачей — 1 минута'})
-        task.status = 'done'
-        task.is_done = True
-        task.completed_at = now
-        # Останавливаем таймер проекта и фиксируем запись времени для этой задачи
-        if timer and timer.in_work and timer.current_task_id == task.id and timer.last_started_at:
-            duration = now - timer.last_started_at
-            TimeEntry.objects.create(
-                user=request.user,
-                project=task.project,
-                task=task,
-                started_at=timer.last_started_at,
-                ended_at=now,
-                seconds=int(duration.total_seconds())
-            )
-            timer.in_work = False
-            timer.current_task = None
-            timer.save(update_fields=['in_work', 'current_task'])
-    else:
-        # done: ничего не делаем (можно расширить логикой отката при необходимости)
+    # Блокировка задачи держится до сохранения: параллельные нажатия не
+    # переводят статус дважды и не запускают/останавливают таймер повторно
+    with transaction.atomic():
+        try:
+            task = Task.objects.select_for_update().select_related('project').get(
+                id=id, project__user=request.user)
+        except Task.DoesNotExist:
+            return JsonResponse({'is_success': False, 'error': 'Задача не найдена'})
+
+        # Запрет изменения задач, если проект на проверке или принят
+        if task.project.review_status in ['in_review', 'approved']:
+            return JsonResponse({'is_success': False, 'error': 'Проект на проверке/принят: изменение задач запрещено'})
+
+        # Проверка: должен быть запущен какой-либо таймер пользователя
+        # Разрешаем переключаться между проектами или запускать таймер для задачи
+        state = timers.state(request.user)
+        if not state.is_running():
+            return JsonResponse({'is_success': False, 'error': 'Ни один таймер не запущен. Сначала запустите таймер проекта.'})
+
+        # Линейный переход статусов: new -> in_progress -> done
+        if task.status == 'new':
+            task.status = 'in_progress'
+            task.is_done = False
+            # Останавливаем все другие таймеры пользователя и фиксируем время
+            now = timezone.now()
+            # Останавливаем другие таймеры и запускаем таймер по текущему проекту с этой задачей
+            timers.switch(request.user, task.project, task, now, current=state)
+            # Фиксируем момент старта задачи
+            task.started_at = now
+        elif task.status == 'in_progress':
+            # Минимальная длительность 60 секунд, если таймер был запущен
+            timer = state.get(task.project_id)
+            now = timezone.now()
+            base_start = task.started_at or (timer.last_started_at if (timer and timer.in_work and timer.current_task_id == task.id) else None)
+            if base_start:
+                worked = (now - base_start).total_seconds()
+                if worked < 60:
+                    return JsonResponse({'is_success': False, 'error': 'Минимальная длительность работы над задачей — 1 минута'})
+            task.status = 'done'
+            task.is_done = True
+            task.completed_at = now
+            # Останавливаем таймер проекта и фиксируем запись времени для этой задачи
+            if timer and timer.in_work and timer.current_task_id == task.id:
+                timers.stop_timers(request.user, [timer], now)
+        else:
+            # done: ничего не делаем (можно расширить логикой отката при необходимости)
+            return JsonResponse({'is_success': True})
+        update_fields = ['status', 'is_done']
+        if task.status == 'done':
+            update_fields.append('completed_at')
+        if task.status == 'in_progress' and task.started_at:
+            update_fields.append('started_at')
+        task.save(update_fields=update_fields)
         return JsonResponse({'is_success': True})
-    update_fields = ['status', 'is_done']
-    if task.status == 'done':
-        update_fields.append('completed_at')
-    if task.status == 'in_progress' and task.started_at:
-        update_fields.append('started_at')
-    task.save(update_fields=update_fields)
-    return JsonResponse({'is_success': True})
 
 # Запуск таймера для конкретного проекта (параллельно с другими)
 @require_POST
@@ -309,10 +247,8 @@ def project_timer_start(request):
     # Запрет старта таймера, если проект на проверке или принят
     if project.review_status in ['in_review', 'approved']:
         return JsonResponse({'is_success': False, 'error': 'Проект на проверке/принят: запуск таймера запрещён'})
-    timer, _ = ProjectTimer.objects.get_or_create(user=request.user, project=project)
-    if timer.in_work:
+    if not timers.start(request.user, project):
         return JsonResponse({'is_success': False, 'error': 'Таймер уже запущен'})
-    timer.start()
     return JsonResponse({'is_success': True})
 
 # Остановка таймера для конкретного проекта
@@ -325,49 +261,61 @@ def project_timer_stop(request):
     except (Project.DoesNotExist, ValueError, TypeError):
         return JsonResponse({'is_success': False, 'error': 'Проект не найден'})
 
-    timer = ProjectTimer.objects.filter(user=request.user, project=project).first()
-    if not timer or not timer.in_work:
+    # Общее время проекта и запись времени обновляются при остановке
+    duration = timers.stop(request.user, project)
+    if duration is None:
         return JsonResponse({'is_success': False, 'error': 'Таймер не запущен'})
-
-    started_at = timer.last_started_at
-    duration = timer.stop()
-    # Обновляем общее время проекта
-    project.total_time += duration
-    project.save()
-    TimeEntry.objects.create(
-        user=request.user,
-        project=project,
-        started_at=started_at,
-        ended_at=timezone.now(),
-        seconds=int(duration.total_seconds())
-    )
     return JsonResponse({'is_success': True, 'seconds': int(duration.total_seconds())})
 
+# Сигнал открытой страницы с запущенным таймером (без запросов к базе)
+@require_POST
+@login_required
+def project_timer_heartbeat(request):
+    timers.heartbeat(request.user)
+    return HttpResponse(status=204)
+
+# Синхронизация таймера пакетом событий (в том числе накопленных без сети)
+# Тело — JSON {"sent_at": мс, "events": [{"id", "kind", "project_id", "task_id", "at": мс}]},
+# время по часам браузера. Ответ — результат по каждому событию.
+@require_POST
+@login_required
+def project_timer_sync(request):
+    try:
+        payload = json.loads(request.body)
+        skew = timezone.now() - timers.from_epoch_ms(payload['sent_at'])
+        events = [
+            {
+                'id': str(event['id'])[:64],
+                'kind': event['kind'],
+                'project_id': int(event['project_id']),
+                'task_id': int(event['task_id']) if event.get('task_id') else None,
+                'at': timers.from_epoch_ms(event['at']) + skew,
+            }
+            for event in payload['events']
+        ]
+    except (ValueError, KeyError, TypeError, OverflowError):
+        return JsonResponse({'is_success': False, 'error': 'Некорректный пакет событий'}, status=400)
+    if len(events) > settings.TIMER_SYNC_MAX_EVENTS:
+        return JsonResponse({'is_success': False, 'error': 'Слишком много событий в пакете'}, status=400)
+    try:
+        results = timers.sync(request.user, events)
+    except IntegrityError:
+        # Тот же пакет пришёл параллельно (повтор запроса)
+        return JsonResponse({'is_success': False, 'error': 'Пакет уже обрабатывается, повторите синхронизацию'}, status=409)
+    return JsonResponse({'is_success': True, 'results': results})
+
 # Project-level review workflow
-class ProjectReviewQueueView(LoginRequiredMixin, ListView):
+class ProjectReviewQueueView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'workflow/project_review_queue.html'
     model = Project
     def get_queryset(self):
-        role = getattr(getattr(self.request.user, 'profile', None), 'role', None)
-        if role not in ['manager', 'sector_manager', 'director']:
-            return self.model.objects.none()
-        if role == 'director':
-            # Директор видит проекты своих непосредственных подчиненных
-            from accounts.models import Profile
-            try:
-                my_profile = self.request.user.profile
-                subordinate_users = Profile.objects.filter(manager=my_profile).values_list('user_id', flat=True)
-                return super().get_queryset().filter(user_id__in=subordinate_users, review_status='in_review')
-            except Exception:
-                return self.model.objects.none()
-        # руководитель видит проекты подчиненных
-        from accounts.models import Profile
-        try:
-            my_profile = self.request.user.profile
-            subordinate_users = Profile.objects.filter(manager=my_profile).values_list('user_id', flat=True)
-            return super().get_queryset().filter(user_id__in=subordinate_users, review_status='in_review')
-        except Exception:
+        scope = visibility.scope(self.request.user)
+        if scope.role not in ['manager', 'sector_manager', 'director']:
             return self.model.objects.none()
+        # Руководитель и директор видят проекты своих непосредственных подчиненных
+        return super().get_queryset().filter(
+            user_id__in=list(scope.direct_ids), review_status='in_review'
+        ).select_related('review_submitted_by')
 
 @require_POST
 @login_required
@@ -382,59 +330,110 @@ def project_submit_review(request, pk):
         messages.error(request, 'Нельзя отправить на проверку: не все задачи завершены')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     # Нельзя отправить, если запущены таймеры по проекту
-    ptimer = ProjectTimer.objects.filter(user=request.user, project=project, in_work=True).exists()
-    atimer = ActiveProject.objects.filter(user=request.user, project=project, in_work=True).exists()
-    if ptimer or atimer:
+    if timers.state(request.user).is_running(project.id):
         messages.error(request, 'Остановите таймер по этому проекту перед отправкой на проверку')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     # Валидация: нужен комментарий или хотя бы один файл
     submit_comment = request.POST.get('submit_comment', '').strip()
     files = request.FILES.getlist('files')
-    if not submit_comment and not files:
+    # Файлы, заранее загруженные частями (project_upload_create / project_upload)
+    try:
+        upload_ids = [int(upload_id) for upload_id in request.POST.getlist('upload_ids')]
+    except ValueError:
+        upload_ids = None
+    if upload_ids is None:
+        messages.error(request, 'Некорректный список загруженных файлов')
+        return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
+    if not submit_comment and not files and not upload_ids:
         messages.error(request, 'Нужно добавить комментарий или хотя бы один файл для отправки на проверку')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
-    if submit_comment:
-        project.submit_comment = submit_comment
-    for f in files:
-        ProjectAttachment.objects.create(project=project, file=f, uploaded_by=request.user)
-
-    project.review_status = 'in_review'
-    project.review_submitted_by = request.user
-    project.review_submitted_at = timezone.now()
-    project.save(update_fields=['review_status', 'review_submitted_by', 'review_submitted_at', 'submit_comment'])
+    # Вложения и смена статуса — одной транзакцией: при сбое загрузки частями
+    # остаются нетронутыми, и отправку можно повторить
+    try:
+        with transaction.atomic():
+            uploads.attach(request.user, project, upload_ids)
+            if submit_comment:
+                project.submit_comment = submit_comment
+            for f in files:
+                ProjectAttachment.objects.create(project=project, file=f, uploaded_by=request.user)
+
+            project.review_status = 'in_review'
+            project.review_submitted_by = request.user
+            project.review_submitted_at = timezone.now()
+            project.save(update_fields=['review_status', 'review_submitted_by', 'review_submitted_at',
+                                        'submit_comment'])
+    except uploads.UploadError as error:
+        messages.error(request, str(error))
+        return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     messages.success(request, 'Проект отправлен на проверку')
     return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
 
+# Загрузка вложений частями (возобновляемая), см. projects.uploads
+# Открытие загрузки: тело — JSON {"filename", "size"}; ответ — id загрузки,
+# адрес для частей, размер части и смещение, с которого слать данные
+@require_POST
+@login_required
+def project_upload_create(request, pk):
+    project = Project.objects.filter(pk=pk, user=request.user).first()
+    if project is None:
+        return JsonResponse({'is_success': False, 'error': 'Проект не найден'}, status=404)
+    if project.review_status not in ['none', 'rejected']:
+        return JsonResponse({'is_success': False, 'error': 'Проект уже на проверке или принят'}, status=400)
+    try:
+        payload = json.loads(request.body)
+        session = uploads.create(request.user, project, payload['filename'], int(payload['size']))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'is_success': False, 'error': 'Некорректный запрос'}, status=400)
+    except uploads.UploadError as error:
+        return JsonResponse({'is_success': False, 'error': str(error)}, status=error.status)
+    return JsonResponse({
+        'is_success': True,
+        'id': session.pk,
+        'url': reverse('project_upload', kwargs={'upload_id': session.pk}),
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        'offset': session.received,
+    }, status=201)
+
+# Состояние загрузки (GET — смещение для продолжения) и приём части (POST):
+# тело — байты части, заголовки X-Upload-Offset (смещение) и X-Chunk-Sha256
+@login_required
+def project_upload(request, upload_id):
+    if request.method == 'GET':
+        session = UploadSession.objects.filter(pk=upload_id, user=request.user).first()
+        if session is None:
+            return JsonResponse({'is_success': False, 'error': 'Загрузка не найдена'}, status=404)
+        return JsonResponse({'is_success': True, 'offset': session.received, 'size': session.size,
+                             'complete': session.is_complete})
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+    try:
+        offset = int(request.headers['X-Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+        checksum = request.headers['X-Chunk-Sha256']
+    except (KeyError, ValueError):
+        return JsonResponse({'is_success': False, 'error': 'Нет смещения, размера или контрольной суммы части'}, status=400)
+    try:
+        session = uploads.write_chunk(request.user, upload_id, offset, checksum, request, length)
+    except uploads.UploadError as error:
+        return JsonResponse({'is_success': False, 'error': str(error), 'offset': error.offset}, status=error.status)
+    return JsonResponse({'is_success': True, 'offset': session.received, 'complete': session.is_complete})
+
 # Защищенная выдача вложений проекта с проверкой прав
+# Сам файл отдаёт прокси или Django с поддержкой докачки (projects.downloads)
 @login_required
 def project_attachment_download(request, pk, attachment_id):
-    project = get_object_or_404(Project, pk=pk)
-    attachment = get_object_or_404(ProjectAttachment, pk=attachment_id, project=project)
-    # Доступ: владелец проекта, его непосредственный руководитель (manager/sector_manager), директор, суперпользователь
-    if request.user.is_superuser or project.user_id == request.user.id:
-        pass
-    else:
-        role = getattr(getattr(request.user, 'profile', None), 'role', None)
-        try:
-            owner_manager_id = project.user.profile.manager_id
-        except Exception:
-            owner_manager_id = None
-        allowed = (
-            (role in ['manager', 'sector_manager'] and owner_manager_id == getattr(request.user, 'profile', None).id) or
-            role == 'director'
-        )
-        if not allowed:
-            messages.error(request, 'Нет доступа к файлу')
-            return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
-    file_handle = attachment.file.open('rb')
-    response = FileResponse(file_handle, as_attachment=True, filename=attachment.file.name.split('/')[-1])
-    return response
+    attachment = get_object_or_404(ProjectAttachment.objects.select_related('project'), pk=attachment_id, project_id=pk)
+    # Доступ: все, кому виден проект (владелец, его руководители, директор, суперпользователь)
+    if not visibility.scope(request.user).can_view(attachment.project.user_id):
+        messages.error(request, 'Нет доступа к файлу')
+        return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
+    return downloads.serve(request, attachment.file, attachment.file.name.split('/')[-1])
 
 @require_POST
 @login_required
 def project_review_approve(request, pk):
-    role = getattr(getattr(request.user, 'profile', None), 'role', None)
-    if role not in ['manager', 'sector_manager']:
+    scope = visibility.scope(request.user)
+    if scope.role not in visibility.MANAGER_ROLES:
         messages.error(request, 'Нет прав')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     try:
@@ -442,19 +441,12 @@ def project_review_approve(request, pk):
     except Project.DoesNotExist:
         messages.error(request, 'Проект не найден')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
-    # Дополнительные проверки подчиненности и самоутверждения
-    try:
-        reviewer_profile = request.user.profile
-        owner_profile = project.user.profile
-    except Exception:
-        messages.error(request, 'Нет прав')
-        return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     # Запрет самоутверждения
     if project.user_id == request.user.id:
         messages.error(request, 'Нельзя принимать собственный проект')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     # Разрешения по ролям: менеджер/начальник сектора может только своих подчиненных
-    if owner_profile.manager_id != reviewer_profile.id:
+    if not scope.is_direct_manager(project.user_id):
         messages.error(request, 'Можно принимать только проекты подчиненных')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     project.review_status = 'approved'
@@ -468,8 +460,8 @@ def project_review_approve(request, pk):
 @require_POST
 @login_required
 def project_review_reject(request, pk):
-    role = getattr(getattr(request.user, 'profile', None), 'role', None)
-    if role not in ['manager', 'sector_manager']:
+    scope = visibility.scope(request.user)
+    if scope.role not in visibility.MANAGER_ROLES:
         messages.error(request, 'Нет прав')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     try:
@@ -478,16 +470,10 @@ def project_review_reject(request, pk):
         messages.error(request, 'Проект не найден')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     # Дополнительные проверки подчиненности и самоутверждения
-    try:
-        reviewer_profile = request.user.profile
-        owner_profile = project.user.profile
-    except Exception:
-        messages.error(request, 'Нет прав')
-        return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     if project.user_id == request.user.id:
         messages.error(request, 'Нельзя возвращать собственный проект')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
-    if owner_profile.manager_id != reviewer_profile.id:
+    if not scope.is_direct_manager(project.user_id):
         messages.error(request, 'Можно возвращать только проекты подчиненных')
         return HttpResponseRedirect(reverse_lazy('project_detail', kwargs={'pk': pk}))
     comment = request.POST.get('review_comment', '').strip()
@@ -502,28 +488,70 @@ def project_review_reject(request, pk):
 @require_GET
 @login_required
 def project_review_count(request):
-    role = getattr(getattr(request.user, 'profile', None), 'role', None)
-    if role not in ['manager', 'sector_manager', 'director']:
+    scope = visibility.scope(request.user)
+    if scope.role not in ['manager', 'sector_manager', 'director']:
         return JsonResponse({'count': 0})
-    if role == 'director':
-        # Директор видит проекты своих непосредственных подчиненных
-        from accounts.models import Profile
-        try:
-            my_profile = request.user.profile
-            subordinate_users = Profile.objects.filter(manager=my_profile).values_list('user_id', flat=True)
-            count = Project.objects.filter(user_id__in=subordinate_users, review_status='in_review').count()
-        except Exception:
-            count = 0
-    else:
-        from accounts.models import Profile
-        try:
-            my_profile = request.user.profile
-            subordinate_users = Profile.objects.filter(manager=my_profile).values_list('user_id', flat=True)
-            count = Project.objects.filter(user_id__in=subordinate_users, review_status='in_review').count()
-        except Exception:
-            count = 0
+    # Проекты непосредственных подчиненных
+    count = Project.objects.filter(user_id__in=list(scope.direct_ids), review_status='in_review').count()
     return JsonResponse({'count': count})
 
+# Поток событий (SSE) для шапки: очередь проверки и состояние таймера
+# Заменяет периодический опрос project_review_count. Поток только оповещает:
+# при подключении отправляет состояние (event: state), затем по событию из шины
+# (projects.bus) — event: changed, и страница забирает новое состояние обычным
+# запросом live_events_state. Пока вкладка открыта, поток ждёт на asyncio.Event
+# без обращений к базе: ни рабочего потока, ни соединения с базой он не занимает.
+# Работает только под ASGI (asgi.py): под WSGI возвращается 204, и страница
+# переходит на опрос.
+async def live_events(request):
+    user = await request.auser()
+    if not user.is_authenticated or not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_live_event_stream(user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _live_initial_state(user):
+    state = navigation.live_state(user)
+    # Дальше поток базу не читает: соединение освобождается до начала передачи
+    # (кроме соединения внутри транзакции — в тестах)
+    if not connection.in_atomic_block:
+        connection.close()
+    return state
+
+
+async def _live_event_stream(user):
+    loop = asyncio.get_running_loop()
+    # Соединение периодически закрывается, браузер переподключается сам
+    closes_at = loop.time() + settings.LIVE_EVENTS_MAX_AGE
+    watched = await sync_to_async(navigation.watched_users)(user)
+    # Изменения своих данных и данных подчинённых из шины событий; подписка до
+    # чтения состояния, чтобы изменение между ними не потерялось
+    subscription = bus.AsyncSubscription(lambda event: event['user'] in watched)
+    try:
+        state = await sync_to_async(_live_initial_state)(user)
+        yield f'retry: {settings.LIVE_EVENTS_RETRY_MS}\n\n'
+        yield f'event: state\ndata: {json.dumps(state)}\n\n'
+        while True:
+            remaining = closes_at - loop.time()
+            if remaining <= 0:
+                return
+            if await subscription.wait(min(settings.LIVE_EVENTS_HEARTBEAT, remaining)):
+                # События, пришедшие до отправки, сливаются в одно оповещение
+                yield 'event: changed\ndata: {}\n\n'
+            else:
+                yield ': ping\n\n'
+    finally:
+        subscription.close()
+
+# Состояние шапки по оповещению потока событий
+@login_required
+def live_events_state(request):
+    return JsonResponse(navigation.live_state(request.user))
+
 @require_POST
 @login_required
 def stop_all_timers_on_close(request):
@@ -531,46 +559,7 @@ def stop_all_timers_on_close(request):
     Stops all running timers for the current user when the application is closed.
     This view is called automatically via JavaScript beforeunload event.
     """
-    now = timezone.now()
-    
-    # Stop ActiveProject timer if running
-    active_project = ActiveProject.objects.filter(user=request.user, in_work=True).first()
-    if active_project and active_project.project and active_project.last_started_at:
-        duration = now - active_project.last_started_at
-        active_project.in_work = False
-        active_project.project.total_time += duration
-        active_project.save()
-        active_project.project.save()
-        
-        # Create TimeEntry for the session
-        TimeEntry.objects.create(
-            user=request.user,
-            project=active_project.project,
-            started_at=active_project.last_started_at,
-            ended_at=now,
-            seconds=int(duration.total_seconds())
-        )
-    
-    # Stop all ProjectTimer instances that are running
-    running_timers = ProjectTimer.objects.filter(user=request.user, in_work=True)
-    for timer in running_timers:
-        if timer.last_started_at:
-            duration = now - timer.last_started_at
-            timer.in_work = False
-            timer.save()
-            
-            # Update project total time
-            timer.project.total_time += duration
-            timer.project.save()
-            
-            # Create TimeEntry for the session
-            TimeEntry.objects.create(
-                user=request.user,
-                project=timer.project,
-                task=timer.current_task,
-                started_at=timer.last_started_at,
-                ended_at=now,
-                seconds=int(duration.total_seconds())
-            )
-    
-    return JsonResponse({'is_success': True, 'stopped_timers': running_timers.count() + (1 if active_project else 0)})
\ No newline at end of file
+    # Only appends stop events to the timer log (one insert); TimeEntry rows and
+    # project totals are written when the log is compacted (TIMER_COMPACTION)
+    stopped = timers.stop_all(request.user)
+    return JsonResponse({'is_success': True, 'stopped_timers': stopped})
@@ -97,6 +97,89 @@ else:
 #     }
 # }
 
+# Кэш общий для веб-процессов и обработчика отчётов (process_report_jobs),
+# поэтому по умолчанию файловый, а не в памяти процесса.
+# Кроме готовых отчётов в нём лежат бессрочные версии данных отчётов, области
+# видимости, навигация и сигналы таймеров. При вытеснении они заводятся заново
+# (лишний промах, а не ошибка), но частое вытеснение сводит кэш на нет,
+# поэтому лимит записей (CACHE_MAX_ENTRIES) большой, а не стандартные 300.
+# Файловый кэш при каждой записи пересчитывает файлы каталога, поэтому для
+# рабочего развёртывания рекомендуется Redis (нужен пакет redis):
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://127.0.0.1:6379/1 (лимит записей задаёт сам Redis)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    }
+}
+if CACHES['default']['BACKEND'].endswith(('FileBasedCache', 'LocMemCache', 'DatabaseCache')):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '100000')),
+        # При переполнении удаляется 1/10 записей, а не треть
+        'CULL_FREQUENCY': 10,
+    }
+
+# Время жизни закэшированных отчётов (HTML/PDF), сек.
+REPORT_CACHE_TIMEOUT = int(os.getenv('REPORT_CACHE_TIMEOUT', '3600'))
+
+# Время жизни закэшированных данных навигации (счётчики, активный таймер), сек.
+NAVIGATION_CACHE_TIMEOUT = int(os.getenv('NAVIGATION_CACHE_TIMEOUT', '300'))
+
+# Время жизни закэшированных областей видимости (чьи проекты и отчёты видит
+# пользователь), сек. Изменения профилей сбрасывают кэш сразу
+VISIBILITY_CACHE_TIMEOUT = int(os.getenv('VISIBILITY_CACHE_TIMEOUT', '3600'))
+
+# Поток событий для шапки (SSE, только под ASGI): пинг для прокси,
+# время жизни соединения (сек.) и пауза перед переподключением (мс)
+LIVE_EVENTS_HEARTBEAT = float(os.getenv('LIVE_EVENTS_HEARTBEAT', '20'))
+LIVE_EVENTS_MAX_AGE = float(os.getenv('LIVE_EVENTS_MAX_AGE', '300'))
+LIVE_EVENTS_RETRY_MS = int(os.getenv('LIVE_EVENTS_RETRY_MS', '5000'))
+
+# Шина изменений между процессами: auto — LISTEN/NOTIFY на PostgreSQL,
+# иначе только в пределах процесса (memory)
+EVENT_BUS_BACKEND = os.getenv('EVENT_BUS_BACKEND', 'auto')
+EVENT_BUS_CHANNEL = os.getenv('EVENT_BUS_CHANNEL', 'usemytime_changes')
+
+# Сжатие журнала таймеров (TimerEvent) в записи времени и общее время проектов:
+# worker — только отдельным процессом compact_timer_events (запросы лишь
+# добавляют события); режим для развёртываний с этим процессом (Procfile).
+# inline — сразу после запроса в том же веб-процессе: только для разработки
+# (runserver) и развёртываний из одного веб-процесса без compact_timer_events
+# (start.sh, render.yaml); под нагрузкой запросы сжимают журнал одновременно
+TIMER_COMPACTION = os.getenv('TIMER_COMPACTION', 'inline')
+
+# Через сколько часов работы таймер считается забытым (команда reap_timers);
+# отрезок записывается длиной не больше порога
+TIMER_REAP_AFTER_HOURS = float(os.getenv('TIMER_REAP_AFTER_HOURS', '10'))
+
+# Сигналы открытой страницы с таймером: перенос из кэша в базу не чаще раза
+# за интервал (сек.), срок хранения в кэше (сек.) и молчание, после которого
+# reap_timers останавливает таймер (мин.)
+TIMER_HEARTBEAT_FLUSH_INTERVAL = int(os.getenv('TIMER_HEARTBEAT_FLUSH_INTERVAL', '60'))
+TIMER_HEARTBEAT_CACHE_TIMEOUT = int(os.getenv('TIMER_HEARTBEAT_CACHE_TIMEOUT', '86400'))
+TIMER_HEARTBEAT_TIMEOUT_MINUTES = float(os.getenv('TIMER_HEARTBEAT_TIMEOUT_MINUTES', '15'))
+
+# Синхронизация таймера пакетом: не больше событий за запрос, предельный
+# возраст события (сек.) и допуск «из будущего» после поправки часов (сек.)
+TIMER_SYNC_MAX_EVENTS = int(os.getenv('TIMER_SYNC_MAX_EVENTS', '200'))
+TIMER_SYNC_MAX_AGE = int(os.getenv('TIMER_SYNC_MAX_AGE', '86400'))
+TIMER_SYNC_TOLERANCE = int(os.getenv('TIMER_SYNC_TOLERANCE', '5'))
+
+# Число процессов для параллельного рендеринга отчёта по компании (по отделам).
+# 0 или 1 — весь отчёт рендерится одним документом
+REPORT_PDF_WORKERS = int(os.getenv('REPORT_PDF_WORKERS', '0'))
+
+# Задание на PDF, которое формируется дольше REPORT_JOB_LEASE_MINUTES (обработчик
+# упал или завис), возвращается в очередь; после REPORT_JOB_MAX_ATTEMPTS
+# попыток — помечается ошибкой
+REPORT_JOB_LEASE_MINUTES = float(os.getenv('REPORT_JOB_LEASE_MINUTES', '30'))
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv('REPORT_JOB_MAX_ATTEMPTS', '2'))
+
+# Сжатие изображений в PDF-отчётах: качество JPEG и предельное разрешение
+REPORT_PDF_JPEG_QUALITY = int(os.getenv('REPORT_PDF_JPEG_QUALITY', '80'))
+REPORT_PDF_DPI = int(os.getenv('REPORT_PDF_DPI', '150'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -166,4 +249,22 @@ AUTHENTICATION_BACKENDS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Загрузка вложений частями (projects.uploads): каталог собираемых файлов
+# (на том же диске, что и MEDIA_ROOT), размер части и файла, байт, и срок
+# хранения брошенных загрузок, ч (команда purge_upload_sessions).
+# На пользователя — не больше UPLOAD_MAX_SESSIONS_PER_USER незавершённых
+# загрузок общим объёмом до UPLOAD_MAX_STAGED_BYTES_PER_USER байт
+UPLOAD_SESSION_DIR = os.getenv('UPLOAD_SESSION_DIR', str(MEDIA_ROOT / 'upload_sessions'))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(5 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_AGE_HOURS = float(os.getenv('UPLOAD_SESSION_MAX_AGE_HOURS', '48'))
+UPLOAD_MAX_SESSIONS_PER_USER = int(os.getenv('UPLOAD_MAX_SESSIONS_PER_USER', '20'))
+UPLOAD_MAX_STAGED_BYTES_PER_USER = int(os.getenv('UPLOAD_MAX_STAGED_BYTES_PER_USER', str(4 * 1024 * 1024 * 1024)))
+
+# Выдача вложений (projects.downloads): python — Django с Range/ETag,
+# accel — nginx (X-Accel-Redirect на internal location с префиксом
+# ATTACHMENT_ACCEL_PREFIX, указывающий на MEDIA_ROOT), sendfile — X-Sendfile
+ATTACHMENT_DELIVERY = os.getenv('ATTACHMENT_DELIVERY', 'python')
+ATTACHMENT_ACCEL_PREFIX = os.getenv('ATTACHMENT_ACCEL_PREFIX', '/protected-media/')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -3,7 +3,20 @@ from settings import *  # noqa
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "test_db.sqlite3",
+        "NAME": ":memory:",
+        # Тестовая база в файле (не в git, см. .gitignore), а не в памяти: тесты
+        # с параллельными соединениями (потоками) видят одни данные.
+        # IMMEDIATE — блокировка на запись берётся в начале транзакции, и
+        # писатели ждут её до timeout, а не получают «database is locked»
+        # при повышении блокировки
+        "OPTIONS": {"timeout": 20, "transaction_mode": "IMMEDIATE"},
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+    }
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
 }
 
@@ -11,6 +11,9 @@ python UseMyTime/manage.py collectstatic --no-input
 # Apply database migrations
 python UseMyTime/manage.py migrate
 
+# Rebuild hierarchy paths — same as Procfile
+python UseMyTime/manage.py rebuild_profile_paths
+
 # Start gunicorn
 cd UseMyTime
-gunicorn --bind 0.0.0.0:$PORT wsgi:application
+gunicorn --bind 0.0.0.0:$PORT -k gthread --threads 4 wsgi:application